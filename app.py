@@ -1,16 +1,48 @@
-from flask import Flask, request, jsonify, g ,render_template
+import time
+MODULE_LOADED_AT = time.perf_counter()    # worker start-up time is measured from here
+from flask import Flask, request, jsonify, g ,render_template, Response, has_app_context, url_for, send_from_directory
 from flask_cors import CORS
+import click
 import sqlite3
 import hashlib
+import base64
+import csv
+import json
+import threading
+import functools
+import math
+import random
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_left, bisect_right
+import heapq
+from itertools import islice
 import datetime
+import gzip
+import io
+import mimetypes
 import os
+import shutil
+import zlib
+import re
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from google.oauth2 import id_token
-from google.auth.transport import requests as grequests
+try:
+    import orjson
+except ImportError:     # optional, faster JSON encoding when installed
+    orjson = None
+try:
+    import brotli
+except ImportError:     # optional, brotli variants of assets and responses when installed
+    brotli = None
+try:
+    import fcntl
+except ImportError:     # Windows: no lock file, the migrations re-check their version instead
+    fcntl = None
 import traceback
 from dotenv import load_dotenv
+from werkzeug.middleware.proxy_fix import ProxyFix
 load_dotenv()
 
 
@@ -18,103 +50,1751 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# Reverse proxies in front of the app. Only the X-Forwarded-For entries they
+# appended are trusted, so request.remote_addr is the client as the outermost
+# proxy saw it; anything earlier in the header is the client's own claim.
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
+
 # Email configuration
-EMAIL_HOST = 'smtp.gmail.com'
-EMAIL_PORT = 587
-EMAIL_USER = 'lnmiit.hostel@gmail.com'  # Replace with actual email
-EMAIL_PASSWORD = 'your_app_password'    # Replace with actual app password
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'smtp.gmail.com')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 587))
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', '1') == '1'
+EMAIL_USER = os.environ.get('EMAIL_USER', 'lnmiit.hostel@gmail.com')  # Replace with actual email
+EMAIL_PASSWORD = os.environ.get('EMAIL_PASSWORD', 'your_app_password')    # Replace with actual app password
 EMAIL_FROM = 'LNMIIT Girls Hostel <lnmiit.hostel@gmail.com>'
 
+# Outbox delivery
+EMAIL_BATCH_SIZE = 20
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_BASE_SECONDS = 30     # doubled after every failed attempt
+EMAIL_CLAIM_LEASE_SECONDS = 120   # a claimed job is retried if not finished by then
+EMAIL_POLL_INTERVAL = 15
+EMAIL_SMTP_IDLE_TIMEOUT = 60      # close the SMTP session after this long unused
+
+# Google Sign-In configuration
+GOOGLE_CLIENT_ID = "624690583385-s3cnmv6iro5kjjror5oq6t4iulerrcde.apps.googleusercontent.com"
+GOOGLE_CERTS_URL = os.environ.get('GOOGLE_CERTS_URL', 'https://www.googleapis.com/oauth2/v1/certs')
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+GOOGLE_TOKEN_CACHE_SIZE = 1024
+
+# Live updates (Server-Sent Events)
+EVENT_POLL_INTERVAL = 0.5         # how often each process checks for events from other workers
+EVENT_BUFFER_SIZE = 1000          # recent events kept in memory per process
+EVENT_RETENTION = 10000           # events kept in the database for Last-Event-ID resume
+EVENT_HEARTBEAT_SECONDS = 15
+
+# Booking quota policy: at most BOOKING_QUOTA_LIMIT active bookings starting
+# within the next BOOKING_QUOTA_WINDOW_DAYS days
+BOOKING_QUOTA_LIMIT = int(os.environ.get('BOOKING_QUOTA_LIMIT', 1))
+BOOKING_QUOTA_WINDOW_DAYS = int(os.environ.get('BOOKING_QUOTA_WINDOW_DAYS', 10))
+
+# How a machine is picked for bookings made with machine_id "any"; see PLACEMENT_POLICIES
+PLACEMENT_POLICY = os.environ.get('PLACEMENT_POLICY', 'least_loaded')
+
+# Booking list pagination
+BOOKING_PAGE_SIZE = 100
+MAX_BOOKING_PAGE_SIZE = 1000
+STREAM_FETCH_SIZE = 500
+
+# Availability grid
+DEFAULT_SLOT_MINUTES = 30
+MAX_AVAILABILITY_SLOTS = 4096
+# Cached snapshots per worker; the grid adds one per distinct range asked for
+SNAPSHOT_CACHE_SIZE = 256
+
+# Booking lifecycle
+# Lifecycle and email outbox threads; off in workers that only serve /api/events
+BACKGROUND_WORKERS = os.environ.get('BACKGROUND_WORKERS', '1') == '1'
+LIFECYCLE_INTERVAL = 60           # seconds between passes of the lifecycle worker
+LIFECYCLE_BATCH_SIZE = 200        # bookings completed per write transaction
+# Completed/cancelled bookings that started longer ago than this move to bookings_archive
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 31))
+ARCHIVE_BATCH_SIZE = 500
+
+# Utilization rollups. Hours are on the hostel's clock (IST by default);
+# after changing the offset run `flask rebuild-usage`
+USAGE_UTC_OFFSET_MINUTES = int(os.environ.get('USAGE_UTC_OFFSET_MINUTES', 330))
+USAGE_MAX_HOURS = 24 * 7          # a longer booking only counts its first week
+LATE_CANCELLATION_MINUTES = 30    # the notice the confirmation email asks for
+STATS_DEFAULT_DAYS = 28
+STATS_MAX_DAYS = 366
+STATS_PEAK_HOURS = 5
+
+# In-process read model: a catch-up longer than this many events reloads it
+READ_MODEL_REPLAY_LIMIT = 500
+READ_MODEL_CHECK_INTERVAL = 600   # seconds between consistency checks by the lifecycle worker
+
+# Admission control for writes. Token buckets are (refill per second, burst
+# capacity); per-IP limits are generous because a whole hostel shares one NAT
+# address. Reads are not limited: a poll is a version check against a cached
+# snapshot, cheaper than taking a token on the shared admission file.
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', '1') == '1'
+RATE_LIMITS = {
+    'booking_user': (0.2, 5),
+    'booking_ip': (20, 100),
+    'write_ip': (10, 50)
+}
+WRITE_CONCURRENCY = 2             # booking writes admitted at once, across all workers
+WRITE_QUEUE_LIMIT = 64            # waiting beyond this is shed with 429
+WRITE_QUEUE_MAX_WAIT = 2.0        # seconds a request may wait for its turn
+WRITE_QUEUE_POLL = 0.005
+WRITE_TICKET_TTL = 15             # a ticket left behind by a crashed worker expires
+BUCKET_PRUNE_BATCH_SIZE = 500
+
+# Idempotency-Key: responses of keyed writes are kept this long for replays
+IDEMPOTENCY_KEY_TTL = 24 * 3600
+IDEMPOTENCY_CLAIM_SECONDS = 60    # a key claimed by a worker that crashed can be reused after this
+IDEMPOTENCY_PRUNE_BATCH_SIZE = 500
+
+# Most items one admin batch request may carry
+ADMIN_BATCH_LIMIT = 500
+
+# Static assets: `flask build-assets` writes content-hashed, pre-compressed
+# copies of the static files to static/dist, served as immutable for a year
+ASSET_DIR = os.path.join(app.static_folder, 'dist')
+ASSET_MAX_AGE = 365 * 24 * 3600
+COMPRESSIBLE_ASSETS = ('.js', '.css', '.svg', '.html', '.json', '.txt')
+ASSET_IMAGE_MAX_HEIGHT = 180      # the logo is shown 60px high; 3x covers dense screens
+
+# Text responses at least this large are compressed for clients that accept it
+COMPRESS_MIN_BYTES = 1024
+COMPRESSIBLE_MIMETYPES = {
+    'application/json', 'application/vnd.washing-machine.columnar+json',
+    'text/html', 'text/plain', 'text/css', 'application/javascript'
+}
+
+# Metrics
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 0))   # 0 disables the slow-query log
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
 # Database configuration
-DATABASE = 'washing_machine_booking.db'
+DATABASE = os.environ.get('DATABASE', 'washing_machine_booking.db')
+
+# Hostels served by this deployment as comma-separated "id:Name" pairs. Every
+# hostel has its own SQLite shard, so their writers never share a lock. The
+# first hostel is the default and keeps DATABASE as its file.
+HOSTELS = dict(
+    (entry.split(':', 1) + [entry])[:2]
+    for entry in (e.strip() for e in os.environ.get('HOSTELS', 'main:LNMIIT Girls Hostel').split(','))
+    if entry
+)
+for _hostel in HOSTELS:
+    if not re.fullmatch(r'[A-Za-z0-9_-]+', _hostel):
+        raise ValueError(f'Invalid hostel id: {_hostel!r}')
+DEFAULT_HOSTEL = next(iter(HOSTELS))
+
+# How long a statement waits for another worker's write lock. SQLite calls
+# block the whole process under gevent, so gevent workers run with a short one
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+# SQLite tuning applied once to every pooled connection. WAL lets readers
+# run alongside the single writer instead of queueing behind its commit.
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', SQLITE_BUSY_TIMEOUT_MS),
+    ('cache_size', -16000),      # 16 MB page cache
+    ('mmap_size', 268435456),    # 256 MB memory-mapped I/O
+    ('temp_store', 'MEMORY')
+)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+# BEGIN IMMEDIATE waits busy_timeout for the write lock; after that it is
+# retried this many times with jittered backoff before giving up
+WRITE_LOCK_RETRIES = 3
+WRITE_LOCK_BACKOFF_SECONDS = 0.05
+# Compiled statements kept per connection; reused across requests since
+# connections outlive them
+DB_STATEMENT_CACHE_SIZE = 256
+
+class Metrics:
+    """Per-process counters and latency histograms, rendered in Prometheus text format"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> {labels: [bucket counts..., +Inf count, sum]}
+        self._histograms = {}
+        # name -> {labels: value}
+        self._counters = {}
+        self._help = {}
+    
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+    
+    def observe(self, name, labels, seconds):
+        if not METRICS_ENABLED:
+            return
+        i = bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            series = self._histograms.setdefault(name, {}).get(labels)
+            if series is None:
+                series = self._histograms[name][labels] = [0] * (len(LATENCY_BUCKETS) + 2)
+            series[i] += 1
+            series[-1] += seconds
+    
+    def inc(self, name, labels, amount=1):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            counter = self._counters.setdefault(name, {})
+            counter[labels] = counter.get(labels, 0) + amount
+    
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                self._render_help(lines, name)
+                for labels, counts in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{format_labels(labels + (("le", str(bound)),))} {cumulative}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {counts[-1]:.6f}')
+                    lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+            for name, series in sorted(self._counters.items()):
+                self._render_help(lines, name)
+                for labels, value in sorted(series.items()):
+                    lines.append(f'{name}{format_labels(labels)} {value:g}')
+        return '\n'.join(lines) + '\n'
+    
+    def _render_help(self, lines, name):
+        kind, help_text = self._help.get(name, ('untyped', ''))
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+def format_labels(labels):
+    """(('route', '/api/x'), ...) -> {route="/api/x",...}"""
+    if not labels:
+        return ''
+    escaped = (
+        f'{key}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for key, value in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+metrics = Metrics()
+metrics.describe('http_request_duration_seconds', 'histogram', 'Request handling time by route')
+metrics.describe('db_query_duration_seconds', 'histogram', 'SQLite statement execution time')
+metrics.describe('db_rows_returned_total', 'counter', 'Rows fetched by statement')
+metrics.describe('db_lock_wait_seconds', 'histogram', 'Time spent waiting for the SQLite write lock')
+metrics.describe('db_lock_timeouts_total', 'counter', 'Write transactions that gave up waiting for the lock')
+metrics.describe('smtp_send_duration_seconds', 'histogram', 'Time to send one email, by result')
+metrics.describe('google_token_verify_duration_seconds', 'histogram', 'ID token verification time, by cache result')
+metrics.describe('read_model_reloads_total', 'counter', 'Full reloads of the in-process read model')
+metrics.describe('idempotent_replays_total', 'counter', 'Writes answered from a stored Idempotency-Key response')
+metrics.describe('worker_start_seconds', 'histogram', 'Time from loading the app module to serving the first request')
+
+# Normalized SQL text used as the statement label; statements are string
+# literals in this file, so the set of labels stays small
+_statement_labels = {}
+
+def statement_label(sql):
+    label = _statement_labels.get(sql)
+    if label is None:
+        label = _statement_labels[sql] = ' '.join(sql.split())[:120]
+    return label
+
+def record_query(sql, seconds):
+    label = statement_label(sql)
+    metrics.observe('db_query_duration_seconds', (('statement', label),), seconds)
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        print(f"Slow query ({seconds * 1000:.1f} ms): {label}")
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times statements and counts the rows fetched"""
+    
+    def execute(self, sql, parameters=()):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._statement = sql
+            record_query(sql, time.perf_counter() - t0)
+    
+    def executemany(self, sql, seq_of_parameters):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._statement = sql
+            record_query(sql, time.perf_counter() - t0)
+    
+    def _count(self, rows):
+        if rows:
+            metrics.inc('db_rows_returned_total', (('statement', statement_label(self._statement)),), len(rows))
+        return rows
+    
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self._count((row,))
+        return row
+    
+    def fetchmany(self, size=None):
+        return self._count(super().fetchmany(self.arraysize if size is None else size))
+    
+    def fetchall(self):
+        return self._count(super().fetchall())
+
+class PooledConnection(sqlite3.Connection):
+    """Connection handed out by a ConnectionPool; knows which shard it is on
+    and collects the change events of its open write transaction"""
+    database = None
+    published = ()
+
+class InstrumentedConnection(PooledConnection):
+    """Connection whose shortcut execute methods use InstrumentedCursor"""
+    
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+    
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+@app.before_request
+def start_request_timer():
+    g._request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started = getattr(g, '_request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('http_request_duration_seconds', (
+            ('method', request.method),
+            ('route', route),
+            ('status', str(response.status_code))
+        ), time.perf_counter() - started)
+    return response
+
+class ConnectionPool:
+    """Per-process pool of tuned, reusable SQLite connections"""
+    
+    def __init__(self, database, size=DB_POOL_SIZE):
+        self.database = database
+        self.size = size
+        self._lock = threading.Lock()
+        self._idle = []
+        self._pid = os.getpid()
+    
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.database,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE_SIZE,
+            factory=InstrumentedConnection if METRICS_ENABLED else PooledConnection
+        )
+        conn.database = self.database
+        conn.published = []
+        conn.row_factory = sqlite3.Row
+        for pragma, value in SQLITE_PRAGMAS:
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        return conn
+    
+    def acquire(self):
+        """Take an idle connection, or open a new one"""
+        with self._lock:
+            # Connections must not cross a fork (gunicorn preload)
+            if self._pid != os.getpid():
+                self._idle = []
+                self._pid = os.getpid()
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+    
+    def release(self, conn):
+        """Return a connection to the pool, closing it if the pool is full"""
+        if conn.in_transaction:
+            conn.rollback()
+        conn.published.clear()
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+    
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+class DatabaseBusyError(Exception):
+    """The write lock could not be taken within the retry budget"""
+
+@contextmanager
+def write_transaction(db, retries=WRITE_LOCK_RETRIES):
+    """Run the block as one transaction holding the write lock from the start.
+    
+    BEGIN IMMEDIATE makes check-then-write sequences atomic across workers:
+    nobody else can write between our SELECTs and our INSERT. Commits on
+    success (including early returns), rolls back on error. Change events
+    published in the block are written through once it commits.
+    """
+    t0 = time.perf_counter()
+    for attempt in range(retries + 1):
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            metrics.observe('db_lock_wait_seconds', (), time.perf_counter() - t0)
+            break
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) and 'busy' not in str(e):
+                raise
+            if attempt == retries:
+                metrics.inc('db_lock_timeouts_total', ())
+                raise DatabaseBusyError('Database is busy, please retry') from e
+            time.sleep(WRITE_LOCK_BACKOFF_SECONDS * 2 ** attempt * random.uniform(0.5, 1.5))
+    try:
+        yield db
+    except BaseException:
+        db.rollback()
+        db.published.clear()
+        raise
+    else:
+        db.commit()
+        if db.published:
+            events = list(db.published)
+            db.published.clear()
+            after_commit(db, events)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def hostel_database(hostel):
+    """SQLite shard file of a hostel"""
+    if hostel == DEFAULT_HOSTEL:
+        return DATABASE
+    root, ext = os.path.splitext(DATABASE)
+    return f'{root}_{hostel}{ext}'
+
+def current_database():
+    """Shard of the hostel the current request is for (the default one outside requests)"""
+    hostel = g.get('hostel', DEFAULT_HOSTEL) if has_app_context() else DEFAULT_HOSTEL
+    return hostel_database(hostel)
+
+@app.before_request
+def select_hostel():
+    """Route API requests to a hostel's shard, from X-Hostel or ?hostel="""
+    if not request.path.startswith('/api'):
+        return None
+    hostel = request.headers.get('X-Hostel') or request.args.get('hostel') or DEFAULT_HOSTEL
+    if hostel not in HOSTELS:
+        return jsonify({'message': 'Unknown hostel'}), 404
+    g.hostel = hostel
+
+def get_pool(database=None):
+    """Get the connection pool for a database file (the current hostel's by default)"""
+    database = database or current_database()
+    pool = _pools.get(database)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(database, ConnectionPool(database))
+    return pool
+
+class AdmissionRejected(Exception):
+    """The request was shed by admission control"""
+    
+    def __init__(self, retry_after):
+        super().__init__('Too many requests, please retry shortly')
+        self.retry_after = max(1, math.ceil(retry_after))
+
+class AdmissionController:
+    """Token buckets and a FIFO write queue shared by all workers on this host.
+    
+    State lives in a small SQLite file next to the main database, so the
+    limiter never takes the main database's write lock.
+    """
+    
+    def __init__(self):
+        self._initialized = set()
+        self._lock = threading.Lock()
+    
+    def _pool(self, database=None):
+        # Per hostel, so one hostel's rush never queues another's bookings
+        path = (database or current_database()) + '.admission'
+        pool = get_pool(path)
+        if path not in self._initialized:
+            with self._lock:
+                db = pool.acquire()
+                try:
+                    db.execute('''
+                        CREATE TABLE IF NOT EXISTS token_buckets (
+                            key TEXT PRIMARY KEY,
+                            tokens REAL NOT NULL,
+                            updated_at REAL NOT NULL
+                        )
+                    ''')
+                    db.execute('''
+                        CREATE TABLE IF NOT EXISTS write_queue (
+                            ticket INTEGER PRIMARY KEY AUTOINCREMENT,
+                            owner TEXT NOT NULL UNIQUE,
+                            expires_at REAL NOT NULL
+                        )
+                    ''')
+                    db.commit()
+                finally:
+                    pool.release(db)
+                self._initialized.add(path)
+        return pool
+    
+    def take_tokens(self, buckets):
+        """Take one token from each (key, rate, capacity) bucket; raises AdmissionRejected if any is empty"""
+        pool = self._pool()
+        db = pool.acquire()
+        try:
+            now = time.time()
+            retry_after = 0
+            with write_transaction(db):
+                for key, rate, capacity in buckets:
+                    # Refill for the time elapsed, then take a token; a rejected
+                    # request leaves the bucket at most one token in debt
+                    tokens = db.execute('''
+                        INSERT INTO token_buckets (key, tokens, updated_at) VALUES (?, ? - 1, ?)
+                        ON CONFLICT (key) DO UPDATE SET
+                            tokens = MAX(-1, MIN(?, tokens + (excluded.updated_at - updated_at) * ?) - 1),
+                            updated_at = excluded.updated_at
+                        RETURNING tokens
+                    ''', (key, capacity, now, capacity, rate)).fetchone()[0]
+                    if tokens < 0:
+                        retry_after = max(retry_after, (1 - tokens) / rate)
+            if retry_after:
+                raise AdmissionRejected(retry_after)
+        finally:
+            pool.release(db)
+    
+    def prune_buckets(self, database, now=None):
+        """Delete one batch of buckets idle long enough to be full again;
+        returns how many. A full bucket is the same as no row at all."""
+        # Slowest refill, from one token in debt up to capacity
+        idle = max((capacity + 1) / rate for rate, capacity in RATE_LIMITS.values())
+        pool = self._pool(database)
+        db = pool.acquire()
+        try:
+            with write_transaction(db):
+                return db.execute('''
+                    DELETE FROM token_buckets WHERE key IN (
+                        SELECT key FROM token_buckets WHERE updated_at < ? LIMIT ?
+                    )
+                ''', ((now or time.time()) - idle, BUCKET_PRUNE_BATCH_SIZE)).rowcount
+        finally:
+            pool.release(db)
+    
+    @contextmanager
+    def write_slot(self, owner):
+        """Wait for a turn among the booking writes in flight on this host.
+        
+        Tickets are served in order, each owner may hold only one, and when
+        the queue is full or the wait too long the request is shed instead of
+        piling up on the SQLite write lock.
+        """
+        pool = self._pool()
+        db = pool.acquire()
+        try:
+            now = time.time()
+            try:
+                with write_transaction(db):
+                    db.execute('DELETE FROM write_queue WHERE expires_at < ?', (now,))
+                    queued = db.execute('SELECT COUNT(*) FROM write_queue').fetchone()[0]
+                    if queued >= WRITE_QUEUE_LIMIT:
+                        raise AdmissionRejected(1)
+                    ticket = db.execute('''
+                        INSERT INTO write_queue (owner, expires_at) VALUES (?, ?)
+                    ''', (owner, now + WRITE_TICKET_TTL)).lastrowid
+            except sqlite3.IntegrityError:
+                # This user already has a booking write waiting or running
+                raise AdmissionRejected(1)
+            
+            try:
+                deadline = now + WRITE_QUEUE_MAX_WAIT
+                while db.execute('''
+                    SELECT COUNT(*) FROM write_queue WHERE ticket < ? AND expires_at >= ?
+                ''', (ticket, time.time())).fetchone()[0] >= WRITE_CONCURRENCY:
+                    if time.time() > deadline:
+                        raise AdmissionRejected(1)
+                    time.sleep(WRITE_QUEUE_POLL)
+                yield
+            finally:
+                # The view has already committed; failing to hand the slot
+                # back must not turn its response into an error, and a ticket
+                # left behind expires after WRITE_TICKET_TTL
+                try:
+                    with write_transaction(db):
+                        db.execute('DELETE FROM write_queue WHERE ticket = ?', (ticket,))
+                except (sqlite3.Error, DatabaseBusyError) as e:
+                    print(f"Could not release write ticket {ticket}: {str(e)}")
+        finally:
+            pool.release(db)
+
+admission = AdmissionController()
+
+def admission_control(scope, queue_writes=False):
+    """Rate-limit a view per IP (and per user where a limit is configured),
+    optionally queueing it behind other booking writes; sheds with 429"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not ADMISSION_ENABLED:
+                return call_admitted(view, *args, **kwargs)
+            user = request.headers.get('Authorization', '').replace('Bearer ', '')
+            # Not X-Forwarded-For: the client writes that header (see TRUSTED_PROXIES)
+            ip = request.remote_addr
+            buckets = [(f'{scope}:ip:{ip}',) + RATE_LIMITS[f'{scope}_ip']]
+            if user and f'{scope}_user' in RATE_LIMITS:
+                buckets.append((f'{scope}:user:{user}',) + RATE_LIMITS[f'{scope}_user'])
+            slot = None
+            try:
+                admission.take_tokens(buckets)
+                if queue_writes:
+                    slot = admission.write_slot(user or ip)
+                    slot.__enter__()
+            except AdmissionRejected as e:
+                return jsonify({'message': str(e)}), 429, {'Retry-After': str(e.retry_after)}
+            except (sqlite3.Error, DatabaseBusyError) as e:
+                # Never fail a request because the limiter itself is unavailable
+                print(f"Admission control unavailable: {str(e)}")
+                slot = None
+            # Outside the try above: an error in the view must not run it again
+            if slot is None:
+                return call_admitted(view, *args, **kwargs)
+            try:
+                return call_admitted(view, *args, **kwargs)
+            finally:
+                slot.__exit__(None, None, None)
+        wrapper.admission_controlled = True
+        return wrapper
+    return decorator
+
+def call_admitted(view, *args, **kwargs):
+    """Run a view admission control let through, claiming its Idempotency-Key
+    first (see `idempotent`); the claim's answer instead if it was taken"""
+    claim = g.pop('idempotency_claim', None)
+    if claim is not None:
+        refused = claim()
+        if refused is not None:
+            return refused
+    return view(*args, **kwargs)
+
+def idempotency_lookup(db, key, now):
+    """The live idempotency_keys row for `key`, or None"""
+    return db.execute('''
+        SELECT fingerprint, status, body FROM idempotency_keys
+        WHERE key = ? AND expires_at > ?
+    ''', (key, now)).fetchone()
+
+def idempotent_reply(row, fingerprint):
+    """Answer to a request whose key is already taken by `row`"""
+    if row['fingerprint'] != fingerprint:
+        return jsonify({'message': 'Idempotency-Key was already used for a different request'}), 422
+    if row['status'] is None:
+        return jsonify({'message': 'A request with this Idempotency-Key is still in progress'}), \
+            409, {'Retry-After': '1'}
+    metrics.inc('idempotent_replays_total', (('route', request.url_rule.rule),))
+    return Response(row['body'], status=row['status'], mimetype='application/json',
+                    headers={'Idempotent-Replayed': 'true'})
+
+def idempotent(view):
+    """Honour an Idempotency-Key header on a write endpoint.
+    
+    The first request with a key claims it and runs; its response is stored
+    for IDEMPOTENCY_KEY_TTL and a retry with the same key gets that response
+    back from one primary-key lookup, without running the view again. Keys
+    are scoped to the caller and the endpoint. Errors the client should
+    retry (429, 5xx) are not stored.
+    
+    Stack it above admission_control: replays are answered from the
+    read-only lookup before admission, and the key is only claimed (a write
+    on the main database) once the request has been admitted, so requests
+    shed with 429 never touch the main database's write lock.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if not idempotency_key:
+            return view(*args, **kwargs)
+        if len(idempotency_key) > 255:
+            return jsonify({'message': 'Idempotency-Key is too long'}), 400
+        
+        user = request.headers.get('Authorization', '')
+        key = hashlib.sha256(
+            f'{user}\n{request.method} {request.path}\n{idempotency_key}'.encode()
+        ).digest()[:16]
+        fingerprint = hashlib.sha256(request.get_data()).digest()[:16]
+        db = get_db()
+        row = idempotency_lookup(db, key, time.time())
+        if row is not None:
+            return idempotent_reply(row, fingerprint)
+        
+        claimed = False
+        def claim():
+            nonlocal claimed
+            now = time.time()
+            try:
+                with write_transaction(db):
+                    row = idempotency_lookup(db, key, now)
+                    if row is None:
+                        db.execute('''
+                            INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, expires_at)
+                            VALUES (?, ?, ?)
+                        ''', (key, fingerprint, now + IDEMPOTENCY_CLAIM_SECONDS))
+            except DatabaseBusyError as e:
+                return jsonify({'message': str(e)}), 503, {'Retry-After': '1'}
+            if row is not None:
+                # Another request with the key got in since the lookup
+                return idempotent_reply(row, fingerprint)
+            claimed = True
+            return None
+        
+        if getattr(view, 'admission_controlled', False):
+            g.idempotency_claim = claim
+        else:
+            refused = claim()
+            if refused is not None:
+                return refused
+        
+        response = None
+        try:
+            response = app.make_response(view(*args, **kwargs))
+            return response
+        finally:
+            g.pop('idempotency_claim', None)
+            # Once claimed, always settle: store the response, or release the
+            # key so that a retry runs the request again (not after a 429
+            # from admission control, which never claimed it)
+            if claimed:
+                try:
+                    with write_transaction(db):
+                        if response is not None and response.status_code < 500 and response.status_code != 429:
+                            db.execute('''
+                                UPDATE idempotency_keys SET status = ?, body = ?, expires_at = ?
+                                WHERE key = ?
+                            ''', (response.status_code, response.get_data(),
+                                  time.time() + IDEMPOTENCY_KEY_TTL, key))
+                        else:
+                            db.execute('DELETE FROM idempotency_keys WHERE key = ?', (key,))
+                except (sqlite3.Error, DatabaseBusyError) as e:
+                    # The claim lapses after IDEMPOTENCY_CLAIM_SECONDS
+                    print(f"Failed to store idempotent response: {str(e)}")
+    return wrapper
+
+def prune_idempotency_keys(db, now=None):
+    """Delete one batch of expired idempotency keys; returns how many"""
+    with write_transaction(db):
+        return db.execute('''
+            DELETE FROM idempotency_keys WHERE key IN (
+                SELECT key FROM idempotency_keys WHERE expires_at <= ? LIMIT ?
+            )
+        ''', (now or time.time(), IDEMPOTENCY_PRUNE_BATCH_SIZE)).rowcount
 
 def get_db():
     """Get database connection"""
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
+        pool = get_pool()
+        db = g._database = pool.acquire()
+        g._database_pool = pool
     return db
 
 @app.teardown_appcontext
 def close_connection(exception):
-    """Close database connection"""
+    """Return database connection to the pool"""
     db = getattr(g, '_database', None)
     if db is not None:
-        db.close()
+        g._database_pool.release(db)
 
-def init_db():
-    """Initialize database with tables"""
-    with app.app_context():
-        db = get_db()
-        
-        # Create Users table
-        db.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                student_id TEXT UNIQUE NOT NULL,
-                username TEXT NOT NULL,
-                password TEXT NOT NULL,
-                email TEXT,
-                role TEXT NOT NULL DEFAULT 'user',
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create Washing_Machines table
-        db.execute('''
-            CREATE TABLE IF NOT EXISTS washing_machines (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                machine_name TEXT NOT NULL,
-                status TEXT NOT NULL DEFAULT 'available',
-                last_used_by INTEGER,
-                last_used_time DATETIME,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (last_used_by) REFERENCES users (id)
-            )
-        ''')
-        
-        # Create Bookings table
-        db.execute('''
-            CREATE TABLE IF NOT EXISTS bookings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                machine_id INTEGER NOT NULL,
-                start_time DATETIME NOT NULL,
-                end_time DATETIME NOT NULL,
-                status TEXT NOT NULL DEFAULT 'pending',
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                FOREIGN KEY (machine_id) REFERENCES washing_machines (id)
-            )
-        ''')
-        
-        # Insert default admin user
-        admin_password = hash_password('admin123')
-        db.execute('''
-            INSERT OR IGNORE INTO users (student_id, username, password, role)
-            VALUES (?, ?, ?, ?)
-        ''', ('admin', 'Administrator', admin_password, 'admin'))
-        
-        # Insert default washing machines
-        machines = [
-            ('Machine 1', 'available'),
-            ('Machine 2', 'available'),
-            ('Machine 3', 'available'),
-            ('Machine 4', 'available'),
-            ('Machine 5', 'available'),
-            ('Machine 6', 'available'),
-            ('Machine 7', 'available'),
-            ('Machine 8', 'available')
-        ]
-        
-        for machine_name, status in machines:
-            db.execute('''
-                INSERT OR IGNORE INTO washing_machines (machine_name, status)
-                VALUES (?, ?)
-            ''', (machine_name, status))
-        
-        db.commit()
+# Schema migrations, applied in order and recorded in PRAGMA user_version:
+# MIGRATIONS[n - 1] takes a shard from version n - 1 to n. Append new ones at
+# the end and never edit a migration that has shipped.
+MIGRATIONS = []
+
+def migration(description):
+    """Register the decorated function as the next schema migration"""
+    def decorator(func):
+        MIGRATIONS.append((description, func))
+        return func
+    return decorator
+
+DEFAULT_MACHINE_NAMES = [f'Machine {n}' for n in range(1, 9)]
+
+@migration('users, washing machines and bookings')
+def _migrate_base_tables(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id TEXT UNIQUE NOT NULL,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL,
+            email TEXT,
+            role TEXT NOT NULL DEFAULT 'user',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS washing_machines (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            machine_name TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'available',
+            last_used_by INTEGER,
+            last_used_time DATETIME,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (last_used_by) REFERENCES users (id)
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS bookings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            machine_id INTEGER NOT NULL,
+            start_time DATETIME NOT NULL,
+            end_time DATETIME NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (machine_id) REFERENCES washing_machines (id)
+        )
+    ''')
+    
+    # Default admin user and machines, seeded once
+    db.execute('''
+        INSERT OR IGNORE INTO users (student_id, username, password, role)
+        VALUES (?, ?, ?, ?)
+    ''', ('admin', 'Administrator', hash_password('admin123'), 'admin'))
+    if db.execute('SELECT COUNT(*) FROM washing_machines').fetchone()[0] == 0:
+        db.executemany('''
+            INSERT INTO washing_machines (machine_name, status) VALUES (?, 'available')
+        ''', [(name,) for name in DEFAULT_MACHINE_NAMES])
+
+@migration('booking indexes')
+def _migrate_booking_indexes(db):
+    # Partial index on active bookings per machine ordered by start time: the
+    # latest booking starting before a point is a single index seek
+    db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_active_interval
+        ON bookings (machine_id, start_time, end_time)
+        WHERE status IN ('pending', 'confirmed')
+    ''')
+    db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_user_active
+        ON bookings (user_id, start_time)
+        WHERE status IN ('pending', 'confirmed')
+    ''')
+    
+    # Indexes for the booking history lists: keyset pagination walks
+    # (start_time, id) newest first, optionally within a user, machine or status
+    db.execute('CREATE INDEX IF NOT EXISTS idx_bookings_start ON bookings (start_time)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_bookings_user_start ON bookings (user_id, start_time)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_bookings_machine_start ON bookings (machine_id, start_time)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_bookings_status_start ON bookings (status, start_time)')
+    
+    # Active bookings by end time: the lifecycle worker's queue of
+    # bookings waiting to be completed
+    db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_active_end
+        ON bookings (end_time)
+        WHERE status IN ('pending', 'confirmed')
+    ''')
+
+@migration('bookings archive')
+def _migrate_bookings_archive(db):
+    # Finished bookings past the archive horizon, moved out so the hot
+    # bookings table stays small. Ids are kept (bookings uses AUTOINCREMENT,
+    # so they are never reused).
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS bookings_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            machine_id INTEGER NOT NULL,
+            start_time DATETIME NOT NULL,
+            end_time DATETIME NOT NULL,
+            status TEXT NOT NULL,
+            created_at DATETIME
+        )
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_bookings_archive_start ON bookings_archive (start_time)')
+    db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_archive_user_start
+        ON bookings_archive (user_id, start_time)
+    ''')
+
+@migration('email outbox')
+def _migrate_email_outbox(db):
+    # Emails are queued in the same transaction as the change that triggers
+    # them and delivered by a background worker
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            to_email TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            sent_at DATETIME
+        )
+    ''')
+    db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_email_outbox_due
+        ON email_outbox (next_attempt_at)
+        WHERE status IN ('pending', 'sending')
+    ''')
+
+@migration('change events')
+def _migrate_change_events(db):
+    # An append-only log of machine and booking changes; its id is the SSE
+    # event id used for Last-Event-ID resume and the read model's version
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS change_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_type TEXT NOT NULL,
+            data TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+@migration('per-user booking quota')
+def _migrate_booking_quota(db):
+    # Each user's active bookings as a JSON list of [booking_id, start_time],
+    # maintained in the same transaction as every booking change so the quota
+    # check is one lookup
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS user_booking_quota (
+            user_id INTEGER PRIMARY KEY,
+            active_bookings TEXT NOT NULL DEFAULT '[]'
+        )
+    ''')
+    db.execute('''
+        INSERT INTO user_booking_quota (user_id, active_bookings)
+        SELECT user_id, json_group_array(json_array(id, start_time))
+        FROM bookings
+        WHERE status IN ('pending', 'confirmed')
+        GROUP BY user_id
+    ''')
+
+@migration('remove default machines duplicated by repeated init_db runs')
+def _migrate_dedupe_default_machines(db):
+    # Only untouched copies go: never used, never booked, still available
+    placeholders = ','.join('?' * len(DEFAULT_MACHINE_NAMES))
+    removed = [row[0] for row in db.execute(f'''
+        DELETE FROM washing_machines
+        WHERE machine_name IN ({placeholders})
+        AND id > (SELECT MIN(id) FROM washing_machines first
+                  WHERE first.machine_name = washing_machines.machine_name)
+        AND status = 'available' AND last_used_by IS NULL
+        AND id NOT IN (SELECT machine_id FROM bookings)
+        AND id NOT IN (SELECT machine_id FROM bookings_archive)
+        RETURNING id
+    ''', DEFAULT_MACHINE_NAMES)]
+    if removed:
+        publish_event(db, 'machines_removed', {'machine_ids': sorted(removed)})
+
+@migration('index active bookings by start time')
+def _migrate_active_start_index(db):
+    # Read-model loads and the availability grid read active bookings in
+    # start-time order; without this they walk every booking ever made
+    db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_active_start
+        ON bookings (start_time)
+        WHERE status IN ('pending', 'confirmed')
+    ''')
+    # Only the quota rebuild used it, and that is fine with the index above;
+    # one index fewer to maintain on every booking write
+    db.execute('DROP INDEX IF EXISTS idx_bookings_user_active')
+
+@migration('idempotency keys')
+def _migrate_idempotency_keys(db):
+    # Stored responses of writes sent with an Idempotency-Key; key and
+    # fingerprint are truncated SHA-256 digests, status is NULL while the
+    # first request is still running
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key BLOB PRIMARY KEY,
+            fingerprint BLOB NOT NULL,
+            status INTEGER,
+            body BLOB,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires
+        ON idempotency_keys (expires_at)
+    ''')
+
+@migration('hourly machine usage rollup')
+def _migrate_machine_usage(db):
+    # When a booking was cancelled, to tell late cancellations from timely ones
+    for table in ('bookings', 'bookings_archive'):
+        columns = {row['name'] for row in db.execute(f'PRAGMA table_info({table})')}
+        if 'cancelled_at' not in columns:
+            db.execute(f'ALTER TABLE {table} ADD COLUMN cancelled_at DATETIME')
+    # Per machine and hour: seconds booked by bookings that were not
+    # cancelled, split over the hours they cover, and by the hour a booking
+    # starts in how many were made, cancelled, cancelled late and completed;
+    # kept up to date in the same transaction as every booking change
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS machine_usage_hourly (
+            hour TEXT NOT NULL,
+            machine_id INTEGER NOT NULL,
+            busy_seconds INTEGER NOT NULL DEFAULT 0,
+            bookings INTEGER NOT NULL DEFAULT 0,
+            cancelled INTEGER NOT NULL DEFAULT 0,
+            late_cancelled INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour, machine_id)
+        ) WITHOUT ROWID
+    ''')
+    # Roll up the bookings made so far. The rules are spelled out here as
+    # they stood when this shipped; later changes go to rebuild_machine_usage
+    def naive_utc(value):
+        parsed = datetime.datetime.fromisoformat(value)
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return parsed
+    
+    offset = datetime.timedelta(minutes=USAGE_UTC_OFFSET_MINUTES)
+    usage = {}
+    for machine_id, start_time, end_time, status, cancelled_at in db.execute('''
+        SELECT machine_id, start_time, end_time, status, cancelled_at FROM bookings
+        UNION ALL
+        SELECT machine_id, start_time, end_time, status, cancelled_at FROM bookings_archive
+    '''):
+        try:
+            start, end = naive_utc(start_time) + offset, naive_utc(end_time) + offset
+        except (TypeError, ValueError):
+            continue
+        cancelled = status == 'cancelled'
+        try:
+            late = cancelled and naive_utc(start_time) - naive_utc(cancelled_at) < datetime.timedelta(minutes=30)
+        except (TypeError, ValueError):
+            late = False
+        # busy_seconds, bookings, cancelled, late_cancelled, completed
+        end = min(end, start + datetime.timedelta(hours=24 * 7))
+        hour = start.replace(minute=0, second=0, microsecond=0)
+        totals = usage.setdefault((hour.strftime('%Y-%m-%dT%H'), machine_id), [0] * 5)
+        totals[1] += 1
+        totals[2] += int(cancelled)
+        totals[3] += int(late)
+        totals[4] += int(status == 'completed')
+        while not cancelled and hour < end:
+            next_hour = hour + datetime.timedelta(hours=1)
+            seconds = round((min(end, next_hour) - max(start, hour)).total_seconds())
+            usage.setdefault((hour.strftime('%Y-%m-%dT%H'), machine_id), [0] * 5)[0] += seconds
+            hour = next_hour
+    db.execute('DELETE FROM machine_usage_hourly')
+    db.executemany('''
+        INSERT INTO machine_usage_hourly
+            (hour, machine_id, busy_seconds, bookings, cancelled, late_cancelled, completed)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(hour, machine_id, *totals) for (hour, machine_id), totals in usage.items()])
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def schema_version(db):
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+@contextmanager
+def migration_lock(database):
+    """Hold an exclusive lock file so one worker on this host migrates a shard
+    while the others wait, instead of all of them queueing on the write lock"""
+    with open(database + '.migrate.lock', 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield   # closing the file releases the lock
+
+def migrate(database):
+    """Bring a shard's schema up to SCHEMA_VERSION; returns the versions applied.
+    
+    An up-to-date shard costs one PRAGMA read. Each migration runs in its own
+    write transaction together with its user_version bump, and re-checks the
+    version once it holds the lock, so concurrent workers never apply one twice.
+    """
+    pool = get_pool(database)
+    db = pool.acquire()
+    try:
+        if schema_version(db) >= SCHEMA_VERSION:
+            return []
+        applied = []
+        with migration_lock(database):
+            for version in range(schema_version(db) + 1, SCHEMA_VERSION + 1):
+                description, apply = MIGRATIONS[version - 1]
+                t0 = time.perf_counter()
+                with write_transaction(db):
+                    if schema_version(db) >= version:
+                        continue    # applied by another worker meanwhile
+                    apply(db)
+                    db.execute(f'PRAGMA user_version = {version}')
+                applied.append(version)
+                print(f"{database}: migrated to version {version}, {description} "
+                      f"({(time.perf_counter() - t0) * 1000:.0f} ms)")
+            if applied:
+                db.execute('PRAGMA optimize')   # statistics for the new indexes
+        return applied
+    finally:
+        pool.release(db)
+
+# Shards this process has checked; the schema cannot move backwards under us
+_migrated = set()
+_migrated_lock = threading.Lock()
+
+def ensure_schema(database):
+    """Migrate a shard if this process has not checked it yet"""
+    if database in _migrated:
+        return
+    with _migrated_lock:
+        if database not in _migrated:
+            migrate(database)
+            _migrated.add(database)
+
+_databases_ready = False
+
+@app.before_request
+def prepare_databases():
+    """Check every shard's schema on this process's first request, before the
+    background workers start on them"""
+    global _databases_ready
+    if _databases_ready:
+        return
+    for hostel in HOSTELS:
+        ensure_schema(hostel_database(hostel))
+    _databases_ready = True
+    metrics.observe('worker_start_seconds', (), time.perf_counter() - MODULE_LOADED_AT)
+
+def init_db(hostel=None):
+    """Create or upgrade the schema of every hostel's shard (or just one)"""
+    for hostel in ([hostel] if hostel else HOSTELS):
+        ensure_schema(hostel_database(hostel))
+
+class MachineState:
+    """A washing machine as held in the read model"""
+    __slots__ = ('id', 'machine_name', 'status', 'last_used_by', 'last_used_time')
+    
+    def __init__(self, id, machine_name, status, last_used_by=None, last_used_time=None):
+        self.id = id
+        self.machine_name = machine_name
+        self.status = status
+        self.last_used_by = last_used_by
+        self.last_used_time = last_used_time
+
+class ActiveBooking:
+    """A pending or confirmed booking as held in the read model"""
+    __slots__ = ('id', 'user_id', 'machine_id', 'start_time', 'end_time', 'status', 'created_at')
+    
+    def __init__(self, id, user_id, machine_id, start_time, end_time, status, created_at):
+        self.id = id
+        self.user_id = user_id
+        self.machine_id = machine_id
+        self.start_time = start_time
+        self.end_time = end_time
+        self.status = status
+        self.created_at = created_at
+
+class MachineSchedule:
+    """Active bookings of one machine as parallel lists sorted by start time.
+    
+    `reach[i]` is the latest end among the first i + 1 bookings, so a booking
+    that encloses later ones is still found: data from before the conflict
+    check ran in one transaction can hold overlapping active bookings.
+    """
+    __slots__ = ('starts', 'ends', 'bookings', 'reach')
+    
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.bookings = []
+        self.reach = []
+    
+    def insert(self, booking):
+        i = bisect_right(self.starts, booking.start_time)
+        self.starts.insert(i, booking.start_time)
+        self.ends.insert(i, booking.end_time)
+        self.bookings.insert(i, booking)
+        self.reach.insert(i, None)
+        self._extend_reach(i)
+    
+    def remove(self, booking):
+        i = self.bookings.index(booking)
+        del self.starts[i], self.ends[i], self.bookings[i], self.reach[i]
+        self._extend_reach(i)
+    
+    def _extend_reach(self, i):
+        latest = self.reach[i - 1] if i > 0 else ''
+        for j in range(i, len(self.ends)):
+            latest = max(latest, self.ends[j])
+            self.reach[j] = latest
+    
+    def overlap(self, start_time, end_time):
+        """The first booking overlapping [start_time, end_time), or None"""
+        i = bisect_left(self.starts, end_time)
+        if i == 0 or self.reach[i - 1] <= start_time:
+            return None
+        # Some booking starting before `end_time` ends after `start_time`;
+        # usually the latest one, an enclosing one further back otherwise
+        for j in range(i - 1, -1, -1):
+            if self.ends[j] > start_time:
+                return self.bookings[j]
+
+class ReadModel:
+    """In-process copy of a shard's machines, users and active bookings.
+    
+    Loaded on first use and kept at the data version by replaying
+    change_events: this process's own writes are applied as they commit, and
+    writes by other workers are replayed whenever the version has moved on.
+    Synced inside a write transaction the model is exact, which is what lets
+    the conflict check run from memory.
+    """
+    
+    def __init__(self, database):
+        self.database = database
+        self.version = None
+        self._lock = threading.RLock()
+        self.machines = {}      # id -> MachineState, in id order
+        self.users = {}         # id -> (username, student_id)
+        self.bookings = {}      # booking id -> ActiveBooking
+        self.schedules = {}     # machine id -> MachineSchedule
+    
+    @contextmanager
+    def _snapshot(self, db):
+        """Read from one consistent snapshot, reusing the caller's transaction if any"""
+        if db.in_transaction:
+            yield
+            return
+        db.execute('BEGIN')
+        try:
+            yield
+        finally:
+            db.commit()
+    
+    def _load(self, db):
+        with self._snapshot(db):
+            version = current_data_version(db)
+            machines = db.execute('''
+                SELECT id, machine_name, status, last_used_by, last_used_time
+                FROM washing_machines ORDER BY id
+            ''').fetchall()
+            users = db.execute('SELECT id, username, student_id FROM users').fetchall()
+            bookings = db.execute('''
+                SELECT id, user_id, machine_id, start_time, end_time, status, created_at
+                FROM bookings
+                WHERE status IN ('pending', 'confirmed')
+                ORDER BY start_time, id
+            ''').fetchall()
+        
+        self.machines = {row['id']: MachineState(*row) for row in machines}
+        self.users = {row['id']: (row['username'], row['student_id']) for row in users}
+        self.bookings = {}
+        self.schedules = {}
+        for row in bookings:
+            self._add_booking(ActiveBooking(*row))
+        self.version = version
+    
+    def _add_booking(self, booking):
+        schedule = self.schedules.get(booking.machine_id)
+        if schedule is None:
+            schedule = self.schedules[booking.machine_id] = MachineSchedule()
+        schedule.insert(booking)
+        self.bookings[booking.id] = booking
+    
+    def _remove_booking(self, booking_id):
+        booking = self.bookings.pop(booking_id, None)
+        if booking is None:
+            return None
+        self.schedules[booking.machine_id].remove(booking)
+        return booking
+    
+    def _user(self, db, user_id):
+        """(username, student_id) of a user, or None; users are added without
+        events, so misses are looked up (every time: the row may appear later)"""
+        user = self.users.get(user_id)
+        if user is None and user_id is not None:
+            row = db.execute('SELECT username, student_id FROM users WHERE id = ?', (user_id,)).fetchone()
+            if row:
+                user = self.users[user_id] = (row['username'], row['student_id'])
+        return user
+    
+    def _apply(self, db, event_type, data):
+        """Apply one change event; False if the event type is not understood"""
+        if event_type == 'booking_created':
+            self._user(db, data['user_id'])
+            self._add_booking(ActiveBooking(
+                data['booking_id'], data['user_id'], data['machine_id'],
+                data['start_time'], data['end_time'], data['status'], data['created_at']
+            ))
+        elif event_type == 'booking_cancelled':
+            self._remove_booking(data['booking_id'])
+        elif event_type == 'bookings_completed':
+            # Mirrors complete_finished_bookings: each machine is stamped with
+            # its latest finished booking, unless it has a later use already
+            finished = [b for b in map(self._remove_booking, data['booking_ids']) if b is not None]
+            for booking in sorted(finished, key=lambda b: b.end_time):
+                machine = self.machines.get(booking.machine_id)
+                if machine and (machine.last_used_time is None or machine.last_used_time < booking.end_time):
+                    machine.last_used_by = booking.user_id
+                    machine.last_used_time = booking.end_time
+                    self._user(db, booking.user_id)
+        elif event_type == 'machine_status':
+            self.machines[data['machine_id']].status = data['status']
+        elif event_type == 'machine_added':
+            self.machines[data['machine_id']] = MachineState(
+                data['machine_id'], data['machine_name'], data['status'])
+        elif event_type == 'machines_added':
+            for machine in data['machines']:
+                self.machines[machine['machine_id']] = MachineState(
+                    machine['machine_id'], machine['machine_name'], machine['status'])
+        elif event_type == 'machines_updated':
+            for change in data['machines']:
+                self.machines[change['machine_id']].status = change['status']
+            for change in data['cancelled']:
+                self._remove_booking(change['booking_id'])
+            for change in data['reassigned']:
+                booking = self._remove_booking(change['booking_id'])
+                if booking is not None:
+                    booking.machine_id = change['machine_id']
+                    self._add_booking(booking)
+        elif event_type == 'machines_removed':
+            for machine_id in data['machine_ids']:
+                self.machines.pop(machine_id, None)
+                self.schedules.pop(machine_id, None)
+        else:
+            return False
+        return True
+    
+    def _sync(self, db):
+        if self.version is None:
+            self._load(db)
+            return
+        version = current_data_version(db)
+        if version == self.version:
+            return
+        rows = db.execute('''
+            SELECT id, event_type, data FROM change_events
+            WHERE id > ? ORDER BY id LIMIT ?
+        ''', (self.version, READ_MODEL_REPLAY_LIMIT + 1)).fetchall()
+        # Pruned events or a long gap: cheaper and safer to reload
+        if not rows or rows[0]['id'] != self.version + 1 or len(rows) > READ_MODEL_REPLAY_LIMIT:
+            self.reload(db)
+            return
+        for row in rows:
+            if not self._apply(db, row['event_type'], json.loads(row['data'])):
+                self.reload(db)
+                return
+            self.version = row['id']
+    
+    def sync(self, db):
+        """Bring the model up to the database's data version"""
+        with self._lock:
+            self._sync(db)
+    
+    def reload(self, db):
+        with self._lock:
+            metrics.inc('read_model_reloads_total', ())
+            self._load(db)
+    
+    def write_through(self, db, events):
+        """Apply events this process just committed, as (event_id, type, data)"""
+        with self._lock:
+            if self.version is None:
+                return      # not loaded in this process yet
+            for event_id, event_type, data in events:
+                if event_id <= self.version:
+                    continue
+                if event_id != self.version + 1 or not self._apply(db, event_type, data):
+                    # Another worker wrote in between: catch up from the log
+                    self._sync(db)
+                    return
+                self.version = event_id
+    
+    def _overlap(self, machine_id, start_time, end_time):
+        schedule = self.schedules.get(machine_id)
+        booking = schedule.overlap(start_time, end_time) if schedule else None
+        return booking.id if booking else None
+    
+    def find_overlap(self, db, machine_id, start_time, end_time):
+        """Id of an active booking overlapping [start_time, end_time), or None"""
+        with self._lock:
+            self._sync(db)
+            return self._overlap(machine_id, start_time, end_time)
+    
+    def booking_count(self, machine_id):
+        """Number of active bookings on a machine"""
+        schedule = self.schedules.get(machine_id)
+        return len(schedule.bookings) if schedule else 0
+    
+    def last_use(self, machine_id):
+        """When a machine was (or is booked to be) last used, '' if never"""
+        schedule = self.schedules.get(machine_id)
+        if schedule and schedule.reach:
+            return schedule.reach[-1]
+        return self.machines[machine_id].last_used_time or ''
+    
+    def place(self, db, start_time, end_time, preferences=None, policy=None):
+        """An available machine free for [start_time, end_time), or None.
+        
+        The first free one of `preferences` (machine ids, most preferred
+        first) when given, otherwise the one `policy` picks among all free
+        machines. One pass over the machines' schedules, each a bisect.
+        """
+        with self._lock:
+            self._sync(db)
+            free = []
+            for machine_id in self.machines if preferences is None else preferences:
+                machine = self.machines.get(machine_id)
+                if machine is None or machine.status != 'available':
+                    continue
+                if self._overlap(machine_id, start_time, end_time) is None:
+                    if preferences is not None:
+                        return machine
+                    free.append(machine)
+            return policy(self, free) if free else None
+    
+    def machine_rows(self, db, with_user_names=False):
+        """Every machine in id order, as MACHINE_COLUMNS (or ADMIN_MACHINE_COLUMNS) tuples"""
+        with self._lock:
+            self._sync(db)
+            rows = []
+            for machine in self.machines.values():
+                row = (machine.id, machine.machine_name, machine.status,
+                       machine.last_used_by, machine.last_used_time)
+                if with_user_names:
+                    user = self._user(db, machine.last_used_by)
+                    row += (user[0] if user else None,)
+                rows.append(row)
+            return rows
+    
+    def machine_bookings(self, db, machine_id):
+        """(machine name, active bookings by start time as MACHINE_BOOKING_COLUMNS
+        tuples), or None for an unknown machine"""
+        with self._lock:
+            self._sync(db)
+            machine = self.machines.get(machine_id)
+            if machine is None:
+                return None
+            schedule = self.schedules.get(machine_id)
+            bookings = []
+            for booking in schedule.bookings if schedule else ():
+                user = self._user(db, booking.user_id)
+                if user is None:
+                    continue    # same as the inner join with users
+                bookings.append((booking.id, user[0], user[1], booking.start_time,
+                                 booking.end_time, booking.status, booking.created_at))
+            return machine.machine_name, bookings
+    
+    def check(self, db):
+        """Differences between the model and the database; empty when they agree"""
+        fresh = ReadModel(self.database)
+        with self._lock, self._snapshot(db):
+            self._sync(db)
+            fresh._load(db)
+            differences = []
+            for name, ours, theirs in (('machine', self.machines, fresh.machines),
+                                       ('booking', self.bookings, fresh.bookings)):
+                for key in sorted(set(ours) | set(theirs)):
+                    a, b = ours.get(key), theirs.get(key)
+                    a = a and tuple(getattr(a, slot) for slot in a.__slots__)
+                    b = b and tuple(getattr(b, slot) for slot in b.__slots__)
+                    if a != b:
+                        differences.append(f'{name} {key}: model {a}, database {b}')
+            # Users the model has cached; it looks up the rest on demand
+            for key in sorted(self.users):
+                if self.users[key] != fresh.users.get(key):
+                    differences.append(f'user {key}: model {self.users[key]}, database {fresh.users.get(key)}')
+            return differences
+
+# database file -> ReadModel of that shard
+read_models = {}
+_read_models_lock = threading.Lock()
+
+def read_model(db):
+    """The read model of the shard `db` is connected to"""
+    model = read_models.get(db.database)
+    if model is None:
+        with _read_models_lock:
+            model = read_models.setdefault(db.database, ReadModel(db.database))
+    return model
+
+# Placement policies for bookings made with machine_id "any": each picks one
+# of the free machines (MachineState, in id order), given the read model
+PLACEMENT_POLICIES = {}
+
+def placement_policy(name):
+    """Register the decorated function as a placement policy"""
+    def decorator(func):
+        PLACEMENT_POLICIES[name] = func
+        return func
+    return decorator
+
+@placement_policy('least_recently_used')
+def _place_least_recently_used(model, machines):
+    # Never-used machines first, then the one whose last booking ends earliest
+    return min(machines, key=lambda machine: model.last_use(machine.id))
+
+@placement_policy('least_loaded')
+def _place_least_loaded(model, machines):
+    # Fewest upcoming bookings, so use (and wear) spreads evenly over the
+    # machines; ties go to the least recently used
+    return min(machines, key=lambda machine: (model.booking_count(machine.id), model.last_use(machine.id)))
+
+if PLACEMENT_POLICY not in PLACEMENT_POLICIES:
+    raise ValueError(f'Unknown PLACEMENT_POLICY: {PLACEMENT_POLICY!r}')
+
+def find_conflicting_booking(db, machine_id, start_time, end_time):
+    """Return the id of an active booking overlapping [start_time, end_time), or None.
+    
+    Called inside the booking's write transaction, where the synced read
+    model is exact, so no query beyond the data version is needed.
+    """
+    return read_model(db).find_overlap(db, machine_id, start_time, end_time)
+
+def after_commit(db, events):
+    """Write committed change events through to this process's read model and SSE subscribers"""
+    read_model(db).write_through(db, events)
+    get_broadcaster(db.database).wake()
+
+def active_user_bookings(db, user_id):
+    """A user's active bookings as [booking_id, start_time] pairs"""
+    row = db.execute(
+        'SELECT active_bookings FROM user_booking_quota WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    return json.loads(row['active_bookings']) if row else []
+
+def quota_add_booking(db, user_id, booking_id, start_time):
+    """Record a new active booking in the user's quota entry (inside the write transaction)"""
+    active = active_user_bookings(db, user_id)
+    active.append([booking_id, start_time])
+    db.execute('''
+        INSERT INTO user_booking_quota (user_id, active_bookings) VALUES (?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET active_bookings = excluded.active_bookings
+    ''', (user_id, json.dumps(active)))
+
+def quota_remove_bookings(db, user_id, booking_ids):
+    """Drop bookings that were cancelled or completed from the user's quota entry"""
+    booking_ids = set(booking_ids)
+    active = [entry for entry in active_user_bookings(db, user_id) if entry[0] not in booking_ids]
+    db.execute('''
+        UPDATE user_booking_quota SET active_bookings = ? WHERE user_id = ?
+    ''', (json.dumps(active), user_id))
+
+def bookings_within_quota_window(db, user_id, now=None):
+    """How many of the user's active bookings start within the quota window"""
+    now = now or datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    window_start = format_timestamp(now)
+    window_end = format_timestamp(now + datetime.timedelta(days=BOOKING_QUOTA_WINDOW_DAYS))
+    return sum(1 for _, start_time in active_user_bookings(db, user_id)
+               if window_start <= start_time <= window_end)
+
+def rebuild_booking_quotas(db):
+    """Recompute every user's quota entry from the bookings table"""
+    db.execute('DELETE FROM user_booking_quota')
+    db.execute('''
+        INSERT INTO user_booking_quota (user_id, active_bookings)
+        SELECT user_id, json_group_array(json_array(id, start_time))
+        FROM bookings
+        WHERE status IN ('pending', 'confirmed')
+        GROUP BY user_id
+    ''')
+
+USAGE_COUNTERS = ('busy_seconds', 'bookings', 'cancelled', 'late_cancelled', 'completed')
+USAGE_HOUR_FORMAT = '%Y-%m-%dT%H'
+
+def usage_hour(value):
+    """The rollup hour of a naive UTC datetime, on the hostel's clock"""
+    return (value + datetime.timedelta(minutes=USAGE_UTC_OFFSET_MINUTES)).strftime(USAGE_HOUR_FORMAT)
+
+def add_usage(usage, machine_id, start_time, end_time, busy=0, **counts):
+    """Add one booking's share of the hourly rollup to `usage`, a dict of
+    {(hour, machine_id): [busy_seconds, bookings, cancelled, late_cancelled, completed]}.
+
+    `busy` (1 or -1) adds or takes away the time the booking covers, split
+    over its hours; `counts` go to the hour it starts in.
+    """
+    try:
+        start, end = parse_timestamp(start_time), parse_timestamp(end_time)
+    except (TypeError, ValueError):
+        return    # not a timestamp, so it has no place on the clock
+    offset = datetime.timedelta(minutes=USAGE_UTC_OFFSET_MINUTES)
+    start += offset
+    end = min(end + offset, start + datetime.timedelta(hours=USAGE_MAX_HOURS))
+    hour = start.replace(minute=0, second=0, microsecond=0)
+    totals = usage.setdefault((hour.strftime(USAGE_HOUR_FORMAT), machine_id), [0] * len(USAGE_COUNTERS))
+    for name, amount in counts.items():
+        totals[USAGE_COUNTERS.index(name)] += amount
+    while busy and hour < end:
+        next_hour = hour + datetime.timedelta(hours=1)
+        seconds = round((min(end, next_hour) - max(start, hour)).total_seconds())
+        usage.setdefault((hour.strftime(USAGE_HOUR_FORMAT), machine_id),
+                         [0] * len(USAGE_COUNTERS))[0] += busy * seconds
+        hour = next_hour
+
+def is_late_cancellation(start_time, cancelled_at):
+    """Whether a booking was cancelled with less notice than students are asked to give"""
+    try:
+        notice = parse_timestamp(start_time) - parse_timestamp(cancelled_at)
+    except (TypeError, ValueError):
+        return False
+    return notice < datetime.timedelta(minutes=LATE_CANCELLATION_MINUTES)
+
+def store_usage(db, usage):
+    """Add the changes collected by add_usage to the rollup (inside the write transaction)"""
+    db.executemany(f'''
+        INSERT INTO machine_usage_hourly (hour, machine_id, {', '.join(USAGE_COUNTERS)})
+        VALUES (?, ?, {', '.join('?' * len(USAGE_COUNTERS))})
+        ON CONFLICT (hour, machine_id) DO UPDATE SET
+        {', '.join(f'{name} = {name} + excluded.{name}' for name in USAGE_COUNTERS)}
+    ''', [(hour, machine_id, *totals) for (hour, machine_id), totals in usage.items()])
+
+def rebuild_machine_usage(db):
+    """Recompute the hourly usage rollup from bookings and the archive"""
+    db.execute('DELETE FROM machine_usage_hourly')
+    usage = {}
+    for booking in iter_rows(db.execute('''
+        SELECT machine_id, start_time, end_time, status, cancelled_at FROM bookings
+        UNION ALL
+        SELECT machine_id, start_time, end_time, status, cancelled_at FROM bookings_archive
+    ''')):
+        cancelled = booking['status'] == 'cancelled'
+        add_usage(usage, booking['machine_id'], booking['start_time'], booking['end_time'],
+                  busy=0 if cancelled else 1, bookings=1, cancelled=int(cancelled),
+                  late_cancelled=int(cancelled and is_late_cancellation(booking['start_time'],
+                                                                        booking['cancelled_at'])),
+                  completed=int(booking['status'] == 'completed'))
+    store_usage(db, usage)
+    return len(usage)
+
+def publish_event(db, event_type, data):
+    """Append a change event (inside a write_transaction); once it commits the
+    event is applied to the read model and streamed to clients"""
+    event_id = db.execute('''
+        INSERT INTO change_events (event_type, data) VALUES (?, ?)
+    ''', (event_type, json.dumps(data, separators=(',', ':')))).lastrowid
+    db.published.append((event_id, event_type, data))
+    return event_id
+
+class EventBroadcaster:
+    """Fans a shard's change_events log out to every SSE subscriber in this process.
+    
+    One poller thread per process and shard tails the table; subscribers only
+    wait on a condition variable, so idle streams cost no database work.
+    """
+    
+    def __init__(self, database):
+        self.database = database
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._ids = []
+        self._events = []
+        self._latest_id = 0
+        self._thread = None
+        self._pid = None
+    
+    def _ensure_started(self):
+        with self._cond:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._ids, self._events = [], []
+            pool = get_pool(self.database)
+            db = pool.acquire()
+            try:
+                self._latest_id = db.execute('SELECT COALESCE(MAX(id), 0) FROM change_events').fetchone()[0]
+            finally:
+                pool.release(db)
+            self._thread = threading.Thread(target=self._run, name='event-broadcaster', daemon=True)
+            self._thread.start()
+    
+    def wake(self):
+        """Poll immediately (called after this process commits an event)"""
+        self._wake.set()
+    
+    def latest_id(self):
+        self._ensure_started()
+        return self._latest_id
+    
+    def _run(self):
+        last_prune = time.monotonic()
+        while True:
+            self._wake.wait(EVENT_POLL_INTERVAL)
+            self._wake.clear()
+            pool = get_pool(self.database)
+            db = pool.acquire()
+            try:
+                rows = db.execute('''
+                    SELECT id, event_type, data FROM change_events
+                    WHERE id > ? ORDER BY id LIMIT 500
+                ''', (self._latest_id,)).fetchall()
+                if time.monotonic() - last_prune > 60:
+                    db.execute('DELETE FROM change_events WHERE id <= ?',
+                               (self._latest_id - EVENT_RETENTION,))
+                    db.commit()
+                    last_prune = time.monotonic()
+            except sqlite3.Error as e:
+                print(f"Event broadcaster error: {str(e)}")
+                rows = []
+            finally:
+                pool.release(db)
+            
+            if rows:
+                with self._cond:
+                    for row in rows:
+                        self._ids.append(row['id'])
+                        self._events.append(format_sse(row['id'], row['event_type'], row['data']))
+                    if len(self._ids) > 2 * EVENT_BUFFER_SIZE:
+                        del self._ids[:-EVENT_BUFFER_SIZE], self._events[:-EVENT_BUFFER_SIZE]
+                    self._latest_id = rows[-1]['id']
+                    self._cond.notify_all()
+                if len(rows) == 500:
+                    self._wake.set()
+    
+    def events_after(self, last_id, timeout):
+        """Wait up to `timeout` for events newer than last_id.
+        
+        Returns (new_last_id, messages); messages is None when there are newer
+        events the in-memory buffer does not hold (it starts empty after a
+        restart) and the caller must catch up from the database.
+        """
+        self._ensure_started()
+        with self._cond:
+            if self._latest_id <= last_id:
+                self._cond.wait(timeout)
+            if last_id < self._latest_id and not (self._ids and self._ids[0] <= last_id + 1):
+                return last_id, None
+            i = bisect_right(self._ids, last_id)
+            return self._latest_id, self._events[i:]
+
+# database file -> EventBroadcaster of that shard
+_broadcasters = {}
+_broadcasters_lock = threading.Lock()
+
+def get_broadcaster(database=None):
+    """Get the event broadcaster for a database file (the current hostel's by default)"""
+    database = database or current_database()
+    broadcaster = _broadcasters.get(database)
+    if broadcaster is None:
+        with _broadcasters_lock:
+            broadcaster = _broadcasters.setdefault(database, EventBroadcaster(database))
+    return broadcaster
+
+def format_sse(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n"
+
+def read_event_backlog(database, last_id):
+    """Events after last_id from the database, or None if they were pruned"""
+    pool = get_pool(database)
+    db = pool.acquire()
+    try:
+        oldest = db.execute('SELECT MIN(id) FROM change_events').fetchone()[0]
+        if oldest is None or last_id < oldest - 1:
+            return None
+        rows = db.execute('''
+            SELECT id, event_type, data FROM change_events
+            WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, EVENT_BUFFER_SIZE)).fetchall()
+        return [(row['id'], format_sse(row['id'], row['event_type'], row['data'])) for row in rows]
+    finally:
+        pool.release(db)
 
 def hash_password(password):
     """Hash password using SHA-256"""
@@ -124,29 +1804,324 @@ def verify_password(password, hashed):
     """Verify password against hash"""
     return hash_password(password) == hashed
 
-def send_email(to_email, subject, body):
-    """Send email notification"""
-    try:
+def queue_email(db, to_email, subject, body):
+    """Add an email to the outbox; delivered once the caller commits"""
+    cursor = db.execute('''
+        INSERT INTO email_outbox (to_email, subject, body, next_attempt_at)
+        VALUES (?, ?, ?, ?)
+    ''', (to_email, subject, body, time.time()))
+    return cursor.lastrowid
+
+class SMTPSession:
+    """Long-lived authenticated SMTP connection, reopened on demand"""
+    
+    def __init__(self):
+        self._server = None
+        self._last_used = 0
+    
+    def _connect(self):
+        server = smtplib.SMTP(EMAIL_HOST, EMAIL_PORT, timeout=30)
+        if EMAIL_USE_TLS:
+            server.starttls()
+        if EMAIL_PASSWORD:
+            server.login(EMAIL_USER, EMAIL_PASSWORD)
+        self._server = server
+    
+    def send(self, to_email, subject, body):
+        """Send one email, reconnecting once if the session has dropped"""
         msg = MIMEMultipart()
         msg['From'] = EMAIL_FROM
         msg['To'] = to_email
         msg['Subject'] = subject
-        
         msg.attach(MIMEText(body, 'html'))
-        
-        server = smtplib.SMTP(EMAIL_HOST, EMAIL_PORT)
-        server.starttls()
-        server.login(EMAIL_USER, EMAIL_PASSWORD)
         text = msg.as_string()
-        server.sendmail(EMAIL_USER, to_email, text)
-        server.quit()
-        return True
-    except Exception as e:
-        print(f"Email sending failed: {str(e)}")
-        return False
+        
+        for attempt in range(2):
+            if self._server is None:
+                self._connect()
+            t0 = time.perf_counter()
+            try:
+                self._server.sendmail(EMAIL_USER, to_email, text)
+                self._last_used = time.monotonic()
+                metrics.observe('smtp_send_duration_seconds', (('result', 'sent'),), time.perf_counter() - t0)
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                self._server = None
+                metrics.observe('smtp_send_duration_seconds', (('result', 'disconnected'),), time.perf_counter() - t0)
+                if attempt:
+                    raise
+            except smtplib.SMTPException:
+                metrics.observe('smtp_send_duration_seconds', (('result', 'error'),), time.perf_counter() - t0)
+                raise
+    
+    def close_if_idle(self):
+        if self._server is not None and time.monotonic() - self._last_used > EMAIL_SMTP_IDLE_TIMEOUT:
+            self.close()
+    
+    def close(self):
+        server, self._server = self._server, None
+        if server is not None:
+            try:
+                server.quit()
+            except smtplib.SMTPException:
+                server.close()
+
+def claim_email_jobs(db, limit=EMAIL_BATCH_SIZE):
+    """Lease a batch of due outbox rows to this process"""
+    now = time.time()
+    with write_transaction(db):
+        jobs = db.execute('''
+            SELECT id, to_email, subject, body, attempts FROM email_outbox
+            WHERE status IN ('pending', 'sending') AND next_attempt_at <= ?
+            ORDER BY next_attempt_at
+            LIMIT ?
+        ''', (now, limit)).fetchall()
+        db.executemany('''
+            UPDATE email_outbox
+            SET status = 'sending', attempts = attempts + 1, next_attempt_at = ?
+            WHERE id = ?
+        ''', [(now + EMAIL_CLAIM_LEASE_SECONDS, job['id']) for job in jobs])
+    return jobs
+
+def drain_email_outbox(session, database=None):
+    """Deliver every due outbox email over one SMTP session; returns the number sent"""
+    pool = get_pool(database)
+    db = pool.acquire()
+    sent = 0
+    try:
+        while True:
+            jobs = claim_email_jobs(db)
+            if not jobs:
+                return sent
+            results = []
+            for job in jobs:
+                attempts = job['attempts'] + 1
+                try:
+                    session.send(job['to_email'], job['subject'], job['body'])
+                    sent_at = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+                    results.append(('sent', None, 0, sent_at, job['id']))
+                    sent += 1
+                except Exception as e:
+                    if isinstance(e, smtplib.SMTPRecipientsRefused) or attempts >= EMAIL_MAX_ATTEMPTS:
+                        status = 'dead'
+                    else:
+                        status = 'pending'
+                    print(f"Email sending failed (job {job['id']}, attempt {attempts}): {str(e)}")
+                    retry_at = time.time() + EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+                    results.append((status, str(e), retry_at, None, job['id']))
+            db.executemany('''
+                UPDATE email_outbox
+                SET status = ?, last_error = ?, next_attempt_at = ?, sent_at = ?
+                WHERE id = ?
+            ''', results)
+            db.commit()
+    finally:
+        pool.release(db)
+
+class EmailOutboxWorker:
+    """Background thread draining the email outbox"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+    
+    def ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='email-outbox', daemon=True)
+                self._thread.start()
+    
+    def notify(self):
+        """Wake the worker (starting it if needed) after queueing an email"""
+        self.ensure_started()
+        self._wake.set()
+    
+    def _run(self):
+        session = SMTPSession()
+        while True:
+            self._wake.clear()
+            for hostel in HOSTELS:
+                try:
+                    drain_email_outbox(session, hostel_database(hostel))
+                except Exception as e:
+                    print(f"Email outbox worker error ({hostel}): {str(e)}")
+                    session.close()
+            session.close_if_idle()
+            self._wake.wait(EMAIL_POLL_INTERVAL)
+
+email_worker = EmailOutboxWorker()
+
+def complete_finished_bookings(db, now=None, batch_size=LIFECYCLE_BATCH_SIZE):
+    """Move one batch of bookings that have ended to 'completed'; returns how many.
+    
+    Due bookings are read in end-time order from the partial index on active
+    bookings, so every pass only touches rows that actually need work and
+    completed rows drop out of the hot indexes. Each batch is one write
+    transaction and the UPDATEs re-check the status, so several workers
+    (or nodes) can run this concurrently without double-processing.
+    """
+    now = now or format_timestamp(datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None))
+    with write_transaction(db):
+        due = db.execute('''
+            SELECT id, user_id, machine_id, start_time, end_time FROM bookings
+            INDEXED BY idx_bookings_active_end
+            WHERE status IN ('pending', 'confirmed') AND end_time <= ?
+            ORDER BY end_time
+            LIMIT ?
+        ''', (now, batch_size)).fetchall()
+        if not due:
+            return 0
+        
+        db.executemany('''
+            UPDATE bookings SET status = 'completed'
+            WHERE id = ? AND status IN ('pending', 'confirmed')
+        ''', [(booking['id'],) for booking in due])
+        
+        by_user = {}
+        for booking in due:
+            by_user.setdefault(booking['user_id'], []).append(booking['id'])
+        for user_id, booking_ids in by_user.items():
+            quota_remove_bookings(db, user_id, booking_ids)
+        
+        usage = {}
+        for booking in due:
+            add_usage(usage, booking['machine_id'], booking['start_time'], booking['end_time'], completed=1)
+        store_usage(db, usage)
+        
+        # Stamp each machine with its most recent user
+        last_use = {}
+        for booking in due:
+            last_use[booking['machine_id']] = (booking['user_id'], booking['end_time'])
+        db.executemany('''
+            UPDATE washing_machines SET last_used_by = ?, last_used_time = ?
+            WHERE id = ? AND (last_used_time IS NULL OR last_used_time < ?)
+        ''', [(user_id, end_time, machine_id, end_time)
+              for machine_id, (user_id, end_time) in last_use.items()])
+        
+        publish_event(db, 'bookings_completed', {
+            'booking_ids': [booking['id'] for booking in due],
+            'machine_ids': sorted(last_use)
+        })
+    
+    return len(due)
+
+def archive_cutoff():
+    """Bookings starting before this timestamp belong in the archive once finished"""
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return format_timestamp(now - datetime.timedelta(days=ARCHIVE_AFTER_DAYS))
+
+def archive_old_bookings(db, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move one batch of finished bookings past the horizon to bookings_archive; returns how many"""
+    with write_transaction(db):
+        ids = [row['id'] for row in db.execute('''
+            SELECT id FROM bookings
+            WHERE status IN ('completed', 'cancelled') AND start_time < ?
+            LIMIT ?
+        ''', (archive_cutoff(), batch_size)).fetchall()]
+        if not ids:
+            return 0
+        placeholders = ','.join('?' * len(ids))
+        db.execute(f'''
+            INSERT OR IGNORE INTO bookings_archive
+                (id, user_id, machine_id, start_time, end_time, status, created_at, cancelled_at)
+            SELECT id, user_id, machine_id, start_time, end_time, status, created_at, cancelled_at
+            FROM bookings WHERE id IN ({placeholders})
+        ''', ids)
+        db.execute(f'DELETE FROM bookings WHERE id IN ({placeholders})', ids)
+    return len(ids)
+
+def run_booking_lifecycle(database=None):
+    """Complete every booking that has ended, archive old ones and drop
+    expired idempotency keys and idle rate-limit buckets; returns (completed, archived)"""
+    pool = get_pool(database)
+    db = pool.acquire()
+    try:
+        completed = archived = 0
+        while True:
+            batch = complete_finished_bookings(db)
+            completed += batch
+            if batch < LIFECYCLE_BATCH_SIZE:
+                break
+        # Small transactions, so bookings are never blocked for long
+        while True:
+            batch = archive_old_bookings(db)
+            archived += batch
+            if batch < ARCHIVE_BATCH_SIZE:
+                break
+        while prune_idempotency_keys(db) == IDEMPOTENCY_PRUNE_BATCH_SIZE:
+            pass
+        if ADMISSION_ENABLED:
+            while admission.prune_buckets(database or current_database()) == BUCKET_PRUNE_BATCH_SIZE:
+                pass
+        return completed, archived
+    finally:
+        pool.release(db)
+
+class LifecycleWorker:
+    """Background thread that periodically completes finished bookings and
+    checks the read models against the database"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+    
+    def ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='booking-lifecycle', daemon=True)
+                self._thread.start()
+    
+    def _check_read_models(self):
+        for model in list(read_models.values()):
+            if model.version is None:
+                continue
+            pool = get_pool(model.database)
+            db = pool.acquire()
+            try:
+                check_read_model(db)
+            finally:
+                pool.release(db)
+    
+    def _run(self):
+        last_check = time.monotonic()
+        while True:
+            if time.monotonic() - last_check > READ_MODEL_CHECK_INTERVAL:
+                last_check = time.monotonic()
+                try:
+                    self._check_read_models()
+                except Exception as e:
+                    print(f"Read model check error: {str(e)}")
+            for hostel in HOSTELS:
+                try:
+                    run_booking_lifecycle(hostel_database(hostel))
+                except DatabaseBusyError:
+                    pass    # another worker holds the lock; try again next pass
+                except Exception as e:
+                    print(f"Booking lifecycle worker error ({hostel}): {str(e)}")
+            # Jitter keeps workers started together from polling in lockstep
+            time.sleep(LIFECYCLE_INTERVAL * random.uniform(0.8, 1.2))
 
-def send_booking_confirmation_email(user_email, username, machine_name, start_time, end_time, booking_id):
-    """Send booking confirmation email"""
+lifecycle_worker = LifecycleWorker()
+
+@app.before_request
+def start_background_workers():
+    """Start this process's background threads on its first request"""
+    if not BACKGROUND_WORKERS:
+        return
+    lifecycle_worker.ensure_started()
+    email_worker.ensure_started()
+
+def queue_booking_confirmation_email(db, user_email, username, machine_name, start_time, end_time, booking_id):
+    """Queue booking confirmation email"""
     subject = "Washing Machine Booking Confirmation - LNMIIT Girls Hostel"
     
     body = f"""
@@ -180,7 +2155,356 @@ def send_booking_confirmation_email(user_email, username, machine_name, start_ti
     </html>
     """
     
-    return send_email(user_email, subject, body)
+    return queue_email(db, user_email, subject, body)
+
+def queue_booking_change_email(db, user_email, username, booking_id, machine_name, start_time, end_time,
+                               new_machine_name=None):
+    """Queue the email telling a student their booking was moved to another
+    machine (or cancelled, without `new_machine_name`) because its machine broke"""
+    if new_machine_name:
+        subject = "Washing Machine Booking Moved - LNMIIT Girls Hostel"
+        change = f"has been moved to <strong>{new_machine_name}</strong>, at the same time"
+    else:
+        subject = "Washing Machine Booking Cancelled - LNMIIT Girls Hostel"
+        change = "has been cancelled, as no other machine is free at that time. Please book another slot"
+    
+    body = f"""
+    <html>
+    <body>
+        <p>Dear {username},</p>
+        
+        <p>{machine_name} is out of order, so your booking #{booking_id}
+        ({start_time} to {end_time}) {change}.</p>
+        
+        <p>Best regards,<br>
+        LNMIIT Girls Hostel Management</p>
+    </body>
+    </html>
+    """
+    
+    return queue_email(db, user_email, subject, body)
+
+# Columns of each row list the API returns, in the order rows carry them
+MACHINE_COLUMNS = ('id', 'machine_name', 'status', 'last_used_by', 'last_used_time')
+ADMIN_MACHINE_COLUMNS = MACHINE_COLUMNS + ('last_used_by_name',)
+MACHINE_BOOKING_COLUMNS = ('id', 'username', 'student_id', 'start_time', 'end_time', 'status', 'created_at')
+USER_BOOKING_COLUMNS = ('id', 'machine_name', 'start_time', 'end_time', 'status', 'created_at')
+ADMIN_BOOKING_COLUMNS = ('id', 'username', 'student_id', 'machine_name', 'start_time', 'end_time', 'status', 'created_at')
+
+# Compact alternative to a list of objects, {"columns": [...], "rows": [[...], ...]};
+# clients opt in with the Accept header
+COLUMNAR_MIMETYPE = 'application/vnd.washing-machine.columnar+json'
+
+def json_dumps(obj):
+    """Compact JSON as bytes, encoded by orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode()
+
+def wants_columnar():
+    """Whether the client prefers the columnar format over plain JSON"""
+    best = request.accept_mimetypes.best_match(('application/json', COLUMNAR_MIMETYPE))
+    return best == COLUMNAR_MIMETYPE
+
+def encode_row_batch(rows, columns, columnar):
+    """Rows (sqlite3.Row or tuples, values in `columns` order) ready for json_dumps"""
+    if columnar:
+        return [tuple(row) for row in rows]
+    return [dict(zip(columns, row)) for row in rows]
+
+def rows_payload(key, rows, columns, columnar, **extra):
+    """`{key: [objects], **extra}`, or `{"columns", "rows", **extra}` when columnar"""
+    if columnar:
+        return {'columns': columns, 'rows': encode_row_batch(rows, columns, True), **extra}
+    return {key: encode_row_batch(rows, columns, False), **extra}
+
+def rows_response(key, rows, columns, **extra):
+    """Respond with a row list in the format the client accepts"""
+    columnar = wants_columnar()
+    response = app.response_class(
+        json_dumps(rows_payload(key, rows, columns, columnar, **extra)),
+        mimetype=COLUMNAR_MIMETYPE if columnar else 'application/json'
+    )
+    response.vary.add('Accept')
+    return response
+
+def encode_cursor(start_time, booking_id):
+    """Opaque keyset cursor for the booking after which the next page starts"""
+    raw = json.dumps([start_time, booking_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        start_time, booking_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return start_time, int(booking_id)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+def booking_filters(args, allowed=('status', 'machine_id', 'student_id', 'from', 'to')):
+    """Translate query-string filters into SQL conditions on `b` (bookings) and `u` (users)"""
+    conditions = {
+        'status': 'b.status = ?',
+        'machine_id': 'b.machine_id = ?',
+        'student_id': 'u.student_id = ?',
+        'from': 'b.start_time >= ?',
+        'to': 'b.start_time < ?'
+    }
+    where, params = [], []
+    for name in allowed:
+        value = args.get(name)
+        if value:
+            where.append(conditions[name])
+            params.append(int(value) if name == 'machine_id' else value)
+    return where, params
+
+def needs_archive(args):
+    """Whether a booking history query can match rows in bookings_archive"""
+    if args.get('status') in ('pending', 'confirmed'):
+        return False
+    # Archived bookings all started before the current archive cutoff
+    return not args.get('from') or args['from'] < archive_cutoff()
+
+def iter_rows(cursor):
+    while True:
+        rows = cursor.fetchmany(STREAM_FETCH_SIZE)
+        if not rows:
+            return
+        yield from rows
+
+def merged_rows(db, queries):
+    """Rows of several queries, each ordered newest first, merged into one such ordering"""
+    iterators = [iter_rows(db.execute(query, params)) for query, params in queries]
+    if len(iterators) == 1:
+        return iterators[0]
+    return heapq.merge(*iterators, key=lambda row: (row['start_time'], row['id']), reverse=True)
+
+def booking_list_response(select, where, params, columns):
+    """Respond with bookings newest first, either one keyset page or streamed.
+    
+    With `?limit=` (and optionally `?cursor=`) a single page is returned along
+    with `next_cursor`. Without it every matching booking is streamed in the
+    usual `{"bookings": [...]}` shape, straight from the database cursor.
+    
+    `select` reads `FROM bookings b` and returns exactly `columns`, in order;
+    when the filters reach past the archive horizon the same query also runs
+    against bookings_archive and the two ordered results are merged.
+    """
+    where = list(where)
+    params = list(params)
+    cursor = request.args.get('cursor')
+    if cursor:
+        where.append('(b.start_time, b.id) < (?, ?)')
+        params.extend(decode_cursor(cursor))
+    query = select
+    if where:
+        query += ' WHERE ' + ' AND '.join(where)
+    query += ' ORDER BY b.start_time DESC, b.id DESC'
+    queries = [query]
+    if needs_archive(request.args):
+        queries.append(query.replace('FROM bookings b', 'FROM bookings_archive b'))
+    
+    limit = request.args.get('limit')
+    if limit is not None:
+        limit = max(1, min(int(limit), MAX_BOOKING_PAGE_SIZE))
+        rows = list(islice(merged_rows(get_db(), [
+            (q + ' LIMIT ?', params + [limit + 1]) for q in queries
+        ]), limit + 1))
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['start_time'], rows[-1]['id'])
+        return rows_response('bookings', rows, columns, next_cursor=next_cursor)
+    
+    columnar = wants_columnar()
+    response = Response(stream_json_rows('bookings', [(q, params) for q in queries], columns,
+                                         current_database(), columnar),
+                        mimetype=COLUMNAR_MIMETYPE if columnar else 'application/json')
+    response.vary.add('Accept')
+    return response
+
+def stream_json_rows(key, queries, columns, database, columnar=False):
+    """Yield `{"<key>": [...]}` (or the columnar shape) incrementally,
+    holding one batch of rows at a time"""
+    # The response outlives the request context, so use a connection of our own
+    pool = get_pool(database)
+    db = pool.acquire()
+    try:
+        rows = merged_rows(db, queries)
+        if columnar:
+            yield b'{"columns":' + json_dumps(columns) + b',"rows":['
+        else:
+            yield b'{"%s":[' % key.encode()
+        separator = b''
+        while True:
+            batch = list(islice(rows, STREAM_FETCH_SIZE))
+            if not batch:
+                break
+            # One encoder call per batch; strip the list's brackets
+            yield separator + json_dumps(encode_row_batch(batch, columns, columnar))[1:-1]
+            separator = b','
+        yield b']}'
+    finally:
+        pool.release(db)
+
+# Columns of booking exports; rows come in booking id order, so the last id
+# exported is where the next incremental export starts
+EXPORT_COLUMNS = ('id', 'user_id', 'student_id', 'username', 'machine_id', 'machine_name',
+                  'start_time', 'end_time', 'status', 'created_at')
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+def export_rows(db, since_id=0, start=None, end=None):
+    """Bookings (live and archived) with id > since_id and a start time in
+    [start, end), joined with their user and machine, in id order.
+    
+    Both tables are walked in rowid order (NOT INDEXED keeps the planner
+    from picking a start-time index that would need a sort), and merged by
+    id, so memory stays at one fetch batch per table.
+    """
+    where, params = ['b.id > ?'], [since_id]
+    if start:
+        where.append('b.start_time >= ?')
+        params.append(start)
+    if end:
+        where.append('b.start_time < ?')
+        params.append(end)
+    queries = [(f'''
+        SELECT b.id, b.user_id, u.student_id, u.username, b.machine_id, m.machine_name,
+               b.start_time, b.end_time, b.status, b.created_at
+        FROM {table} b NOT INDEXED
+        LEFT JOIN users u ON u.id = b.user_id
+        LEFT JOIN washing_machines m ON m.id = b.machine_id
+        WHERE {' AND '.join(where)}
+        ORDER BY b.id
+    ''', params) for table in ('bookings', 'bookings_archive')]
+    return heapq.merge(*[iter_rows(db.execute(query, params)) for query, params in queries],
+                       key=lambda row: row['id'])
+
+def encode_export(rows, fmt):
+    """Yield rows as CSV (with a header line) or NDJSON, one fetch batch per chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if fmt == 'csv':
+        writer.writerow(EXPORT_COLUMNS)
+    while True:
+        batch = list(islice(rows, STREAM_FETCH_SIZE))
+        if not batch:
+            break
+        if fmt == 'csv':
+            writer.writerows(batch)
+            chunk = buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        else:
+            chunk = b''.join(json_dumps(dict(zip(EXPORT_COLUMNS, row))) + b'\n' for row in batch)
+        yield chunk
+    if fmt == 'csv' and buffer.tell():
+        yield buffer.getvalue().encode()
+
+@contextmanager
+def export_snapshot(database):
+    """A connection reading one consistent snapshot, so bookings archived
+    while an export runs are seen exactly once"""
+    pool = get_pool(database)
+    db = pool.acquire()
+    try:
+        db.execute('BEGIN')
+        try:
+            yield db
+        finally:
+            db.commit()
+    finally:
+        pool.release(db)
+
+def stream_export(database, fmt, since_id, start, end):
+    # The response outlives the request context, so use a connection of our own
+    with export_snapshot(database) as db:
+        yield from encode_export(export_rows(db, since_id, start, end), fmt)
+
+# Every write path appends to change_events in its transaction, so the
+# autoincrement sequence of that table doubles as a data version shared by
+# all workers through SQLite
+def current_data_version(db):
+    """Version of the data; changes whenever anything is written"""
+    row = db.execute(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'change_events'"
+    ).fetchone()
+    return row['seq'] if row else 0
+
+# (database file, name, columnar) -> (version, etag, serialized body)
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+def snapshot_response(name, build, columnar=None):
+    """Serve a cached JSON snapshot, rebuilt only when the data version changes.
+    
+    `build(db, columnar)` returns the payload. Responses carry a strong ETag
+    derived from the version, so a client revalidating with If-None-Match
+    gets 304 Not Modified and no body. `columnar` defaults to the client's
+    preference; pass False for payloads that have no columnar form.
+    """
+    db = get_db()
+    if columnar is None:
+        columnar = wants_columnar()
+    # Versions are per shard, so the hostel is part of the tag
+    name = f"{g.get('hostel', DEFAULT_HOSTEL)}-{name}" + ('-columnar' if columnar else '')
+    version = current_data_version(db)
+    etag = f'{name}-{version}'
+    
+    # Weak comparison: compressed responses carry the tag as weak
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        key = (db.database, name, columnar)
+        cached = _snapshots.get(key)
+        if cached is None or cached[0] != version:
+            # Read version and data from one snapshot so they agree
+            db.execute('BEGIN')
+            try:
+                version = current_data_version(db)
+                etag = f'{name}-{version}'
+                body = json_dumps(build(db, columnar))
+            finally:
+                db.commit()
+            with _snapshots_lock:
+                if len(_snapshots) >= SNAPSHOT_CACHE_SIZE:
+                    _snapshots.clear()
+                _snapshots[key] = (version, etag, body)
+        else:
+            _, etag, body = cached
+        response = app.response_class(
+            body, mimetype=COLUMNAR_MIMETYPE if columnar else 'application/json')
+    
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('X-Hostel')
+    response.vary.add('Accept')
+    return response
+
+def parse_timestamp(value):
+    """Parse an ISO 8601 timestamp as naive UTC (naive input is taken as UTC)"""
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def format_timestamp(value):
+    """Format like the browser's Date.toISOString(), which is how bookings are stored"""
+    return value.strftime('%Y-%m-%dT%H:%M:%S.') + f'{value.microsecond // 1000:03d}Z'
+
+# Active bookings overlapping [from, to) on any machine: those starting inside
+# the window (one range scan), plus those that started before it and are
+# still running, read per machine from the partial index of active bookings
+AVAILABILITY_QUERY = '''
+    SELECT machine_id, start_time, end_time FROM bookings
+    WHERE status IN ('pending', 'confirmed')
+    AND start_time >= ? AND start_time < ?
+    UNION ALL
+    SELECT b.machine_id, b.start_time, b.end_time
+    FROM washing_machines m
+    CROSS JOIN bookings b INDEXED BY idx_bookings_active_interval
+    WHERE b.machine_id = m.id AND b.status IN ('pending', 'confirmed')
+    AND b.start_time < ? AND b.end_time > ?
+'''
 
 # API Routes
 
@@ -292,30 +2616,18 @@ def admin_login():
 @app.route('/api/machines', methods=['GET'])
 def get_machines():
     """Get all washing machines"""
+    def build(db, columnar):
+        return rows_payload('machines', read_model(db).machine_rows(db), MACHINE_COLUMNS, columnar)
+    
     try:
-        db = get_db()
-        machines = db.execute('''
-            SELECT id, machine_name, status, last_used_by, last_used_time
-            FROM washing_machines
-            ORDER BY id
-        ''').fetchall()
-        
-        machines_list = []
-        for machine in machines:
-            machines_list.append({
-                'id': machine['id'],
-                'machine_name': machine['machine_name'],
-                'status': machine['status'],
-                'last_used_by': machine['last_used_by'],
-                'last_used_time': machine['last_used_time']
-            })
-        
-        return jsonify({'machines': machines_list}), 200
+        return snapshot_response('machines', build)
         
     except Exception as e:
         return jsonify({'message': f'Failed to get machines: {str(e)}'}), 500
 
 @app.route('/api/bookings', methods=['POST'])
+@idempotent
+@admission_control('booking', queue_writes=True)
 def create_booking():
     """Create a new booking"""
     try:
@@ -328,83 +2640,124 @@ def create_booking():
         if not all([user_id, machine_id, start_time, end_time]):
             return jsonify({'message': 'All fields are required'}), 400
         
-        db = get_db()
-        
-        # Check if machine is available
-        machine = db.execute(
-            'SELECT status FROM washing_machines WHERE id = ?', (machine_id,)
-        ).fetchone()
-        
-        if not machine:
-            return jsonify({'message': 'Machine not found'}), 404
-        
-        if machine['status'] != 'available':
-            return jsonify({'message': 'Machine is not available'}), 400
-        
-        # Check for conflicting bookings
-        conflicts = db.execute('''
-            SELECT id FROM bookings 
-            WHERE machine_id = ? AND status IN ('pending', 'confirmed')
-            AND (
-                (start_time <= ? AND end_time > ?) OR
-                (start_time < ? AND end_time >= ?) OR
-                (start_time >= ? AND end_time <= ?)
-            )
-        ''', (machine_id, start_time, start_time, end_time, end_time, start_time, end_time)).fetchall()
-        
-        if conflicts:
-            return jsonify({'message': 'Time slot conflicts with existing booking'}), 400
-        
-        # Check 10-day booking restriction per user
-        from datetime import datetime, timedelta
-        current_time = datetime.now()
-        ten_days_from_now = current_time + timedelta(days=10)
-        
-        # Count existing bookings for this user in the next 10 days
-        existing_bookings = db.execute('''
-            SELECT COUNT(*) as count FROM bookings 
-            WHERE user_id = ? AND status IN ('pending', 'confirmed')
-            AND start_time BETWEEN ? AND ?
-        ''', (user_id, current_time.isoformat(), ten_days_from_now.isoformat())).fetchone()
-        
-        if existing_bookings['count'] >= 1:
-            return jsonify({'message': 'You can only book one slot in the next 10 days'}), 400
-        
-        # Create booking
-        cursor = db.execute('''
-            INSERT INTO bookings (user_id, machine_id, start_time, end_time, status)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, machine_id, start_time, end_time, 'confirmed'))
-        
-        booking_id = cursor.lastrowid
-        
-        # Get user and machine details for email
-        user = db.execute('''
-            SELECT username, email FROM users WHERE id = ?
-        ''', (user_id,)).fetchone()
+        # machine_id is one machine, "any" for whichever is free, or a list
+        # of machines to try in order
+        auto_assign = machine_id == 'any' or isinstance(machine_id, list)
+        preferences = None
+        try:
+            user_id = int(user_id)
+            if isinstance(machine_id, list):
+                preferences = [int(m) for m in machine_id]
+            elif not auto_assign:
+                machine_id = int(machine_id)
+        except (TypeError, ValueError):
+            return jsonify({'message': 'Invalid user or machine ID'}), 400
+        
+        # Every stored timestamp is compared as text in toISOString form
+        # (conflicts, quota window, completion, availability), so normalize
+        try:
+            start, end = parse_timestamp(start_time), parse_timestamp(end_time)
+        except (TypeError, ValueError):
+            return jsonify({'message': 'Start and end time must be ISO 8601 timestamps'}), 400
+        if end <= start:
+            return jsonify({'message': 'End time must be after start time'}), 400
+        start_time, end_time = format_timestamp(start), format_timestamp(end)
         
-        machine = db.execute('''
-            SELECT machine_name FROM washing_machines WHERE id = ?
-        ''', (machine_id,)).fetchone()
+        db = get_db()
         
-        db.commit()
+        # Checks and insert run as one atomic unit, so two students racing for
+        # the same slot cannot both pass the checks; the loser sees the conflict
+        with write_transaction(db):
+            if auto_assign:
+                # Picked and booked under the same write lock, so the machine
+                # cannot be taken in between
+                machine = read_model(db).place(db, start_time, end_time, preferences,
+                                               PLACEMENT_POLICIES[PLACEMENT_POLICY])
+                if machine is None:
+                    return jsonify({'message': 'No machine is free at this time'}), 409
+                machine_id = machine.id
+            else:
+                # Check if machine is available
+                machine = db.execute(
+                    'SELECT status FROM washing_machines WHERE id = ?', (machine_id,)
+                ).fetchone()
+                
+                if not machine:
+                    return jsonify({'message': 'Machine not found'}), 404
+                
+                if machine['status'] != 'available':
+                    return jsonify({'message': 'Machine is not available'}), 400
+                
+                # Check for conflicting bookings
+                if find_conflicting_booking(db, machine_id, start_time, end_time) is not None:
+                    return jsonify({'message': 'Time slot conflicts with existing booking'}), 409
+            
+            # Check booking quota per user (one slot per 10 days by default)
+            if bookings_within_quota_window(db, user_id) >= BOOKING_QUOTA_LIMIT:
+                slots = 'one slot' if BOOKING_QUOTA_LIMIT == 1 else f'{BOOKING_QUOTA_LIMIT} slots'
+                return jsonify({
+                    'message': f'You can only book {slots} in the next {BOOKING_QUOTA_WINDOW_DAYS} days'
+                }), 400
+            
+            # Create booking
+            created_at = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+            cursor = db.execute('''
+                INSERT INTO bookings (user_id, machine_id, start_time, end_time, status, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (user_id, machine_id, start_time, end_time, 'confirmed', created_at))
+            
+            booking_id = cursor.lastrowid
+            quota_add_booking(db, user_id, booking_id, start_time)
+            usage = {}
+            add_usage(usage, machine_id, start_time, end_time, busy=1, bookings=1)
+            store_usage(db, usage)
+            
+            # Get user and machine details for email
+            user = db.execute('''
+                SELECT username, email FROM users WHERE id = ?
+            ''', (user_id,)).fetchone()
+            
+            machine = db.execute('''
+                SELECT machine_name FROM washing_machines WHERE id = ?
+            ''', (machine_id,)).fetchone()
+            
+            # Queue email notification if user has email; it is committed with
+            # the booking and sent by the outbox worker, off the request path
+            email_queued = False
+            if user and user['email'] and machine:
+                queue_booking_confirmation_email(
+                    db,
+                    user['email'], 
+                    user['username'], 
+                    machine['machine_name'], 
+                    start_time, 
+                    end_time, 
+                    booking_id
+                )
+                email_queued = True
+            
+            publish_event(db, 'booking_created', {
+                'booking_id': booking_id,
+                'machine_id': machine_id,
+                'user_id': user_id,
+                'start_time': start_time,
+                'end_time': end_time,
+                'status': 'confirmed',
+                'created_at': created_at
+            })
         
-        # Send email notification if user has email
-        if user and user['email'] and machine:
-            send_booking_confirmation_email(
-                user['email'], 
-                user['username'], 
-                machine['machine_name'], 
-                start_time, 
-                end_time, 
-                booking_id
-            )
+        if email_queued:
+            email_worker.notify()
         
         return jsonify({
             'message': 'Booking created successfully',
-            'booking_id': booking_id
+            'booking_id': booking_id,
+            'machine_id': machine_id,
+            'machine_name': machine['machine_name'] if machine else None
         }), 201
         
+    except DatabaseBusyError as e:
+        return jsonify({'message': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'message': f'Booking failed: {str(e)}'}), 500
 
@@ -412,33 +2765,21 @@ def create_booking():
 def get_user_bookings(user_id):
     """Get bookings for a specific user"""
     try:
-        db = get_db()
-        bookings = db.execute('''
-            SELECT b.id, b.start_time, b.end_time, b.status, b.created_at,
-                   m.machine_name
+        where, params = booking_filters(request.args, allowed=('status', 'machine_id', 'from', 'to'))
+        return booking_list_response('''
+            SELECT b.id, m.machine_name, b.start_time, b.end_time, b.status, b.created_at
             FROM bookings b
             JOIN washing_machines m ON b.machine_id = m.id
-            WHERE b.user_id = ?
-            ORDER BY b.start_time DESC
-        ''', (user_id,)).fetchall()
-        
-        bookings_list = []
-        for booking in bookings:
-            bookings_list.append({
-                'id': booking['id'],
-                'machine_name': booking['machine_name'],
-                'start_time': booking['start_time'],
-                'end_time': booking['end_time'],
-                'status': booking['status'],
-                'created_at': booking['created_at']
-            })
-        
-        return jsonify({'bookings': bookings_list}), 200
+        ''', ['b.user_id = ?'] + where, [user_id] + params, USER_BOOKING_COLUMNS)
         
+    except ValueError:
+        return jsonify({'message': 'Invalid filter or cursor'}), 400
     except Exception as e:
         return jsonify({'message': f'Failed to get bookings: {str(e)}'}), 500
 
 @app.route('/api/bookings/<int:booking_id>', methods=['DELETE'])
+@idempotent
+@admission_control('write')
 def cancel_booking(booking_id):
     """Cancel a booking"""
     try:
@@ -446,62 +2787,64 @@ def cancel_booking(booking_id):
         
         db = get_db()
         
-        # Check if booking exists and belongs to user
-        booking = db.execute('''
-            SELECT id, user_id, status FROM bookings 
-            WHERE id = ? AND user_id = ?
-        ''', (booking_id, user_id)).fetchone()
-        
-        if not booking:
-            return jsonify({'message': 'Booking not found'}), 404
-        
-        if booking['status'] == 'completed':
-            return jsonify({'message': 'Cannot cancel completed booking'}), 400
-        
-        # Update booking status to cancelled
-        db.execute('''
-            UPDATE bookings SET status = 'cancelled' WHERE id = ?
-        ''', (booking_id,))
-        
-        db.commit()
+        with write_transaction(db):
+            # Check if booking exists and belongs to user
+            booking = db.execute('''
+                SELECT id, user_id, machine_id, start_time, end_time, status FROM bookings 
+                WHERE id = ? AND user_id = ?
+            ''', (booking_id, user_id)).fetchone()
+            
+            if not booking:
+                return jsonify({'message': 'Booking not found'}), 404
+            
+            if booking['status'] == 'completed':
+                return jsonify({'message': 'Cannot cancel completed booking'}), 400
+            
+            # Update booking status to cancelled
+            cancelled_at = format_timestamp(datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None))
+            db.execute('''
+                UPDATE bookings SET status = 'cancelled', cancelled_at = COALESCE(cancelled_at, ?)
+                WHERE id = ?
+            ''', (cancelled_at, booking_id))
+            quota_remove_bookings(db, booking['user_id'], [booking_id])
+            if booking['status'] != 'cancelled':
+                usage = {}
+                add_usage(usage, booking['machine_id'], booking['start_time'], booking['end_time'],
+                          busy=-1, cancelled=1,
+                          late_cancelled=int(is_late_cancellation(booking['start_time'], cancelled_at)))
+                store_usage(db, usage)
+            
+            publish_event(db, 'booking_cancelled', {
+                'booking_id': booking_id,
+                'machine_id': booking['machine_id'],
+                'user_id': booking['user_id'],
+                'start_time': booking['start_time'],
+                'end_time': booking['end_time']
+            })
         
         return jsonify({'message': 'Booking cancelled successfully'}), 200
         
+    except DatabaseBusyError as e:
+        return jsonify({'message': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'message': f'Failed to cancel booking: {str(e)}'}), 500
 
 @app.route('/api/admin/machines', methods=['GET'])
 def get_admin_machines():
     """Get all machines for admin"""
+    def build(db, columnar):
+        return rows_payload('machines', read_model(db).machine_rows(db, with_user_names=True),
+                            ADMIN_MACHINE_COLUMNS, columnar)
+    
     try:
-        db = get_db()
-        machines = db.execute('''
-            SELECT m.id, m.machine_name, m.status, m.last_used_by, m.last_used_time,
-                   u.username as last_used_by_name
-            FROM washing_machines m
-            LEFT JOIN users u ON m.last_used_by = u.id
-            ORDER BY m.id
-        ''').fetchall()
-        
-        machines_list = []
-        # Limit to only 8 machines for admin portal
-        limited_machines = machines[:8]
-        for machine in limited_machines:
-            machines_list.append({
-                'id': machine['id'],
-                'machine_name': machine['machine_name'],
-                'status': machine['status'],
-                'last_used_by': machine['last_used_by'],
-                'last_used_by_name': machine['last_used_by_name'],
-                'last_used_time': machine['last_used_time']
-            })
-        
-        return jsonify({'machines': machines_list}), 200
+        return snapshot_response('admin-machines', build)
         
     except Exception as e:
         return jsonify({'message': f'Failed to get machines: {str(e)}'}), 500
 
 @app.route('/api/admin/machines/<int:machine_id>/status', methods=['PUT'])
+@idempotent
+@admission_control('write')
 def update_machine_status(machine_id):
     """Update machine status"""
     try:
@@ -513,27 +2856,32 @@ def update_machine_status(machine_id):
         
         db = get_db()
         
-        # Check if machine exists
-        machine = db.execute(
-            'SELECT id FROM washing_machines WHERE id = ?', (machine_id,)
-        ).fetchone()
-        
-        if not machine:
-            return jsonify({'message': 'Machine not found'}), 404
-        
-        # Update machine status
-        db.execute('''
-            UPDATE washing_machines SET status = ? WHERE id = ?
-        ''', (status, machine_id))
-        
-        db.commit()
+        with write_transaction(db):
+            # Check if machine exists
+            machine = db.execute(
+                'SELECT id FROM washing_machines WHERE id = ?', (machine_id,)
+            ).fetchone()
+            
+            if not machine:
+                return jsonify({'message': 'Machine not found'}), 404
+            
+            # Update machine status
+            db.execute('''
+                UPDATE washing_machines SET status = ? WHERE id = ?
+            ''', (status, machine_id))
+            
+            publish_event(db, 'machine_status', {'machine_id': machine_id, 'status': status})
         
         return jsonify({'message': 'Machine status updated successfully'}), 200
         
+    except DatabaseBusyError as e:
+        return jsonify({'message': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'message': f'Failed to update machine status: {str(e)}'}), 500
 
 @app.route('/api/admin/machines', methods=['POST'])
+@idempotent
+@admission_control('write')
 def add_machine():
     """Add a new machine"""
     try:
@@ -545,102 +2893,672 @@ def add_machine():
         
         db = get_db()
         
-        # Insert new machine
-        cursor = db.execute('''
-            INSERT INTO washing_machines (machine_name, status)
-            VALUES (?, ?)
-        ''', (machine_name, 'available'))
-        
-        db.commit()
+        with write_transaction(db):
+            # Insert new machine
+            cursor = db.execute('''
+                INSERT INTO washing_machines (machine_name, status)
+                VALUES (?, ?)
+            ''', (machine_name, 'available'))
+            
+            publish_event(db, 'machine_added', {
+                'machine_id': cursor.lastrowid,
+                'machine_name': machine_name,
+                'status': 'available'
+            })
         
         return jsonify({
             'message': 'Machine added successfully',
             'machine_id': cursor.lastrowid
         }), 201
         
+    except DatabaseBusyError as e:
+        return jsonify({'message': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'message': f'Failed to add machine: {str(e)}'}), 500
 
+def parse_batch(data, key):
+    """The item list of a batch request body, or None if it is malformed"""
+    items = (data or {}).get(key)
+    if not isinstance(items, list) or not items or len(items) > ADMIN_BATCH_LIMIT:
+        return None
+    return items
+
+@app.route('/api/admin/machines/batch', methods=['POST'])
+@idempotent
+@admission_control('write')
+def add_machines():
+    """Add several machines in one transaction"""
+    try:
+        items = parse_batch(request.get_json(silent=True), 'machines')
+        if items is None:
+            return jsonify({'message': f'Send 1 to {ADMIN_BATCH_LIMIT} machines'}), 400
+        
+        results = []
+        names = []
+        for item in items:
+            name = item.get('machine_name') if isinstance(item, dict) else None
+            if not isinstance(name, str) or not name.strip():
+                results.append({'result': 'invalid', 'message': 'Machine name is required'})
+            else:
+                results.append({'result': 'created', 'machine_name': name})
+                names.append((name,))
+        
+        db = get_db()
+        
+        if names:
+            with write_transaction(db):
+                db.executemany('''
+                    INSERT INTO washing_machines (machine_name, status) VALUES (?, 'available')
+                ''', names)
+                # AUTOINCREMENT ids under the write lock: the batch got the
+                # consecutive ids ending at the table's sequence
+                last_id = db.execute(
+                    "SELECT seq FROM sqlite_sequence WHERE name = 'washing_machines'"
+                ).fetchone()['seq']
+                created = [result for result in results if result['result'] == 'created']
+                for machine_id, result in zip(range(last_id - len(created) + 1, last_id + 1), created):
+                    result['machine_id'] = machine_id
+                
+                publish_event(db, 'machines_added', {'machines': [
+                    {'machine_id': r['machine_id'], 'machine_name': r['machine_name'], 'status': 'available'}
+                    for r in created
+                ]})
+        
+        return jsonify({'message': f'Added {len(names)} of {len(items)} machine(s)', 'results': results}), \
+            201 if names else 400
+        
+    except DatabaseBusyError as e:
+        return jsonify({'message': str(e)}), 503, {'Retry-After': '1'}
+    except Exception as e:
+        return jsonify({'message': f'Failed to add machines: {str(e)}'}), 500
+
+def find_free_machine(db, candidates, start_time, end_time, taken):
+    """First machine in `candidates` with no active booking overlapping the
+    interval, counting the intervals already `taken` in this transaction"""
+    model = read_model(db)
+    for machine_id in candidates:
+        if model.find_overlap(db, machine_id, start_time, end_time) is not None:
+            continue
+        if any(start < end_time and start_time < end for start, end in taken.get(machine_id, ())):
+            continue
+        return machine_id
+    return None
+
+@app.route('/api/admin/machines/status', methods=['PUT'])
+@idempotent
+@admission_control('write')
+def update_machine_statuses():
+    """Change the status of several machines in one transaction.
+    
+    With `future_bookings` set to "cancel" or "reassign", the upcoming
+    bookings on machines marked broken are cancelled, or moved to another
+    available machine that is free for the slot (and cancelled if none is).
+    """
+    try:
+        data = request.get_json(silent=True)
+        items = parse_batch(data, 'machines')
+        future_bookings = (data or {}).get('future_bookings', 'keep')
+        if items is None:
+            return jsonify({'message': f'Send 1 to {ADMIN_BATCH_LIMIT} machines'}), 400
+        if future_bookings not in ('keep', 'cancel', 'reassign'):
+            return jsonify({'message': 'future_bookings must be keep, cancel or reassign'}), 400
+        
+        results = []
+        requested = {}
+        for item in items:
+            try:
+                machine_id = int(item['machine_id'])
+            except (TypeError, KeyError, ValueError):
+                results.append({'result': 'invalid', 'message': 'Invalid machine ID'})
+                continue
+            status = item.get('status')
+            if status not in ('available', 'in_use', 'broken'):
+                results.append({'machine_id': machine_id, 'result': 'invalid', 'message': 'Invalid status'})
+            elif machine_id in requested:
+                results.append({'machine_id': machine_id, 'result': 'invalid', 'message': 'Duplicate machine'})
+            else:
+                requested[machine_id] = status
+                results.append({'machine_id': machine_id, 'result': 'updated', 'status': status})
+        
+        if not requested:
+            return jsonify({'message': 'No machine was updated', 'results': results}), 400
+        
+        db = get_db()
+        cancelled, reassigned = [], []
+        email_queued = False
+        
+        with write_transaction(db):
+            placeholders = ','.join('?' * len(requested))
+            existing = {row['id'] for row in db.execute(f'''
+                SELECT id FROM washing_machines WHERE id IN ({placeholders})
+            ''', list(requested))}
+            for result in results:
+                if result['result'] == 'updated' and result['machine_id'] not in existing:
+                    result.update(result='not_found', message='Machine not found')
+                    del result['status']
+            updates = [(status, machine_id) for machine_id, status in requested.items() if machine_id in existing]
+            if not updates:
+                return jsonify({'message': 'No machine was updated', 'results': results}), 400
+            db.executemany('UPDATE washing_machines SET status = ? WHERE id = ?', updates)
+            
+            broken = [machine_id for status, machine_id in updates if status == 'broken']
+            if broken and future_bookings != 'keep':
+                now = format_timestamp(datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None))
+                placeholders = ','.join('?' * len(broken))
+                affected = db.execute(f'''
+                    SELECT b.id, b.user_id, b.machine_id, b.start_time, b.end_time,
+                           u.username, u.email, m.machine_name
+                    FROM bookings b INDEXED BY idx_bookings_active_interval
+                    JOIN users u ON u.id = b.user_id
+                    JOIN washing_machines m ON m.id = b.machine_id
+                    WHERE b.machine_id IN ({placeholders})
+                    AND b.status IN ('pending', 'confirmed') AND b.start_time >= ?
+                    ORDER BY b.start_time
+                ''', broken + [now]).fetchall()
+                
+                machine_names = {}
+                if future_bookings == 'reassign':
+                    # Statuses as of this batch's updates
+                    machine_names = dict(db.execute('''
+                        SELECT id, machine_name FROM washing_machines WHERE status = 'available' ORDER BY id
+                    ''').fetchall())
+                taken = {}
+                for booking in affected:
+                    machine_id = find_free_machine(db, machine_names, booking['start_time'],
+                                                   booking['end_time'], taken)
+                    if machine_id is None:
+                        cancelled.append(booking)
+                    else:
+                        taken.setdefault(machine_id, []).append((booking['start_time'], booking['end_time']))
+                        reassigned.append((booking, machine_id))
+                
+                db.executemany("UPDATE bookings SET status = 'cancelled', cancelled_at = ? WHERE id = ?",
+                               [(now, booking['id']) for booking in cancelled])
+                db.executemany('UPDATE bookings SET machine_id = ? WHERE id = ?',
+                               [(machine_id, booking['id']) for booking, machine_id in reassigned])
+                usage = {}
+                for booking in cancelled:
+                    add_usage(usage, booking['machine_id'], booking['start_time'], booking['end_time'],
+                              busy=-1, cancelled=1,
+                              late_cancelled=int(is_late_cancellation(booking['start_time'], now)))
+                for booking, machine_id in reassigned:
+                    add_usage(usage, booking['machine_id'], booking['start_time'], booking['end_time'],
+                              busy=-1, bookings=-1)
+                    add_usage(usage, machine_id, booking['start_time'], booking['end_time'],
+                              busy=1, bookings=1)
+                store_usage(db, usage)
+                by_user = {}
+                for booking in cancelled:
+                    by_user.setdefault(booking['user_id'], []).append(booking['id'])
+                for user_id, booking_ids in by_user.items():
+                    quota_remove_bookings(db, user_id, booking_ids)
+                
+                for booking, machine_id in [(b, None) for b in cancelled] + reassigned:
+                    if booking['email']:
+                        queue_booking_change_email(
+                            db, booking['email'], booking['username'], booking['id'],
+                            booking['machine_name'], booking['start_time'], booking['end_time'],
+                            machine_names.get(machine_id)
+                        )
+                        email_queued = True
+            
+            publish_event(db, 'machines_updated', {
+                'machines': [{'machine_id': machine_id, 'status': status} for status, machine_id in updates],
+                'cancelled': [
+                    {'booking_id': b['id'], 'machine_id': b['machine_id'], 'user_id': b['user_id']}
+                    for b in cancelled
+                ],
+                'reassigned': [
+                    {'booking_id': b['id'], 'from_machine_id': b['machine_id'],
+                     'machine_id': machine_id, 'user_id': b['user_id']}
+                    for b, machine_id in reassigned
+                ]
+            })
+        
+        if email_queued:
+            email_worker.notify()
+        
+        return jsonify({
+            'message': f'Updated {len(updates)} of {len(items)} machine(s)',
+            'results': results,
+            'cancelled_bookings': [booking['id'] for booking in cancelled],
+            'reassigned_bookings': [
+                {'booking_id': booking['id'], 'from_machine_id': booking['machine_id'], 'machine_id': machine_id}
+                for booking, machine_id in reassigned
+            ]
+        }), 200
+        
+    except DatabaseBusyError as e:
+        return jsonify({'message': str(e)}), 503, {'Retry-After': '1'}
+    except Exception as e:
+        return jsonify({'message': f'Failed to update machine status: {str(e)}'}), 500
+
 @app.route('/api/admin/bookings', methods=['GET'])
 def get_all_bookings():
     """Get all bookings for admin"""
     try:
-        db = get_db()
-        bookings = db.execute('''
-            SELECT b.id, b.start_time, b.end_time, b.status, b.created_at,
-                   u.username, u.student_id, m.machine_name
+        where, params = booking_filters(request.args)
+        return booking_list_response('''
+            SELECT b.id, u.username, u.student_id, m.machine_name,
+                   b.start_time, b.end_time, b.status, b.created_at
             FROM bookings b
             JOIN users u ON b.user_id = u.id
             JOIN washing_machines m ON b.machine_id = m.id
-            ORDER BY b.start_time DESC
-        ''').fetchall()
-        
-        bookings_list = []
-        for booking in bookings:
-            bookings_list.append({
-                'id': booking['id'],
-                'username': booking['username'],
-                'student_id': booking['student_id'],
-                'machine_name': booking['machine_name'],
-                'start_time': booking['start_time'],
-                'end_time': booking['end_time'],
-                'status': booking['status'],
-                'created_at': booking['created_at']
-            })
-        
-        return jsonify({'bookings': bookings_list}), 200
+        ''', where, params, ADMIN_BOOKING_COLUMNS)
         
+    except ValueError:
+        return jsonify({'message': 'Invalid filter or cursor'}), 400
     except Exception as e:
         return jsonify({'message': f'Failed to get bookings: {str(e)}'}), 500
 
+@app.route('/api/admin/bookings/export', methods=['GET'])
+def export_bookings():
+    """Stream bookings as CSV or NDJSON for reporting"""
+    try:
+        fmt = request.args.get('format', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({'message': 'format must be csv or ndjson'}), 400
+        since_id = int(request.args.get('since_id', 0))
+        response = Response(
+            stream_export(current_database(), fmt, since_id,
+                          request.args.get('from'), request.args.get('to')),
+            mimetype=EXPORT_FORMATS[fmt]
+        )
+        response.headers['Content-Disposition'] = f'attachment; filename=bookings-{g.hostel}.{fmt}'
+        return response
+        
+    except ValueError:
+        return jsonify({'message': 'Invalid since_id'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to export bookings: {str(e)}'}), 500
+
+def hostel_summary(hostel):
+    """Machine and booking counts of one hostel, read from its own shard"""
+    pool = get_pool(hostel_database(hostel))
+    db = pool.acquire()
+    try:
+        machines = {row['status']: row['count'] for row in db.execute('''
+            SELECT status, COUNT(*) AS count FROM washing_machines GROUP BY status
+        ''')}
+        now = format_timestamp(datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None))
+        bookings = db.execute('''
+            SELECT COUNT(*) AS active, COALESCE(SUM(start_time <= ?), 0) AS running
+            FROM bookings INDEXED BY idx_bookings_active_end
+            WHERE status IN ('pending', 'confirmed') AND end_time > ?
+        ''', (now, now)).fetchone()
+        return {
+            'id': hostel,
+            'name': HOSTELS[hostel],
+            'machines': sum(machines.values()),
+            'machines_by_status': machines,
+            'active_bookings': bookings['active'],
+            'running_bookings': bookings['running']
+        }
+    finally:
+        pool.release(db)
+
+@app.route('/api/admin/hostels', methods=['GET'])
+def get_hostels_overview():
+    """Summary of every hostel on this deployment"""
+    try:
+        # Each hostel is a separate file, so the shards are read in parallel
+        with ThreadPoolExecutor(max_workers=min(len(HOSTELS), DB_POOL_SIZE)) as executor:
+            hostels = list(executor.map(hostel_summary, HOSTELS))
+        return jsonify({'hostels': hostels}), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Failed to get hostels: {str(e)}'}), 500
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+def usage_stats(db, start, end, machine_id=None):
+    """Utilization heatmap, peak hours, per-day and per-machine utilization
+    and cancellation rates for the hours from `start` up to `end` (naive
+    UTC, taken to the hour), read from the hourly rollup only.
+
+    Utilization is booked time over the time the machines were there to be
+    booked, counting every machine that exists now.
+    """
+    first, last = usage_hour(start), usage_hour(end)
+    where, params = 'hour >= ? AND hour < ?', [first, last]
+    if machine_id is None:
+        machines = dict(db.execute('SELECT id, machine_name FROM washing_machines ORDER BY id').fetchall())
+    else:
+        machines = dict(db.execute('SELECT id, machine_name FROM washing_machines WHERE id = ?',
+                                   (machine_id,)).fetchall())
+        where += ' AND machine_id = ?'
+        params.append(machine_id)
+    
+    by_machine = {row['machine_id']: row for row in db.execute(f'''
+        SELECT machine_id, {', '.join(f'SUM({name}) AS {name}' for name in USAGE_COUNTERS)}
+        FROM machine_usage_hourly WHERE {where}
+        GROUP BY machine_id
+    ''', params)}
+    busy_by_hour = db.execute(f'''
+        SELECT hour, SUM(busy_seconds) FROM machine_usage_hourly WHERE {where}
+        GROUP BY hour
+    ''', params).fetchall()
+    
+    # Every hour of the range counts, booked or not, so walk it day by day
+    cells = [[[0, 0] for _ in range(24)] for _ in WEEKDAYS]    # [busy seconds, hours]
+    days = {}                                                  # date: [busy seconds, hours, weekday]
+    begin = datetime.datetime.strptime(first, USAGE_HOUR_FORMAT)
+    stop = datetime.datetime.strptime(last, USAGE_HOUR_FORMAT)
+    day = begin.date()
+    while day <= stop.date():
+        hours = range(begin.hour if day == begin.date() else 0, stop.hour if day == stop.date() else 24)
+        if hours:
+            days[day.isoformat()] = [0, len(hours), day.weekday()]
+            for hour in hours:
+                cells[day.weekday()][hour][1] += 1
+        day += datetime.timedelta(days=1)
+    for hour, busy in busy_by_hour:
+        totals = days[hour[:10]]
+        totals[0] += busy
+        cells[totals[2]][int(hour[11:13])][0] += busy
+    
+    def utilization(busy, hours, machine_count=len(machines)):
+        return round(busy / (3600 * hours * machine_count), 4) if hours and machine_count else None
+    
+    heatmap = [[utilization(*cell) for cell in row] for row in cells]
+    peaks = sorted(((u, w, h) for w, row in enumerate(heatmap) for h, u in enumerate(row) if u),
+                   reverse=True)[:STATS_PEAK_HOURS]
+    range_hours = sum(hours for _, hours, _ in days.values())
+    totals = dict.fromkeys(USAGE_COUNTERS, 0)
+    machine_stats = []
+    for id, name in machines.items():
+        row = by_machine.get(id)
+        counts = {counter: row[counter] if row else 0 for counter in USAGE_COUNTERS}
+        for counter, value in counts.items():
+            totals[counter] += value
+        machine_stats.append({
+            'machine_id': id,
+            'machine_name': name,
+            'busy_hours': round(counts['busy_seconds'] / 3600, 2),
+            'utilization': utilization(counts['busy_seconds'], range_hours, 1),
+            'bookings': counts['bookings'],
+            'cancelled': counts['cancelled'],
+            'completed': counts['completed']
+        })
+    
+    def rate(count):
+        return round(count / totals['bookings'], 4) if totals['bookings'] else None
+    
+    return {
+        'from': first,
+        'to': last,
+        'utc_offset_minutes': USAGE_UTC_OFFSET_MINUTES,
+        'utilization': utilization(totals['busy_seconds'], range_hours),
+        'heatmap': {'weekdays': WEEKDAYS, 'hours': list(range(24)), 'utilization': heatmap},
+        'peak_hours': [{'weekday': WEEKDAYS[w], 'hour': h, 'utilization': u} for u, w, h in peaks],
+        'daily': [{'date': day, 'busy_hours': round(busy / 3600, 2), 'utilization': utilization(busy, hours)}
+                  for day, (busy, hours, _) in days.items()],
+        'machines': machine_stats,
+        'bookings': {
+            'total': totals['bookings'],
+            'completed': totals['completed'],
+            'cancelled': totals['cancelled'],
+            'late_cancelled': totals['late_cancelled'],
+            'cancellation_rate': rate(totals['cancelled']),
+            'late_cancellation_rate': rate(totals['late_cancelled'])
+        }
+    }
+
+@app.route('/api/admin/stats', methods=['GET'])
+def get_usage_stats():
+    """Machine utilization by hour and day, peak hours and cancellation rates"""
+    try:
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        end = parse_timestamp(request.args['to']) if 'to' in request.args else now
+        start = (parse_timestamp(request.args['from']) if 'from' in request.args
+                 else end - datetime.timedelta(days=STATS_DEFAULT_DAYS))
+        machine_id = int(request.args['machine_id']) if 'machine_id' in request.args else None
+        if not start < end <= start + datetime.timedelta(days=STATS_MAX_DAYS):
+            return jsonify({'message': f'from must be before to and at most {STATS_MAX_DAYS} days apart'}), 400
+        
+        stats = usage_stats(get_db(), start, end, machine_id)
+        if machine_id is not None and not stats['machines']:
+            return jsonify({'message': 'Machine not found'}), 404
+        return jsonify(stats), 200
+        
+    except ValueError:
+        return jsonify({'message': 'Invalid from, to or machine_id'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to get stats: {str(e)}'}), 500
+
+def check_read_model(db):
+    """Diff this process's read model against the database, reloading it on a mismatch"""
+    model = read_model(db)
+    differences = model.check(db)
+    if differences:
+        print(f"Read model of {model.database} disagrees with the database, reloading: "
+              f"{'; '.join(differences[:10])}")
+        model.reload(db)
+    return differences
+
+@app.route('/api/admin/read-model/check', methods=['GET'])
+def get_read_model_check():
+    """Consistency check of the serving worker's read model for this hostel"""
+    try:
+        db = get_db()
+        differences = check_read_model(db)
+        return jsonify({
+            'version': read_model(db).version,
+            'consistent': not differences,
+            'differences': differences
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Failed to check read model: {str(e)}'}), 500
+
 @app.route('/api/machines/<int:machine_id>/bookings', methods=['GET'])
 def get_machine_bookings(machine_id):
     """Get all bookings for a specific machine"""
     try:
         db = get_db()
         
-        # Check if machine exists
-        machine = db.execute(
-            'SELECT machine_name FROM washing_machines WHERE id = ?', (machine_id,)
-        ).fetchone()
+        # Active bookings are served from the read model
+        found = read_model(db).machine_bookings(db, machine_id)
         
-        if not machine:
+        if found is None:
             return jsonify({'message': 'Machine not found'}), 404
         
-        # Get all bookings for this machine
-        bookings = db.execute('''
-            SELECT b.id, b.start_time, b.end_time, b.status, b.created_at,
-                   u.username, u.student_id
-            FROM bookings b
-            JOIN users u ON b.user_id = u.id
-            WHERE b.machine_id = ? AND b.status IN ('pending', 'confirmed')
-            ORDER BY b.start_time ASC
-        ''', (machine_id,)).fetchall()
-        
-        bookings_list = []
-        for booking in bookings:
-            bookings_list.append({
-                'id': booking['id'],
-                'username': booking['username'],
-                'student_id': booking['student_id'],
-                'start_time': booking['start_time'],
-                'end_time': booking['end_time'],
-                'status': booking['status'],
-                'created_at': booking['created_at']
-            })
-        
-        return jsonify({
-            'machine_name': machine['machine_name'],
-            'bookings': bookings_list
-        }), 200
+        machine_name, bookings = found
+        return rows_response('bookings', bookings, MACHINE_BOOKING_COLUMNS, machine_name=machine_name)
         
     except Exception as e:
         return jsonify({'message': f'Failed to get machine bookings: {str(e)}'}), 500
 
 
+class CachedCertsRequest:
+    """google-auth transport that reuses one HTTP session and caches
+    GET responses (Google's signing certs) for their Cache-Control max-age"""
+    
+    def __init__(self):
+        self._request = None
+        self._lock = threading.Lock()
+        self._cache = {}
+    
+    def _transport(self):
+        # google-auth and requests take a good part of a second to import,
+        # so they are loaded on the first sign-in rather than at worker start
+        with self._lock:
+            if self._request is None:
+                import requests
+                from google.auth.transport import requests as grequests
+                self._request = grequests.Request(session=requests.Session())
+            return self._request
+    
+    def __call__(self, url, method='GET', **kwargs):
+        if method != 'GET':
+            return self._transport()(url, method=method, **kwargs)
+        
+        with self._lock:
+            cached = self._cache.get(url)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        
+        response = self._transport()(url, method=method, **kwargs)
+        match = re.search(r'max-age=(\d+)', response.headers.get('cache-control', ''))
+        if response.status == 200 and match:
+            with self._lock:
+                self._cache[url] = (time.monotonic() + int(match.group(1)), response)
+        return response
+
+google_request = CachedCertsRequest()
+
+# sha256(token) -> (exp, idinfo) for tokens that already passed verification,
+# so the login-then-register flow in googleSignIn verifies a token only once
+_verified_tokens = {}
+_verified_tokens_lock = threading.Lock()
+
+def _verify_google_token_cached(token):
+    """Verify a Google ID token, memoizing the result until the token expires"""
+    from google.oauth2 import id_token
+    
+    t0 = time.perf_counter()
+    key = hashlib.sha256(token.encode()).hexdigest()
+    now = time.time()
+    with _verified_tokens_lock:
+        cached = _verified_tokens.get(key)
+    if cached and cached[0] > now:
+        metrics.observe('google_token_verify_duration_seconds', (('cache', 'hit'),), time.perf_counter() - t0)
+        return cached[1]
+    
+    try:
+        idinfo = id_token.verify_token(token, google_request, audience=GOOGLE_CLIENT_ID,
+                                       certs_url=GOOGLE_CERTS_URL)
+    finally:
+        metrics.observe('google_token_verify_duration_seconds', (('cache', 'miss'),), time.perf_counter() - t0)
+    if idinfo['iss'] not in GOOGLE_ISSUERS:
+        raise ValueError(f"Wrong issuer: {idinfo['iss']}")
+    
+    with _verified_tokens_lock:
+        if len(_verified_tokens) >= GOOGLE_TOKEN_CACHE_SIZE:
+            for expired in [k for k, (exp, _) in _verified_tokens.items() if exp <= now]:
+                del _verified_tokens[expired]
+            if len(_verified_tokens) >= GOOGLE_TOKEN_CACHE_SIZE:
+                _verified_tokens.clear()
+        _verified_tokens[key] = (idinfo['exp'], idinfo)
+    return idinfo
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics for this worker process"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/events', methods=['GET'])
+def event_stream():
+    """Server-Sent Events stream of machine and booking changes"""
+    # Browsers resend the last id they saw when reconnecting
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    broadcaster = get_broadcaster()
+    try:
+        last_id = int(last_event_id)
+    except (TypeError, ValueError):
+        last_id = broadcaster.latest_id()
+    
+    def generate(last_id):
+        yield 'retry: 3000\n\n'
+        while True:
+            new_last_id, messages = broadcaster.events_after(last_id, EVENT_HEARTBEAT_SECONDS)
+            if messages is None:
+                # Resuming from further back than the in-memory buffer
+                backlog = read_event_backlog(broadcaster.database, last_id)
+                if backlog is None:
+                    # Missed events were pruned: the client must reload everything
+                    last_id = broadcaster.latest_id()
+                    yield format_sse(last_id, 'reset', '{}')
+                else:
+                    for last_id, message in backlog:
+                        yield message
+            elif messages:
+                last_id = new_last_id
+                yield ''.join(messages)
+            else:
+                yield ': keepalive\n\n'
+    
+    return Response(generate(last_id), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/availability', methods=['GET'])
+def get_availability():
+    """Free/busy grid for every machine over a time range"""
+    try:
+        try:
+            slot_minutes = int(request.args.get('slot', DEFAULT_SLOT_MINUTES))
+            if slot_minutes <= 0:
+                raise ValueError('slot must be positive')
+            slot = datetime.timedelta(minutes=slot_minutes)
+            if request.args.get('from'):
+                range_start = parse_timestamp(request.args['from'])
+            else:
+                # Default: from the start of the current slot
+                now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+                midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+                range_start = midnight + (now - midnight) // slot * slot
+            if request.args.get('to'):
+                range_end = parse_timestamp(request.args['to'])
+            else:
+                range_end = range_start + datetime.timedelta(days=1)
+        except (TypeError, ValueError):
+            return jsonify({'message': 'Invalid from, to or slot'}), 400
+        
+        if range_end <= range_start:
+            return jsonify({'message': 'Invalid from, to or slot'}), 400
+        slot_count = -(-(range_end - range_start) // slot)
+        if slot_count > MAX_AVAILABILITY_SLOTS:
+            return jsonify({'message': f'Range too large: at most {MAX_AVAILABILITY_SLOTS} slots'}), 400
+        
+        lower, upper = format_timestamp(range_start), format_timestamp(range_end)
+        
+        def build(db, columnar):
+            machines = db.execute('''
+                SELECT id, machine_name, status FROM washing_machines ORDER BY id
+            ''').fetchall()
+            bookings = db.execute(AVAILABILITY_QUERY, (lower, upper, lower, lower)).fetchall()
+            
+            # One bitmap per machine: bit i (LSB first within each byte) is set
+            # when slot i overlaps an active booking
+            grids = {machine['id']: bytearray((slot_count + 7) // 8) for machine in machines}
+            for booking in bookings:
+                grid = grids.get(booking['machine_id'])
+                if grid is None:
+                    continue
+                start = parse_timestamp(booking['start_time'])
+                end = parse_timestamp(booking['end_time'])
+                first = max(0, (start - range_start) // slot)
+                last = min(slot_count, -(-(end - range_start) // slot))
+                for i in range(first, last):
+                    grid[i >> 3] |= 1 << (i & 7)
+            
+            return {
+                'from': lower,
+                'slot_minutes': slot_minutes,
+                'slots': slot_count,
+                'machines': [{
+                    'id': machine['id'],
+                    'machine_name': machine['machine_name'],
+                    'status': machine['status'],
+                    'busy': base64.b64encode(grids[machine['id']]).decode()
+                } for machine in machines]
+            }
+        
+        # The range is part of the tag: the same data version gives a
+        # different grid for a different window
+        return snapshot_response(f'availability-{lower}-{upper}-{slot_minutes}', build, columnar=False)
+        
+    except Exception as e:
+        return jsonify({'message': f'Failed to get availability: {str(e)}'}), 500
+
+
 def verify_google_id_token(token):
+    from google.auth import exceptions as google_exceptions
+    
     try:
-        idinfo = id_token.verify_oauth2_token(token, grequests.Request(), "624690583385-s3cnmv6iro5kjjror5oq6t4iulerrcde.apps.googleusercontent.com")
+        idinfo = _verify_google_token_cached(token)
 
         email = idinfo['email']
         if not email.endswith('@lnmiit.ac.in'):
@@ -652,7 +3570,7 @@ def verify_google_id_token(token):
             'name': idinfo.get('name', '')
         }, None
 
-    except ValueError as e:
+    except (ValueError, google_exceptions.GoogleAuthError) as e:
         return None, f'Invalid token: {str(e)}'
 
 
@@ -749,14 +3667,184 @@ def google_register():
 @app.route('/api/config')
 def get_config():
     return jsonify({
-        'google_client_id': "624690583385-s3cnmv6iro5kjjror5oq6t4iulerrcde.apps.googleusercontent.com"
+        'google_client_id': GOOGLE_CLIENT_ID,
+        'hostels': [{'id': hostel, 'name': name} for hostel, name in HOSTELS.items()],
+        'default_hostel': DEFAULT_HOSTEL
     })
 
 
+def negotiate_encoding():
+    """Best compression the client accepts: 'br', 'gzip' or None"""
+    if brotli is not None and request.accept_encodings.quality('br') > 0:
+        return 'br'
+    if request.accept_encodings.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+def compress(data, encoding, best=False):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else 5)
+    return gzip.compress(data, compresslevel=9 if best else 6, mtime=0)
+
+def gzip_stream(chunks):
+    """Gzip a streamed body chunk by chunk"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        # Release whatever the wrapped stream holds (e.g. its connection)
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+# (etag, encoding) -> compressed body of a cacheable response
+_compressed_bodies = {}
+COMPRESSED_CACHE_SIZE = 256
+
+@app.after_request
+def compress_response(response):
+    """Compress text responses (JSON, HTML, metrics) for clients that accept it"""
+    if (response.status_code in (204, 304) or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+    
+    etag, weak = response.get_etag()
+    if response.is_streamed:
+        # Size unknown up front; streamed lists are the big ones anyway
+        encoding = 'gzip'
+        response.response = gzip_stream(response.response)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_BYTES:
+            return response
+        # Snapshot and page bodies are identified by their ETag, so each
+        # version is compressed once per process
+        key = (etag, encoding) if etag and not weak else None
+        body = _compressed_bodies.get(key) if key else None
+        if body is None:
+            body = compress(data, encoding)
+            if key:
+                if len(_compressed_bodies) >= COMPRESSED_CACHE_SIZE:
+                    _compressed_bodies.clear()
+                _compressed_bodies[key] = body
+        response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        # The encoded bytes differ from the identity ones
+        response.set_etag(etag, weak=True)
+    return response
+
+_asset_manifest = None
+
+def asset_manifest():
+    """{static filename: fingerprinted filename} from the last build-assets run"""
+    global _asset_manifest
+    if _asset_manifest is None:
+        try:
+            with open(os.path.join(ASSET_DIR, 'manifest.json')) as f:
+                _asset_manifest = json.load(f)
+        except (OSError, ValueError):
+            _asset_manifest = {}
+    return _asset_manifest
+
+@app.template_global()
+def asset_url(filename):
+    """URL of a static file: its fingerprinted build when there is one"""
+    hashed = asset_manifest().get(filename)
+    if hashed:
+        return url_for('hashed_asset', filename=hashed)
+    return url_for('static', filename=filename)
+
+def resize_image(data, max_height):
+    """Downscale an image to at most `max_height` pixels; unchanged without Pillow"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return data
+    image = Image.open(io.BytesIO(data))
+    if image.height <= max_height:
+        return data
+    image_format = image.format
+    image = image.resize((round(image.width * max_height / image.height), max_height), Image.LANCZOS)
+    out = io.BytesIO()
+    image.save(out, format=image_format, optimize=True)
+    return out.getvalue() if out.tell() < len(data) else data
+
+def build_assets():
+    """Write fingerprinted, pre-compressed copies of the static files to ASSET_DIR; returns the manifest"""
+    shutil.rmtree(ASSET_DIR, ignore_errors=True)
+    os.makedirs(ASSET_DIR)
+    
+    def write(name, data):
+        with open(os.path.join(ASSET_DIR, name), 'wb') as f:
+            f.write(data)
+    
+    manifest = {}
+    for name in sorted(os.listdir(app.static_folder)):
+        path = os.path.join(app.static_folder, name)
+        if not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        root, ext = os.path.splitext(name)
+        if ext in ('.png', '.jpg', '.jpeg'):
+            data = resize_image(data, ASSET_IMAGE_MAX_HEIGHT)
+        hashed = f'{root}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+        write(hashed, data)
+        if ext in COMPRESSIBLE_ASSETS:
+            write(hashed + '.gz', compress(data, 'gzip', best=True))
+            if brotli is not None:
+                write(hashed + '.br', compress(data, 'br', best=True))
+        manifest[name] = hashed
+    write('manifest.json', json.dumps(manifest, indent=2).encode())
+    return manifest
+
+@app.route('/assets/<path:filename>')
+def hashed_asset(filename):
+    """Fingerprinted static file: cached for a year, pre-compressed variant preferred"""
+    mimetype = mimetypes.guess_type(filename)[0]
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if (request.accept_encodings.quality(encoding) > 0
+                and os.path.isfile(os.path.join(ASSET_DIR, filename + suffix))):
+            response = send_from_directory(ASSET_DIR, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(ASSET_DIR, filename)
+    response.headers['Cache-Control'] = f'public, max-age={ASSET_MAX_AGE}, immutable'
+    response.vary.add('Accept-Encoding')
+    return response
+
+# (etag, html) of the rendered page; it only changes with the templates and assets
+_index_page = None
+
 @app.route('/')
 def home():
-    """Serve the main HTML file"""
-    return render_template('index.html')
+    """Serve the main HTML file, rendered once per process"""
+    global _index_page
+    if _index_page is None or app.debug:
+        html = render_template('index.html')
+        _index_page = (hashlib.sha256(html.encode()).hexdigest()[:16], html)
+    etag, html = _index_page
+    
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(html, mimetype='text/html')
+    response.set_etag(etag)
+    # Revalidated on every visit, so new asset fingerprints are picked up
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/api')
 def api_docs():
@@ -771,18 +3859,138 @@ def api_docs():
         <li>POST /api/google-register - Google Sign-In registration</li>
         <li>POST /api/admin/login - Admin login</li>
         <li>GET /api/machines - Get all machines</li>
-        <li>POST /api/bookings - Create booking</li>
+        <li>POST /api/bookings - Create booking (409 when the slot is taken)</li>
         <li>GET /api/bookings/user/&lt;user_id&gt; - Get user bookings</li>
         <li>DELETE /api/bookings/&lt;booking_id&gt; - Cancel booking</li>
         <li>GET /api/admin/machines - Get machines (admin)</li>
         <li>PUT /api/admin/machines/&lt;machine_id&gt;/status - Update machine status</li>
         <li>POST /api/admin/machines - Add new machine</li>
+        <li>POST /api/admin/machines/batch - Add several machines</li>
+        <li>PUT /api/admin/machines/status - Change several machines' status, cancelling or reassigning bookings on broken ones</li>
         <li>GET /api/admin/bookings - Get all bookings (admin)</li>
+        <li>GET /api/admin/bookings/export?format=csv|ndjson&amp;since_id=&amp;from=&amp;to= - Stream bookings for reporting</li>
+        <li>GET /api/admin/stats?from=&amp;to=&amp;machine_id= - Utilization heatmap, peak hours and cancellation rates</li>
+        <li>GET /api/admin/hostels - Summary of every hostel (admin)</li>
+        <li>GET /api/admin/read-model/check - Diff the in-memory read model against the database</li>
+        <li>GET /api/availability?from=&amp;to=&amp;slot= - Free/busy grid for all machines</li>
+        <li>GET /api/metrics - Prometheus metrics</li>
+        <li>GET /api/events - Live machine/booking updates (Server-Sent Events)</li>
     </ul>
+    <p>Requests are routed to a hostel by the X-Hostel header (or ?hostel=).</p>
     '''
 
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and pre-compress the static files into static/dist"""
+    for name, hashed in build_assets().items():
+        variants = [suffix for suffix in ('.gz', '.br') if os.path.exists(os.path.join(ASSET_DIR, hashed + suffix))]
+        size = os.path.getsize(os.path.join(ASSET_DIR, hashed))
+        print(f"{name} -> {hashed} ({size} bytes{', ' + ' '.join(variants) if variants else ''})")
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations to every hostel's shard"""
+    for hostel in HOSTELS:
+        database = hostel_database(hostel)
+        applied = migrate(database)
+        status = f"applied {', '.join(map(str, applied))}" if applied else 'up to date'
+        print(f"{hostel}: schema version {SCHEMA_VERSION} ({status})")
+
+@app.cli.command('export-bookings')
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_FORMATS)), default='csv')
+@click.option('--hostel', type=click.Choice(list(HOSTELS)), default=DEFAULT_HOSTEL)
+@click.option('--since-id', type=int, help='Only bookings with a larger id')
+@click.option('--from', 'start', help='Only bookings starting at or after this time')
+@click.option('--to', 'end', help='Only bookings starting before this time')
+@click.option('--output', type=click.Path(dir_okay=False), help='File to write (default: stdout)')
+@click.option('--state', type=click.Path(dir_okay=False),
+              help='JSON file remembering the last exported id per hostel; continues from it')
+def export_bookings_command(fmt, hostel, since_id, start, end, output, state):
+    """Stream bookings to a file or stdout as CSV or NDJSON"""
+    last_ids = {}
+    if state and os.path.exists(state):
+        with open(state) as f:
+            last_ids = json.load(f)
+    if since_id is None:
+        since_id = last_ids.get(hostel, 0)
+    
+    last_id = since_id
+    def tracked(rows):
+        nonlocal last_id
+        for row in rows:
+            last_id = row['id']
+            yield row
+    
+    ensure_schema(hostel_database(hostel))
+    out = open(output, 'wb') if output else click.get_binary_stream('stdout')
+    try:
+        with export_snapshot(hostel_database(hostel)) as db:
+            for chunk in encode_export(tracked(export_rows(db, since_id, start, end)), fmt):
+                out.write(chunk)
+    finally:
+        if output:
+            out.close()
+        else:
+            out.flush()
+    
+    if state:
+        last_ids[hostel] = last_id
+        with open(state + '.tmp', 'w') as f:
+            json.dump(last_ids, f)
+        os.replace(state + '.tmp', state)
+    click.echo(f"{hostel}: exported bookings {since_id + 1}..{last_id}" if last_id > since_id
+               else f"{hostel}: no new bookings", err=True)
+
+@app.cli.command('send-emails')
+def send_emails_command():
+    """Deliver all due emails in the outbox and exit"""
+    session = SMTPSession()
+    try:
+        for hostel in HOSTELS:
+            ensure_schema(hostel_database(hostel))
+            print(f"{hostel}: sent {drain_email_outbox(session, hostel_database(hostel))} email(s)")
+    finally:
+        session.close()
+
+@app.cli.command('rebuild-quotas')
+def rebuild_quotas_command():
+    """Recompute the per-user booking quota table from bookings"""
+    for hostel in HOSTELS:
+        ensure_schema(hostel_database(hostel))
+        pool = get_pool(hostel_database(hostel))
+        db = pool.acquire()
+        try:
+            with write_transaction(db):
+                rebuild_booking_quotas(db)
+            print(f"{hostel}: rebuilt quota entries for "
+                  f"{db.execute('SELECT COUNT(*) FROM user_booking_quota').fetchone()[0]} user(s)")
+        finally:
+            pool.release(db)
+
+@app.cli.command('rebuild-usage')
+def rebuild_usage_command():
+    """Recompute the hourly machine usage rollup from bookings and the archive"""
+    for hostel in HOSTELS:
+        ensure_schema(hostel_database(hostel))
+        pool = get_pool(hostel_database(hostel))
+        db = pool.acquire()
+        try:
+            with write_transaction(db):
+                hours = rebuild_machine_usage(db)
+            print(f"{hostel}: rebuilt {hours} machine-hour(s) of usage")
+        finally:
+            pool.release(db)
+
+@app.cli.command('complete-bookings')
+def complete_bookings_command():
+    """Complete all bookings that have ended, archive old ones and exit"""
+    for hostel in HOSTELS:
+        ensure_schema(hostel_database(hostel))
+        completed, archived = run_booking_lifecycle(hostel_database(hostel))
+        print(f"{hostel}: completed {completed} booking(s), archived {archived}")
+
 if __name__ == '__main__':
-    # Initialize database
+    # Create or upgrade the database schema
     init_db()
     
     # Run the application
@@ -0,0 +1,94 @@
+"""Many processes booking the same slot at once
+
+Starts several processes against one throwaway database, lines them up on a
+barrier and has every one of them fire booking requests for the same machine
+and time slot (each request as a different student). Exactly one booking may
+succeed; everybody else must get the conflict response.
+
+    python benchmarks/bench_booking_race.py [--processes 8] [--requests 50]
+"""
+import argparse
+import collections
+import datetime
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def worker(path, barrier, first_user_id, requests, slot, results):
+    os.environ['DATABASE'] = path
+    # Every request comes from one address; this checks the conflict rule,
+    # not the rate limits
+    os.environ['ADMISSION_ENABLED'] = '0'
+    import app as booking_app
+
+    client = booking_app.app.test_client()
+    start, end = slot
+    statuses = []
+    barrier.wait()
+    for i in range(requests):
+        response = client.post(
+            '/api/bookings',
+            json={'machine_id': 1, 'start_time': start, 'end_time': end},
+            headers={'Authorization': f'Bearer {first_user_id + i}'}
+        )
+        statuses.append(response.status_code)
+    results.put(statuses)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=50, help='requests per process')
+    args = parser.parse_args()
+
+    # A directory, so the -wal/-shm, .migrate.lock and .admission files go with it
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'bench.db')
+    os.environ['DATABASE'] = path
+    import app as booking_app
+    booking_app.init_db()
+    booking_app.get_pool(path).close_all()
+
+    start = (datetime.datetime.now() + datetime.timedelta(days=1)).replace(
+        hour=8, minute=0, second=0, microsecond=0)
+    slot = (start.isoformat(), (start + datetime.timedelta(hours=1)).isoformat())
+
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(args.processes + 1)
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=worker, args=(path, barrier, 1000 + p * args.requests,
+                                         args.requests, slot, results))
+        for p in range(args.processes)
+    ]
+    try:
+        for process in processes:
+            process.start()
+        barrier.wait()
+        t0 = time.perf_counter()
+        statuses = []
+        for _ in processes:
+            statuses.extend(results.get())
+        elapsed = time.perf_counter() - t0
+        for process in processes:
+            process.join()
+
+        counts = collections.Counter(statuses)
+        print(f"{len(statuses)} requests from {args.processes} processes in {elapsed:.2f}s "
+              f"({len(statuses) / elapsed:.0f} req/s)")
+        print('status codes:', dict(sorted(counts.items())))
+        assert counts[201] == 1, f"expected exactly one booking, got {counts[201]}"
+        assert counts[409] == len(statuses) - 1, 'every other request must see the conflict'
+        print('OK: exactly one booking won the slot')
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
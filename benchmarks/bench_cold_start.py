@@ -0,0 +1,121 @@
+"""Worker cold start: time from a fresh process to its first served request
+
+First starts several workers at once on a database that does not exist yet:
+they race to create the schema, exactly one of them migrates each step and
+all of them must come up with the same, complete schema. Then seeds booking
+history and starts fresh workers one after another on the migrated database,
+timing interpreter start, app import and the first request (schema check,
+read-model load and the query itself).
+
+    python benchmarks/bench_cold_start.py [--workers 8] [--history 100000] [--runs 10]
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+
+def child():
+    """Runs in the fresh worker process: import the app and serve one request"""
+    t0 = time.perf_counter()
+    import app as booking_app
+    t1 = time.perf_counter()
+    response = booking_app.app.test_client().get('/api/machines')
+    t2 = time.perf_counter()
+    assert response.status_code == 200, response.status_code
+    print(json.dumps({'import_ms': (t1 - t0) * 1000, 'first_request_ms': (t2 - t1) * 1000,
+                      'machines': len(response.get_json()['machines'])}))
+
+
+def worker_result(worker):
+    # The app logs the migrations it applies; the result is the last line
+    return json.loads(worker.communicate()[0].splitlines()[-1])
+
+
+def start_worker(path):
+    env = dict(os.environ, DATABASE=path, ADMISSION_ENABLED='0', METRICS_ENABLED='0')
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), '--child'],
+                            cwd=ROOT, env=env, stdout=subprocess.PIPE, text=True)
+
+
+def seed_history(path, count):
+    """Past bookings, nearly all finished, plus a day of upcoming ones"""
+    import sqlite3
+
+    db = sqlite3.connect(path)
+    epoch = datetime.datetime(2020, 1, 1)
+    rows = []
+    for i in range(count):
+        start = epoch + datetime.timedelta(hours=i // 8)
+        rows.append((i + 2, i % 8 + 1, start.isoformat(),
+                     (start + datetime.timedelta(hours=1)).isoformat(),
+                     random.choice(['completed'] * 9 + ['cancelled'])))
+    tomorrow = datetime.datetime.now() + datetime.timedelta(days=1)
+    for i in range(8 * 24):
+        start = tomorrow + datetime.timedelta(hours=i // 8)
+        rows.append((count + i + 2, i % 8 + 1, start.isoformat(),
+                     (start + datetime.timedelta(hours=1)).isoformat(), 'confirmed'))
+    db.executemany('''
+        INSERT INTO bookings (user_id, machine_id, start_time, end_time, status)
+        VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+    db.commit()
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8, help='workers racing on the first boot')
+    parser.add_argument('--history', type=int, default=100000, help='past bookings to seed')
+    parser.add_argument('--runs', type=int, default=10, help='cold starts to time')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return
+
+    random.seed(42)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'cold_start.db')
+    try:
+        # First boot: every worker finds an empty database
+        workers = [start_worker(path) for _ in range(args.workers)]
+        results = [worker_result(worker) for worker in workers]
+        assert all(worker.returncode == 0 for worker in workers), 'a worker failed to start'
+        assert {r['machines'] for r in results} == {8}, 'every worker must see the 8 default machines once'
+        print(f"first boot: {args.workers} workers up, schema created once, "
+              f"slowest first request {max(r['first_request_ms'] for r in results):.0f} ms")
+
+        seed_history(path, args.history)
+
+        # Cold starts on a migrated database with history
+        timings = []
+        for _ in range(args.runs):
+            t0 = time.perf_counter()
+            worker = start_worker(path)
+            result = worker_result(worker)
+            result['total_ms'] = (time.perf_counter() - t0) * 1000
+            timings.append(result)
+
+        print(f"{'':>16} {'p50 ms':>9} {'max ms':>9}")
+        for key, label in (('import_ms', 'import app'), ('first_request_ms', 'first request'),
+                           ('total_ms', 'process total')):
+            values = sorted(t[key] for t in timings)
+            print(f"{label:>16} {statistics.median(values):>9.1f} {values[-1]:>9.1f}")
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main()
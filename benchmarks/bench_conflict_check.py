@@ -0,0 +1,108 @@
+"""Booking latency vs. size of the booking history
+
+Seeds a throwaway database with an increasing number of historic bookings and
+times POST /api/bookings at each size. With the in-memory read model the
+latency should stay flat as the history grows.
+
+    python benchmarks/bench_conflict_check.py [--sizes 1000,10000,100000] [--requests 200]
+"""
+import argparse
+import datetime
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app as booking_app
+
+MACHINES = 8
+EPOCH = datetime.datetime(2020, 1, 1)
+
+
+def seed_history(db, count, start_index):
+    """Insert `count` past bookings (mostly completed/cancelled) spread over all machines"""
+    rows = []
+    for i in range(start_index, start_index + count):
+        machine_id = i % MACHINES + 1
+        start = EPOCH + datetime.timedelta(hours=i // MACHINES)
+        end = start + datetime.timedelta(minutes=random.choice([30, 60, 120]))
+        status = random.choice(['completed', 'completed', 'cancelled', 'confirmed'])
+        rows.append((i + 2, machine_id, start.isoformat(), end.isoformat(), status))
+    db.executemany('''
+        INSERT INTO bookings (user_id, machine_id, start_time, end_time, status)
+        VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+    db.commit()
+
+
+def time_bookings(client, requests, first_user_id):
+    """Time `requests` booking attempts for future slots, returning latencies in ms"""
+    latencies = []
+    base = datetime.datetime.now() + datetime.timedelta(days=1)
+    for i in range(requests):
+        start = base + datetime.timedelta(minutes=random.randrange(0, 60 * 24 * 9, 30))
+        end = start + datetime.timedelta(hours=1)
+        t0 = time.perf_counter()
+        client.post(
+            '/api/bookings',
+            json={
+                'machine_id': random.randint(1, MACHINES),
+                'start_time': start.isoformat(),
+                'end_time': end.isoformat()
+            },
+            headers={'Authorization': f'Bearer {first_user_id + i}'}
+        )
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000,200000')
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    random.seed(42)
+    # A directory, so the -wal/-shm, .migrate.lock and .admission files go with it
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'bench.db')
+    booking_app.DATABASE = path
+    booking_app.ADMISSION_ENABLED = False
+    booking_app.init_db()
+
+    print(f"{'history':>10} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    seeded = 0
+    next_user = 10_000_000
+    try:
+        for size in [int(s) for s in args.sizes.split(',')]:
+            with booking_app.app.app_context():
+                db = booking_app.get_db()
+                seed_history(db, size - seeded, seeded)
+                # Drop future bookings from the previous round so every round
+                # books into the same amount of free space
+                db.execute("DELETE FROM bookings WHERE start_time > ?",
+                           (datetime.datetime.now().isoformat(),))
+                db.commit()
+            seeded = size
+            # Seeded without change events, so the read model must reload
+            booking_app.read_models.clear()
+
+            client = booking_app.app.test_client()
+            latencies = time_bookings(client, args.requests, next_user)
+            next_user += args.requests
+            latencies.sort()
+            print(f"{size:>10} {statistics.mean(latencies):>9.3f} "
+                  f"{latencies[len(latencies) // 2]:>9.3f} "
+                  f"{latencies[int(len(latencies) * 0.95)]:>9.3f}")
+    finally:
+        booking_app.get_pool(path).close_all()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+"""Load test for the booking API
+
+Seeds a throwaway SQLite file, boots the app against it (gunicorn when
+installed, otherwise the Flask server) with SMTP and Google sign-in pointed at
+local stand-ins, then drives one or more request mixes from many concurrent
+clients and reports throughput and p50/p95/p99 latency per endpoint.
+
+    python benchmarks/load_test.py --scenario all --clients 32 --duration 20
+    python benchmarks/load_test.py --output before.json
+    python benchmarks/load_test.py --compare before.json
+    python benchmarks/load_test.py --scenario burst --admission
+
+All clients share one address, so admission control is switched off unless
+--admission is given; requests it sheds (429) are reported separately.
+
+Scenarios:
+    poll    dashboards polling machines, own bookings and availability
+    burst   the 8 AM rush: everyone booking the same morning slots
+    admin   the admin dashboard: machine list and paged booking history
+    login   Google sign-in with (stand-in) ID tokens
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from standins import GoogleCertsStandIn, SMTPStandIn
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+GOOGLE_CLIENT_ID = '624690583385-s3cnmv6iro5kjjror5oq6t4iulerrcde.apps.googleusercontent.com'
+SCENARIOS = ('poll', 'burst', 'admin', 'login')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def seed_database(path, env, users, machines, history):
+    """Create the schema (via the app itself) and bulk-load users, machines and past bookings"""
+    subprocess.run([sys.executable, '-c', 'import app; app.init_db()'],
+                   cwd=ROOT, env=env, check=True)
+    db = sqlite3.connect(path)
+    db.executemany('''
+        INSERT INTO users (student_id, username, password, email, role)
+        VALUES (?, ?, 'google_auth', ?, 'user')
+    ''', [(f'student{i}', f'Student {i}', f'student{i}@lnmiit.ac.in') for i in range(users)])
+    existing = db.execute('SELECT COUNT(*) FROM washing_machines').fetchone()[0]
+    db.executemany('''
+        INSERT INTO washing_machines (machine_name, status) VALUES (?, 'available')
+    ''', [(f'Machine {i + 1}',) for i in range(existing, machines)])
+
+    user_ids = [row[0] for row in db.execute("SELECT id FROM users WHERE role = 'user'")]
+    machine_ids = [row[0] for row in db.execute('SELECT id FROM washing_machines')]
+    epoch = datetime.datetime.now() - datetime.timedelta(days=365 * 3)
+    rows = []
+    for i in range(history):
+        start = epoch + datetime.timedelta(minutes=30 * (i // len(machine_ids)))
+        end = start + datetime.timedelta(minutes=random.choice([30, 60, 120]))
+        rows.append((random.choice(user_ids), machine_ids[i % len(machine_ids)],
+                     start.isoformat(timespec='milliseconds') + 'Z',
+                     end.isoformat(timespec='milliseconds') + 'Z',
+                     random.choice(['completed', 'completed', 'completed', 'cancelled'])))
+    db.executemany('''
+        INSERT INTO bookings (user_id, machine_id, start_time, end_time, status)
+        VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+    db.commit()
+    db.close()
+    return user_ids, machine_ids
+
+
+def start_server(env, port, server, workers):
+    if server == 'auto':
+        server = 'gunicorn' if shutil.which('gunicorn') else 'flask'
+    if server == 'gunicorn':
+        command = ['gunicorn', '-w', str(workers), '--threads', '4',
+                   '-b', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app']
+    else:
+        command = [sys.executable, '-m', 'flask', '--app', 'app', 'run',
+                   '--port', str(port), '--with-threads', '--no-reload']
+    process = subprocess.Popen(command, cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/api', timeout=1)
+            return process, server
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{server} server did not start')
+
+
+class Recorder:
+    """Collects latencies per endpoint label"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+        self.shed = {}
+
+    def request(self, session, method, url, label, expected=(200, 201, 304), **kwargs):
+        t0 = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=30, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, None
+        elapsed = (time.perf_counter() - t0) * 1000
+        with self._lock:
+            self.samples.setdefault(label, []).append(elapsed)
+            if status == 429:
+                self.shed[label] = self.shed.get(label, 0) + 1
+            elif status not in expected:
+                self.errors[label] = self.errors.get(label, 0) + 1
+        return response
+
+
+class Scenario:
+    def __init__(self, name, base_url, user_ids, machine_ids, tokens, recorder, auto_assign=False):
+        self.name = name
+        self.base_url = base_url
+        self.user_ids = user_ids
+        self.machine_ids = machine_ids
+        self.tokens = tokens
+        self.recorder = recorder
+        self.auto_assign = auto_assign
+        self._next_user = 0
+        self._lock = threading.Lock()
+        tomorrow = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1)
+        self.rush_start = tomorrow.replace(hour=8, minute=0, second=0, microsecond=0)
+
+    def next_user(self):
+        # Every booking attempt comes from a different student, so the
+        # one-booking-per-10-days rule doesn't reject the whole rush
+        with self._lock:
+            self._next_user += 1
+            return self.user_ids[self._next_user % len(self.user_ids)]
+
+    def step(self, session, rng, state):
+        getattr(self, self.name)(session, rng, state)
+
+    def get(self, session, path, label, state=None, **kwargs):
+        headers = {}
+        if state is not None and label in state:
+            headers['If-None-Match'] = state[label]
+        response = self.recorder.request(session, 'GET', self.base_url + path, label,
+                                         headers=headers, **kwargs)
+        if state is not None and response is not None and 'ETag' in response.headers:
+            state[label] = response.headers['ETag']
+        return response
+
+    def poll(self, session, rng, state):
+        roll = rng.random()
+        if roll < 0.7:
+            self.get(session, '/api/machines', 'GET /api/machines', state)
+        elif roll < 0.9:
+            user_id = rng.choice(self.user_ids)
+            self.get(session, f'/api/bookings/user/{user_id}?limit=20', 'GET /api/bookings/user/<id>')
+        else:
+            self.get(session, '/api/availability?slot=30', 'GET /api/availability')
+
+    def burst(self, session, rng, state):
+        if rng.random() < 0.4:
+            self.get(session, '/api/machines', 'GET /api/machines', state)
+            return
+        start = self.rush_start + datetime.timedelta(minutes=30 * rng.randrange(8))
+        end = start + datetime.timedelta(hours=1)
+        self.recorder.request(
+            session, 'POST', self.base_url + '/api/bookings', 'POST /api/bookings',
+            expected=(201, 409),
+            json={
+                'machine_id': 'any' if self.auto_assign else rng.choice(self.machine_ids),
+                'start_time': start.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                'end_time': end.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+            },
+            headers={'Authorization': f'Bearer {self.next_user()}'}
+        )
+
+    def admin(self, session, rng, state):
+        roll = rng.random()
+        if roll < 0.4:
+            self.get(session, '/api/admin/machines', 'GET /api/admin/machines', state)
+        elif roll < 0.8:
+            response = self.get(session, '/api/admin/bookings?limit=100', 'GET /api/admin/bookings')
+            cursor = response.json().get('next_cursor') if response is not None and response.ok else None
+            if cursor:
+                self.get(session, '/api/admin/bookings', 'GET /api/admin/bookings',
+                         params={'limit': 100, 'cursor': cursor})
+        else:
+            self.get(session, '/api/admin/bookings?status=cancelled&limit=100',
+                     'GET /api/admin/bookings?status')
+
+    def login(self, session, rng, state):
+        self.recorder.request(session, 'POST', self.base_url + '/api/google-login',
+                              'POST /api/google-login', json={'token': rng.choice(self.tokens)})
+
+
+def run_scenario(scenario, clients, duration):
+    deadline = time.time() + duration
+
+    def client(seed):
+        rng = random.Random(seed)
+        session = requests.Session()
+        state = {}
+        while time.time() < deadline:
+            scenario.step(session, rng, state)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    t0 = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - t0
+
+
+def summarize(recorder, elapsed):
+    results = {}
+    for label, samples in sorted(recorder.samples.items()):
+        samples = sorted(samples)
+
+        def pct(p):
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))], 3)
+
+        results[label] = {
+            'requests': len(samples),
+            'errors': recorder.errors.get(label, 0),
+            'shed': recorder.shed.get(label, 0),
+            'rps': round(len(samples) / elapsed, 1),
+            'p50_ms': pct(0.50),
+            'p95_ms': pct(0.95),
+            'p99_ms': pct(0.99)
+        }
+    return results
+
+
+def print_results(name, results, baseline=None):
+    print(f'\n== {name}')
+    print(f"{'endpoint':<34} {'reqs':>7} {'err':>5} {'shed':>5} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for label, r in results.items():
+        line = (f"{label:<34} {r['requests']:>7} {r['errors']:>5} {r.get('shed', 0):>5} {r['rps']:>8.1f} "
+                f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+        before = (baseline or {}).get(name, {}).get(label)
+        if before:
+            line += (f"   p95 {100 * (r['p95_ms'] / before['p95_ms'] - 1):+.0f}%"
+                     f"  req/s {100 * (r['rps'] / before['rps'] - 1):+.0f}%")
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', choices=SCENARIOS + ('all',), default='all')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=15, help='seconds per scenario')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--machines', type=int, default=8)
+    parser.add_argument('--history', type=int, default=100000, help='historic bookings to seed')
+    parser.add_argument('--server', choices=('auto', 'gunicorn', 'flask'), default='auto')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--admission', action='store_true', help='keep admission control on')
+    parser.add_argument('--auto-assign', action='store_true',
+                        help='book with machine_id "any" instead of a random machine')
+    parser.add_argument('--output', help='save results as JSON for later --compare')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    smtp = SMTPStandIn().start()
+    certs = GoogleCertsStandIn(GOOGLE_CLIENT_ID).start()
+
+    workdir = tempfile.mkdtemp(prefix='washing-load-')
+    path = os.path.join(workdir, 'load_test.db')
+    env = dict(os.environ,
+               DATABASE=path,
+               EMAIL_HOST='127.0.0.1', EMAIL_PORT=str(smtp.port),
+               EMAIL_USE_TLS='0', EMAIL_PASSWORD='',
+               GOOGLE_CERTS_URL=certs.url,
+               ADMISSION_ENABLED='1' if args.admission else '0')
+
+    print(f'Seeding {args.users} users, {args.machines} machines, {args.history} bookings...')
+    user_ids, machine_ids = seed_database(path, env, args.users, args.machines, args.history)
+    tokens = [certs.make_id_token(f'student{i}@lnmiit.ac.in') for i in range(min(args.users, 200))]
+
+    port = free_port()
+    process, server = start_server(env, port, args.server, args.workers)
+    print(f'Server: {server} on port {port}, {args.clients} clients, {args.duration:g}s per scenario')
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['scenarios']
+
+    report = {
+        'meta': {
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'server': server,
+            **{k: v for k, v in vars(args).items() if k not in ('output', 'compare')}
+        },
+        'scenarios': {}
+    }
+    try:
+        names = SCENARIOS if args.scenario == 'all' else (args.scenario,)
+        for name in names:
+            recorder = Recorder()
+            scenario = Scenario(name, f'http://127.0.0.1:{port}', user_ids, machine_ids,
+                                tokens, recorder, args.auto_assign)
+            elapsed = run_scenario(scenario, args.clients, args.duration)
+            report['scenarios'][name] = summarize(recorder, elapsed)
+            print_results(name, report['scenarios'][name], baseline)
+        print(f'\nstand-ins: {smtp.messages} emails received, {certs.fetches} cert fetches')
+    finally:
+        process.terminate()
+        process.wait()
+        smtp.shutdown()
+        certs.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results saved to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""Local stand-ins for the external services the app talks to
+
+- SMTPStandIn: accepts and counts mail over plain SMTP, no TLS or auth;
+  can refuse recipients and fail messages on request
+- GoogleCertsStandIn: serves a self-signed signing cert in Google's certs
+  format and mints ID tokens signed with it
+
+Point the app at them through the environment before importing it:
+EMAIL_HOST/EMAIL_PORT/EMAIL_USE_TLS=0/EMAIL_PASSWORD= and GOOGLE_CERTS_URL.
+"""
+import datetime
+import json
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.count('sessions')
+        self.reply('220 stand-in ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply('250-stand-in')
+                self.reply('250 8BITMIME')
+            elif command.startswith('RCPT'):
+                address = command.partition('<')[2].partition('>')[0].lower()
+                self.reply('550 No such user' if address in self.server.refused else '250 OK')
+            elif command.startswith('DATA'):
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                    pass
+                if self.server.take_failure():
+                    self.reply('451 Try again later')
+                else:
+                    self.server.count('messages')
+                    self.reply('250 OK')
+            elif command.startswith('QUIT'):
+                self.reply('221 Bye')
+                return
+            else:
+                # MAIL, RSET, NOOP
+                self.reply('250 OK')
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """Counts sessions and accepted messages. Recipients in `refused` are
+    rejected at RCPT, and the next `failures` messages get a temporary 451."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), _SMTPHandler)
+        self.sessions = 0
+        self.messages = 0
+        self.refused = set()
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def take_failure(self):
+        with self._lock:
+            if self.failures:
+                self.failures -= 1
+                return True
+            return False
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class GoogleCertsStandIn(ThreadingHTTPServer):
+    """Google's /oauth2/v1/certs endpoint, backed by a self-signed key"""
+
+    daemon_threads = True
+
+    def __init__(self, client_id, host='127.0.0.1', port=0, max_age=3600):
+        # Imported here so the rest of the benchmarks don't need cryptography
+        from cryptography import x509
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        from cryptography.x509.oid import NameOID
+        from google.auth import crypt
+
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'certs stand-in')])
+        now = datetime.datetime.now(datetime.timezone.utc)
+        cert = (x509.CertificateBuilder()
+                .subject_name(name).issuer_name(name)
+                .public_key(key.public_key())
+                .serial_number(x509.random_serial_number())
+                .not_valid_before(now - datetime.timedelta(days=1))
+                .not_valid_after(now + datetime.timedelta(days=30))
+                .sign(key, hashes.SHA256()))
+        pem = key.private_bytes(serialization.Encoding.PEM,
+                                serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption()).decode()
+
+        self.client_id = client_id
+        self.key_id = 'stand-in'
+        self.signer = crypt.RSASigner.from_string(pem, self.key_id)
+        self.body = json.dumps({
+            self.key_id: cert.public_bytes(serialization.Encoding.PEM).decode()
+        }).encode()
+        self.max_age = max_age
+        self.fetches = 0
+        super().__init__((host, port), _CertsHandler)
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}/oauth2/v1/certs'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def make_id_token(self, email, name='Test Student', **claims):
+        """A signed ID token; `claims` override the defaults (iss, aud, iat, exp...)"""
+        from google.auth import jwt
+
+        now = int(time.time())
+        payload = {
+            'iss': 'https://accounts.google.com',
+            'aud': self.client_id,
+            'sub': email,
+            'email': email,
+            'name': name,
+            'iat': now,
+            'exp': now + 3600
+        }
+        payload.update(claims)
+        return jwt.encode(self.signer, payload).decode()
+
+
+class _CertsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.fetches += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Cache-Control', f'public, max-age={self.server.max_age}')
+        self.send_header('Content-Length', str(len(self.server.body)))
+        self.end_headers()
+        self.wfile.write(self.server.body)
+
+    def log_message(self, format, *args):
+        pass
@@ -3,10 +3,28 @@ let currentUser = null;
 let isAdmin = false;
 let machines = [];
 let bookings = [];
+let eventSource = null;
+let allBookingsCursor = null;
+let allBookingsLoaded = 0;
+let availability = null;
+let liveUpdatesConnected = false;
+// Hostel whose machines this page shows; every API request is routed by it
+let currentHostel = localStorage.getItem('hostel');
+// Booking submission awaiting a definite answer; resubmitting the same booking
+// reuses its Idempotency-Key, so a request that did reach the server is not repeated
+let pendingBooking = null;
 
 // API Base URL
 const API_BASE = 'https://gh-washing-machine.onrender.com/api';
 
+function apiFetch(path, options = {}) {
+    const headers = { ...(options.headers || {}) };
+    if (currentHostel) {
+        headers['X-Hostel'] = currentHostel;
+    }
+    return fetch(`${API_BASE}${path}`, { ...options, headers });
+}
+
 // DOM Elements
 const loginModal = document.getElementById('loginModal');
 const registerModal = document.getElementById('registerModal');
@@ -53,7 +71,7 @@ function decodeJwtResponse(token) {
 async function googleSignIn(token) {
     try {
         // First try to login
-        const loginResponse = await fetch(`${API_BASE}/google-login`, {
+        const loginResponse = await apiFetch(`/google-login`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -69,7 +87,7 @@ async function googleSignIn(token) {
             showMessage('Google Sign-In successful!', 'success');
         } else {
             // Try to register
-            const registerResponse = await fetch(`${API_BASE}/google-register`, {
+            const registerResponse = await apiFetch(`/google-register`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -96,10 +114,49 @@ async function googleSignIn(token) {
 // Initialize the application
 document.addEventListener('DOMContentLoaded', function() {
     initializeEventListeners();
+    loadHostels();
     checkAuthStatus();
     loadMachines();
 });
 
+// Hostel selection: only shown when the deployment serves several hostels
+async function loadHostels() {
+    try {
+        // Plain fetch: a hostel remembered from an older setup may be gone
+        const response = await fetch(`${API_BASE}/config`);
+        const config = await response.json();
+        const hostels = config.hostels || [];
+        if (!hostels.some(h => h.id === currentHostel)) {
+            currentHostel = config.default_hostel;
+        }
+        const select = document.getElementById('hostelSelect');
+        select.innerHTML = hostels.map(h => `<option value="${h.id}">${h.name}</option>`).join('');
+        select.value = currentHostel;
+        select.style.display = hostels.length > 1 ? '' : 'none';
+        showHostelName(hostels);
+    } catch (error) {
+        console.error('Error loading hostels:', error);
+    }
+}
+
+function showHostelName(hostels) {
+    const hostel = hostels.find(h => h.id === currentHostel);
+    if (hostel && hostels.length > 1) {
+        document.querySelector('.header-text h1').textContent = hostel.name;
+    }
+}
+
+function handleHostelChange(e) {
+    currentHostel = e.target.value;
+    localStorage.setItem('hostel', currentHostel);
+    showHostelName(Array.from(e.target.options).map(o => ({ id: o.value, name: o.text })));
+    // Accounts belong to one hostel, so switching signs out
+    if (currentUser) {
+        handleLogout();
+    }
+    loadMachines();
+}
+
 // Event Listeners
 function initializeEventListeners() {
     // Modal controls
@@ -133,6 +190,8 @@ function initializeEventListeners() {
     document.getElementById('bookingForm').addEventListener('submit', handleBooking);
     document.getElementById('addMachineForm').addEventListener('submit', handleAddMachine);
 
+    document.getElementById('hostelSelect').addEventListener('change', handleHostelChange);
+
     // Logout buttons
     document.getElementById('logoutBtn').addEventListener('click', handleLogout);
     document.getElementById('adminLogoutBtn').addEventListener('click', handleLogout);
@@ -141,6 +200,10 @@ function initializeEventListeners() {
     const now = new Date();
     now.setMinutes(now.getMinutes() - now.getTimezoneOffset());
     document.getElementById('startTime').min = now.toISOString().slice(0, 16);
+
+    // Mark machines that are already booked for the chosen slot
+    document.getElementById('startTime').addEventListener('change', populateMachineSelect);
+    document.getElementById('duration').addEventListener('change', populateMachineSelect);
 }
 
 // Modal functions
@@ -164,7 +227,7 @@ async function handleLogin(e) {
     };
 
     try {
-        const response = await fetch(`${API_BASE}/login`, {
+        const response = await apiFetch(`/login`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -205,7 +268,7 @@ async function handleRegister(e) {
     };
 
     try {
-        const response = await fetch(`${API_BASE}/register`, {
+        const response = await apiFetch(`/register`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -237,7 +300,7 @@ async function handleAdminLogin(e) {
     };
 
     try {
-        const response = await fetch(`${API_BASE}/admin/login`, {
+        const response = await apiFetch(`/admin/login`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -269,6 +332,7 @@ function handleLogout() {
     isAdmin = false;
     localStorage.removeItem('currentUser');
     localStorage.removeItem('isAdmin');
+    stopLiveUpdates();
     showWelcomeSection();
     showMessage('Logged out successfully!', 'info');
 }
@@ -304,6 +368,8 @@ function showUserDashboard() {
     document.getElementById('userName').textContent = currentUser.username;
     loadUserBookings();
     populateMachineSelect();
+    loadAvailability();
+    startLiveUpdates();
 }
 
 function showAdminDashboard() {
@@ -312,13 +378,15 @@ function showAdminDashboard() {
     adminDashboard.style.display = 'block';
     
     loadAdminMachines();
+    allBookingsLoaded = 0;
     loadAllBookings();
+    startLiveUpdates();
 }
 
 // Machine functions
 async function loadMachines() {
     try {
-        const response = await fetch(`${API_BASE}/machines`);
+        const response = await apiFetch(`/machines`);
         const result = await response.json();
         
         if (response.ok) {
@@ -346,10 +414,7 @@ function displayMachines() {
 
     machineList.innerHTML = '';
     
-    // Limit to only 8 machines
-    const limitedMachines = machines.slice(0, 8);
-    
-    limitedMachines.forEach(machine => {
+    machines.forEach(machine => {
         const machineCard = document.createElement('div');
         machineCard.className = `machine-card ${machine.status}`;
         machineCard.innerHTML = `
@@ -374,16 +439,96 @@ function populateMachineSelect() {
     const machineSelect = document.getElementById('machineSelect');
     if (!machineSelect) return;
 
-    machineSelect.innerHTML = '<option value="">Choose a machine</option>';
+    const selected = machineSelect.value;
+    const slot = selectedBookingSlot();
+    machineSelect.innerHTML = '<option value="">Choose a machine</option>' +
+        '<option value="any">Any free machine</option>';
     
-    // Limit to only 8 machines and filter available ones
-    const limitedMachines = machines.slice(0, 8);
-    limitedMachines.filter(machine => machine.status === 'available').forEach(machine => {
+    machines.filter(machine => machine.status === 'available').forEach(machine => {
         const option = document.createElement('option');
         option.value = machine.id;
         option.textContent = machine.machine_name;
+        if (slot && !isMachineFree(machine.id, slot.start, slot.end)) {
+            option.textContent += ' (booked at this time)';
+        }
         machineSelect.appendChild(option);
     });
+    machineSelect.value = selected;
+}
+
+// Availability grid: one request covers every machine for the next 10 days
+async function loadAvailability() {
+    try {
+        // Align to the slot size so slots line up with bookings
+        const slotMinutes = 30;
+        const from = new Date();
+        from.setMinutes(from.getMinutes() < slotMinutes ? 0 : slotMinutes, 0, 0);
+        const to = new Date(from.getTime() + 10 * 24 * 60 * 60 * 1000);
+        // The grid carries an ETag, so the browser revalidates it and an
+        // unchanged grid comes back as 304 without a body
+        const response = await apiFetch(`/availability?from=${encodeURIComponent(from.toISOString())}&to=${encodeURIComponent(to.toISOString())}&slot=${slotMinutes}`);
+        
+        if (response.ok) {
+            availability = await response.json();
+            populateMachineSelect();
+        }
+    } catch (error) {
+        console.error('Error loading availability:', error);
+    }
+}
+
+function selectedBookingSlot() {
+    const startInput = document.getElementById('startTime');
+    const durationInput = document.getElementById('duration');
+    if (!startInput || !startInput.value || !durationInput) return null;
+
+    const start = new Date(startInput.value).getTime();
+    const end = start + parseFloat(durationInput.value) * 60 * 60 * 1000;
+    return { start, end };
+}
+
+// Apply a booking event to the local grid; returns false when only a refetch
+// can tell, as when a freed booking shares a slot with a neighbouring one
+function updateAvailability(machineId, startTime, endTime, busy) {
+    if (!availability || !startTime || !endTime) return false;
+    const machine = availability.machines.find(m => m.id === machineId);
+    if (!machine) return false;
+
+    const grid = Uint8Array.from(atob(machine.busy), c => c.charCodeAt(0));
+    const from = new Date(availability.from).getTime();
+    const slotMs = availability.slot_minutes * 60 * 1000;
+    const start = (new Date(startTime).getTime() - from) / slotMs;
+    const end = (new Date(endTime).getTime() - from) / slotMs;
+    // A new booking takes every slot it touches; a cancelled one frees only
+    // the slots it covers whole
+    const first = Math.max(0, busy ? Math.floor(start) : Math.ceil(start));
+    const last = Math.min(availability.slots, busy ? Math.ceil(end) : Math.floor(end));
+    for (let i = first; i < last; i++) {
+        if (busy) {
+            grid[i >> 3] |= 1 << (i & 7);
+        } else {
+            grid[i >> 3] &= ~(1 << (i & 7));
+        }
+    }
+    machine.busy = btoa(String.fromCharCode(...grid));
+    return busy || (Number.isInteger(start) && Number.isInteger(end));
+}
+
+function isMachineFree(machineId, start, end) {
+    if (!availability) return true;
+    const machine = availability.machines.find(m => m.id === machineId);
+    if (!machine) return true;
+
+    // Bit i of the bitmap (LSB first within each byte) marks slot i busy
+    const busy = atob(machine.busy);
+    const from = new Date(availability.from).getTime();
+    const slotMs = availability.slot_minutes * 60 * 1000;
+    const first = Math.max(0, Math.floor((start - from) / slotMs));
+    const last = Math.min(availability.slots, Math.ceil((end - from) / slotMs));
+    for (let i = first; i < last; i++) {
+        if (busy.charCodeAt(i >> 3) & (1 << (i & 7))) return false;
+    }
+    return true;
 }
 
 // Booking functions
@@ -396,25 +541,37 @@ async function handleBooking(e) {
     const endTime = new Date(startTime.getTime() + duration * 60 * 60 * 1000);
     
     const bookingData = {
-        machine_id: parseInt(formData.get('machineId')),
+        // "any" lets the server pick a machine that is free for the slot
+        machine_id: formData.get('machineId') === 'any' ? 'any' : parseInt(formData.get('machineId')),
         start_time: startTime.toISOString(),
         end_time: endTime.toISOString()
     };
+    const body = JSON.stringify(bookingData);
+    if (!pendingBooking || pendingBooking.body !== body) {
+        pendingBooking = { body, key: newIdempotencyKey() };
+    }
 
     try {
-        const response = await fetch(`${API_BASE}/bookings`, {
+        const response = await apiFetch(`/bookings`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
-                'Authorization': `Bearer ${currentUser.id}`
+                'Authorization': `Bearer ${currentUser.id}`,
+                'Idempotency-Key': pendingBooking.key
             },
-            body: JSON.stringify(bookingData)
+            body
         });
 
         const result = await response.json();
+        // Overload and server errors were not stored; anything else is final
+        if (response.status !== 429 && response.status < 500) {
+            pendingBooking = null;
+        }
         
         if (response.ok) {
-            showMessage('Booking created successfully!', 'success');
+            showMessage(bookingData.machine_id === 'any'
+                ? `Booking created successfully on ${result.machine_name}!`
+                : 'Booking created successfully!', 'success');
             loadUserBookings();
             loadMachines();
             e.target.reset();
@@ -427,11 +584,18 @@ async function handleBooking(e) {
     }
 }
 
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
 async function loadUserBookings() {
     if (!currentUser) return;
 
     try {
-        const response = await fetch(`${API_BASE}/bookings/user/${currentUser.id}`);
+        const response = await apiFetch(`/bookings/user/${currentUser.id}`);
         const result = await response.json();
         
         if (response.ok) {
@@ -495,7 +659,7 @@ async function cancelBooking(bookingId) {
     if (!confirm('Are you sure you want to cancel this booking?')) return;
 
     try {
-        const response = await fetch(`${API_BASE}/bookings/${bookingId}`, {
+        const response = await apiFetch(`/bookings/${bookingId}`, {
             method: 'DELETE',
             headers: {
                 'Authorization': `Bearer ${currentUser.id}`
@@ -520,7 +684,7 @@ async function cancelBooking(bookingId) {
 // Admin functions
 async function loadAdminMachines() {
     try {
-        const response = await fetch(`${API_BASE}/admin/machines`);
+        const response = await apiFetch(`/admin/machines`);
         const result = await response.json();
         
         if (response.ok) {
@@ -541,10 +705,7 @@ function displayAdminMachines(adminMachines) {
 
     adminMachineList.innerHTML = '';
     
-    // Limit to only 8 machines for admin portal
-    const limitedMachines = adminMachines.slice(0, 8);
-    
-    limitedMachines.forEach(machine => {
+    adminMachines.forEach(machine => {
         const machineCard = document.createElement('div');
         machineCard.className = 'admin-machine-card';
         machineCard.innerHTML = `
@@ -572,7 +733,7 @@ function displayAdminMachines(adminMachines) {
 
 async function updateMachineStatus(machineId, status) {
     try {
-        const response = await fetch(`${API_BASE}/admin/machines/${machineId}/status`, {
+        const response = await apiFetch(`/admin/machines/${machineId}/status`, {
             method: 'PUT',
             headers: {
                 'Content-Type': 'application/json',
@@ -605,7 +766,7 @@ async function handleAddMachine(e) {
     };
 
     try {
-        const response = await fetch(`${API_BASE}/admin/machines`, {
+        const response = await apiFetch(`/admin/machines`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -630,16 +791,41 @@ async function handleAddMachine(e) {
     }
 }
 
-async function loadAllBookings() {
+// Admin bookings are fetched a page at a time, newest first, in the compact
+// columnar format (column names once, then one value array per booking)
+const ADMIN_BOOKINGS_PAGE_SIZE = 100;
+const COLUMNAR_JSON = 'application/vnd.washing-machine.columnar+json';
+
+function rowsToObjects(result) {
+    return result.rows.map(row => Object.fromEntries(result.columns.map((column, i) => [column, row[i]])));
+}
+
+async function loadAllBookings(loadMore = false) {
     try {
-        const response = await fetch(`${API_BASE}/admin/bookings`);
-        const result = await response.json();
+        // A reload fetches as many rows as are shown, so pages loaded with
+        // "Load more" stay when a live update refreshes the list
+        const wanted = loadMore ? 1 : allBookingsLoaded;
+        let cursor = loadMore ? allBookingsCursor : null;
+        const rows = [];
+        do {
+            let url = `/admin/bookings?limit=${ADMIN_BOOKINGS_PAGE_SIZE}`;
+            if (cursor) {
+                url += `&cursor=${encodeURIComponent(cursor)}`;
+            }
+            const response = await apiFetch(url, { headers: { 'Accept': COLUMNAR_JSON } });
+            const result = await response.json();
+            
+            if (!response.ok) {
+                console.error('Failed to load all bookings:', result.message);
+                return;
+            }
+            rows.push(...(result.rows ? rowsToObjects(result) : result.bookings));
+            cursor = result.next_cursor;
+        } while (cursor && rows.length < wanted);
         
-        if (response.ok) {
-            displayAllBookings(result.bookings);
-        } else {
-            console.error('Failed to load all bookings:', result.message);
-        }
+        allBookingsCursor = cursor;
+        allBookingsLoaded = loadMore ? allBookingsLoaded + rows.length : rows.length;
+        displayAllBookings(rows, loadMore);
     } catch (error) {
         console.error('Error loading all bookings:', error);
         // Show demo data if API is not available
@@ -657,20 +843,26 @@ async function loadAllBookings() {
     }
 }
 
-function displayAllBookings(allBookings) {
+function displayAllBookings(allBookings, append = false) {
     const allBookingsContainer = document.getElementById('allBookings');
     if (!allBookingsContainer) return;
 
-    if (allBookings.length === 0) {
+    if (!append && allBookings.length === 0) {
         allBookingsContainer.innerHTML = '<p>No bookings found.</p>';
         return;
     }
 
-    allBookingsContainer.innerHTML = '';
+    if (append) {
+        const loadMoreBtn = document.getElementById('loadMoreBookingsBtn');
+        if (loadMoreBtn) loadMoreBtn.remove();
+    } else {
+        allBookingsContainer.innerHTML = '';
+    }
     
     allBookings.forEach(booking => {
         const bookingCard = document.createElement('div');
         bookingCard.className = 'booking-card';
+        bookingCard.dataset.bookingId = booking.id;
         bookingCard.innerHTML = `
             <div class="booking-info">
                 <div>
@@ -691,6 +883,15 @@ function displayAllBookings(allBookings) {
         `;
         allBookingsContainer.appendChild(bookingCard);
     });
+
+    if (allBookingsCursor) {
+        const loadMoreBtn = document.createElement('button');
+        loadMoreBtn.id = 'loadMoreBookingsBtn';
+        loadMoreBtn.className = 'btn-secondary btn-small';
+        loadMoreBtn.textContent = 'Load more';
+        loadMoreBtn.addEventListener('click', () => loadAllBookings(true));
+        allBookingsContainer.appendChild(loadMoreBtn);
+    }
 }
 
 // Utility functions
@@ -714,8 +915,123 @@ function showMessage(message, type = 'info') {
     }, 5000);
 }
 
-// Refresh data periodically
-setInterval(() => {
+// Refetches triggered by live updates are coalesced and spread over a few
+// seconds, so one booking does not send every open dashboard to the server
+// at the same moment
+const LIVE_REFRESH_MIN_MS = 2000;
+const LIVE_REFRESH_MAX_MS = 10000;
+const liveRefreshTimers = {};
+
+function scheduleLiveRefresh(name, load) {
+    if (liveRefreshTimers[name]) return;
+    const delay = LIVE_REFRESH_MIN_MS + Math.random() * (LIVE_REFRESH_MAX_MS - LIVE_REFRESH_MIN_MS);
+    liveRefreshTimers[name] = setTimeout(() => {
+        delete liveRefreshTimers[name];
+        load();
+    }, delay);
+}
+
+// Show a cancellation in the admin list without reloading it
+function markBookingCancelled(bookingId) {
+    const card = document.querySelector(`#allBookings .booking-card[data-booking-id="${bookingId}"]`);
+    const status = card && card.querySelector('.booking-status');
+    if (status) {
+        status.className = 'booking-status status-cancelled';
+        status.textContent = 'CANCELLED';
+    }
+}
+
+// Live updates pushed by the server over Server-Sent Events
+function startLiveUpdates() {
+    if (eventSource || typeof EventSource === 'undefined') return;
+
+    // EventSource reconnects on its own and resends Last-Event-ID,
+    // so missed changes are replayed after a dropped connection
+    // EventSource cannot send headers, so the hostel goes in the query string
+    const hostelParam = currentHostel ? `?hostel=${encodeURIComponent(currentHostel)}` : '';
+    eventSource = new EventSource(`${API_BASE}/events${hostelParam}`);
+    eventSource.onopen = () => { liveUpdatesConnected = true; };
+    eventSource.onerror = () => { liveUpdatesConnected = false; };
+
+    eventSource.addEventListener('machine_status', (e) => {
+        const change = JSON.parse(e.data);
+        const machine = machines.find(m => m.id === change.machine_id);
+        if (machine) {
+            machine.status = change.status;
+            displayMachines();
+            populateMachineSelect();
+        } else {
+            loadMachines();
+        }
+        if (isAdmin) loadAdminMachines();
+    });
+    ['machine_added', 'machines_added', 'machines_removed'].forEach(type => {
+        eventSource.addEventListener(type, () => {
+            loadMachines();
+            if (isAdmin) loadAdminMachines();
+        });
+    });
+    // A batch status change, possibly cancelling or moving bookings off broken machines
+    eventSource.addEventListener('machines_updated', (e) => {
+        const change = JSON.parse(e.data);
+        loadMachines();
+        if (isAdmin) {
+            loadAdminMachines();
+            scheduleLiveRefresh('allBookings', loadAllBookings);
+        } else {
+            scheduleLiveRefresh('availability', loadAvailability);
+            const affected = change.cancelled.concat(change.reassigned);
+            if (currentUser && affected.some(b => b.user_id === currentUser.id)) {
+                loadUserBookings();
+            }
+        }
+    });
+    // Bookings update the local grid and list from the event itself; only
+    // what the event cannot tell is refetched, after a random delay
+    eventSource.addEventListener('booking_created', (e) => {
+        const change = JSON.parse(e.data);
+        if (isAdmin) {
+            // The row needs the student's name, which the event does not carry
+            scheduleLiveRefresh('allBookings', loadAllBookings);
+            return;
+        }
+        if (updateAvailability(change.machine_id, change.start_time, change.end_time, true)) {
+            populateMachineSelect();
+        } else {
+            scheduleLiveRefresh('availability', loadAvailability);
+        }
+        if (currentUser && change.user_id === currentUser.id) {
+            loadUserBookings();
+        }
+    });
+    eventSource.addEventListener('booking_cancelled', (e) => {
+        const change = JSON.parse(e.data);
+        if (isAdmin) {
+            markBookingCancelled(change.booking_id);
+            return;
+        }
+        const exact = updateAvailability(change.machine_id, change.start_time, change.end_time, false);
+        populateMachineSelect();
+        if (!exact) {
+            scheduleLiveRefresh('availability', loadAvailability);
+        }
+        if (currentUser && change.user_id === currentUser.id) {
+            loadUserBookings();
+        }
+    });
+    eventSource.addEventListener('bookings_completed', refreshAll);
+    eventSource.addEventListener('reset', refreshAll);
+}
+
+function stopLiveUpdates() {
+    if (eventSource) {
+        eventSource.close();
+        eventSource = null;
+    }
+    liveUpdatesConnected = false;
+}
+
+function refreshAll() {
     if (currentUser) {
         loadMachines();
         if (isAdmin) {
@@ -725,12 +1041,19 @@ setInterval(() => {
             loadUserBookings();
         }
     }
+}
+
+// Fall back to polling while the live update stream is unavailable
+setInterval(() => {
+    if (!liveUpdatesConnected) {
+        refreshAll();
+    }
 }, 30000); // Refresh every 30 seconds
 
 
 async function showMachineBookings(machineId, machineName) {
     try {
-        const response = await fetch(`${API_BASE}/machines/${machineId}/bookings`);
+        const response = await apiFetch(`/machines/${machineId}/bookings`);
         const result = await response.json();
         
         if (response.ok) {
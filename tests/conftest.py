@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+# Every test runs on its own database (see `app_module`); rate limits are
+# off unless a test switches them on
+os.environ['ADMISSION_ENABLED'] = '0'
+os.environ['DATABASE'] = os.path.join(tempfile.gettempdir(), 'washing-machine-tests.db')
+
+import app as booking_app
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    """The app module on a fresh, migrated database, without background threads"""
+    database = str(tmp_path / 'test.db')
+    monkeypatch.setattr(booking_app, 'DATABASE', database)
+    monkeypatch.setattr(booking_app, '_databases_ready', False)
+    monkeypatch.setattr(booking_app.email_worker, 'ensure_started', lambda: None)
+    monkeypatch.setattr(booking_app.lifecycle_worker, 'ensure_started', lambda: None)
+    booking_app.ensure_schema(database)
+    yield booking_app
+    booking_app.read_models.pop(database, None)
+    booking_app.get_pool(database).close_all()
+
+
+@pytest.fixture
+def db(app_module):
+    """A pooled connection to the test database"""
+    pool = app_module.get_pool(app_module.DATABASE)
+    conn = pool.acquire()
+    yield conn
+    pool.release(conn)
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
@@ -0,0 +1,64 @@
+"""Admission control: per-client rate limits and failing open"""
+import sqlite3
+
+import pytest
+
+
+def book(client, day, forwarded_for=None):
+    headers = {'Authorization': 'Bearer 2'}
+    if forwarded_for:
+        headers['X-Forwarded-For'] = forwarded_for
+    return client.post('/api/bookings', headers=headers, json={
+        'machine_id': 1,
+        'start_time': f'2030-01-{day:02d}T10:00:00.000Z',
+        'end_time': f'2030-01-{day:02d}T11:00:00.000Z',
+    })
+
+
+@pytest.fixture
+def admission(app_module, monkeypatch):
+    """Admission control on, with room for two bookings per address"""
+    monkeypatch.setattr(app_module, 'ADMISSION_ENABLED', True)
+    monkeypatch.setitem(app_module.RATE_LIMITS, 'booking_ip', (0.0001, 2))
+    monkeypatch.setitem(app_module.RATE_LIMITS, 'booking_user', (0.0001, 100))
+
+
+def buckets(app_module):
+    pool = app_module.get_pool(app_module.DATABASE + '.admission')
+    db = pool.acquire()
+    try:
+        return [row[0] for row in db.execute('SELECT key FROM token_buckets')]
+    finally:
+        pool.release(db)
+
+
+def test_forwarded_for_does_not_reset_the_limit(admission, client):
+    statuses = [book(client, day, forwarded_for=f'10.0.0.{day}').status_code for day in range(1, 5)]
+    assert statuses == [201, 201, 429, 429]
+
+
+def test_idle_buckets_are_pruned(admission, app_module, client):
+    book(client, 1)
+    assert 'booking:ip:127.0.0.1' in buckets(app_module)
+
+    app_module.admission.prune_buckets(app_module.DATABASE)
+    assert 'booking:ip:127.0.0.1' in buckets(app_module)
+
+    app_module.admission.prune_buckets(app_module.DATABASE, now=app_module.time.time() + 10 ** 9)
+    assert buckets(app_module) == []
+
+
+@pytest.mark.parametrize('queue_writes', [False, True])
+def test_view_error_is_not_retried(admission, app_module, queue_writes):
+    calls = []
+
+    @app_module.admission_control('booking', queue_writes=queue_writes)
+    def view():
+        calls.append(1)
+        raise sqlite3.OperationalError('database is locked')
+
+    with app_module.app.test_request_context('/api/bookings', method='POST',
+                                             environ_base={'REMOTE_ADDR': '127.0.0.1'}):
+        with pytest.raises(sqlite3.OperationalError):
+            view()
+    assert calls == [1]
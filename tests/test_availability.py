@@ -0,0 +1,36 @@
+"""Availability grid (/api/availability) caching"""
+import base64
+
+GRID = '/api/availability?from=2030-01-01T00:00:00.000Z&to=2030-01-02T00:00:00.000Z&slot=30'
+
+
+def book(client, start='2030-01-01T10:00:00.000Z', end='2030-01-01T11:00:00.000Z'):
+    return client.post('/api/bookings', json={'machine_id': 1, 'start_time': start, 'end_time': end},
+                       headers={'Authorization': 'Bearer 2'})
+
+
+def test_unchanged_grid_is_not_modified(client):
+    first = client.get(GRID)
+    assert first.status_code == 200 and first.headers['ETag']
+
+    again = client.get(GRID, headers={'If-None-Match': first.headers['ETag']})
+    assert (again.status_code, again.data) == (304, b'')
+
+
+def test_booking_changes_the_grid(client):
+    before = client.get(GRID)
+    assert book(client).status_code == 201
+
+    after = client.get(GRID, headers={'If-None-Match': before.headers['ETag']})
+    assert after.status_code == 200
+    machine = next(m for m in after.get_json()['machines'] if m['id'] == 1)
+    grid = base64.b64decode(machine['busy'])
+    busy = [i for i in range(48) if grid[i >> 3] & 1 << (i & 7)]
+    assert busy == [20, 21]
+
+
+def test_other_range_is_another_snapshot(client):
+    first = client.get(GRID)
+    other = client.get(GRID.replace('slot=30', 'slot=60'))
+    assert other.headers['ETag'] != first.headers['ETag']
+    assert other.get_json()['slots'] == 24
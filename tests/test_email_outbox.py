@@ -0,0 +1,120 @@
+"""Email outbox delivery against the local SMTP stand-in"""
+import time
+
+import pytest
+
+from standins import SMTPStandIn
+
+
+@pytest.fixture
+def smtp(app_module, monkeypatch):
+    server = SMTPStandIn().start()
+    monkeypatch.setattr(app_module, 'EMAIL_HOST', '127.0.0.1')
+    monkeypatch.setattr(app_module, 'EMAIL_PORT', server.port)
+    monkeypatch.setattr(app_module, 'EMAIL_USE_TLS', False)
+    monkeypatch.setattr(app_module, 'EMAIL_PASSWORD', '')
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def session(app_module):
+    session = app_module.SMTPSession()
+    yield session
+    session.close()
+
+
+def queue(app_module, db, *addresses):
+    for address in addresses:
+        app_module.queue_email(db, address, 'Booking', '<p>Booked</p>')
+    db.commit()
+
+
+def outbox(db):
+    return db.execute('SELECT * FROM email_outbox ORDER BY id').fetchall()
+
+
+def make_due(db):
+    """Move every retry and lease into the past"""
+    db.execute("UPDATE email_outbox SET next_attempt_at = 0 WHERE status IN ('pending', 'sending')")
+    db.commit()
+
+
+def test_batch_goes_over_one_session(app_module, db, smtp, session):
+    queue(app_module, db, *[f'student{i}@example.com' for i in range(5)])
+
+    assert app_module.drain_email_outbox(session, app_module.DATABASE) == 5
+    assert smtp.messages == 5
+    assert smtp.sessions == 1
+    assert [(row['status'], row['attempts']) for row in outbox(db)] == [('sent', 1)] * 5
+
+
+def test_failure_is_retried_with_backoff(app_module, db, smtp, session):
+    queue(app_module, db, 'student@example.com')
+    smtp.failures = 2
+
+    before = time.time()
+    assert app_module.drain_email_outbox(session, app_module.DATABASE) == 0
+    job = outbox(db)[0]
+    assert (job['status'], job['attempts']) == ('pending', 1)
+    assert '451' in job['last_error']
+    assert job['next_attempt_at'] >= before + app_module.EMAIL_RETRY_BASE_SECONDS
+
+    # Not due yet
+    assert app_module.drain_email_outbox(session, app_module.DATABASE) == 0
+    assert outbox(db)[0]['attempts'] == 1
+
+    # The second failure waits twice as long
+    make_due(db)
+    before = time.time()
+    assert app_module.drain_email_outbox(session, app_module.DATABASE) == 0
+    job = outbox(db)[0]
+    assert (job['status'], job['attempts']) == ('pending', 2)
+    assert job['next_attempt_at'] >= before + 2 * app_module.EMAIL_RETRY_BASE_SECONDS
+
+    make_due(db)
+    assert app_module.drain_email_outbox(session, app_module.DATABASE) == 1
+    assert (outbox(db)[0]['status'], smtp.messages) == ('sent', 1)
+
+
+def test_gives_up_after_max_attempts(app_module, db, smtp, session, monkeypatch):
+    monkeypatch.setattr(app_module, 'EMAIL_MAX_ATTEMPTS', 3)
+    queue(app_module, db, 'student@example.com')
+    smtp.failures = 10
+
+    for attempt in range(3):
+        make_due(db)
+        app_module.drain_email_outbox(session, app_module.DATABASE)
+    job = outbox(db)[0]
+    assert (job['status'], job['attempts']) == ('dead', 3)
+
+    make_due(db)
+    assert app_module.claim_email_jobs(db) == []
+
+
+def test_refused_recipient_is_dead_at_once(app_module, db, smtp, session):
+    smtp.refused.add('nobody@example.com')
+    queue(app_module, db, 'nobody@example.com', 'student@example.com')
+
+    assert app_module.drain_email_outbox(session, app_module.DATABASE) == 1
+    refused, delivered = outbox(db)
+    assert (refused['status'], refused['attempts']) == ('dead', 1)
+    assert delivered['status'] == 'sent'
+
+
+def test_unfinished_lease_is_reclaimed(app_module, db, smtp, session):
+    queue(app_module, db, 'student@example.com')
+
+    # A worker claims the job and dies before finishing it
+    assert len(app_module.claim_email_jobs(db)) == 1
+    assert outbox(db)[0]['status'] == 'sending'
+
+    # Nobody else takes it while the lease runs
+    assert app_module.drain_email_outbox(session, app_module.DATABASE) == 0
+    assert smtp.messages == 0
+
+    make_due(db)
+    assert app_module.drain_email_outbox(session, app_module.DATABASE) == 1
+    job = outbox(db)[0]
+    assert (job['status'], job['attempts'], smtp.messages) == ('sent', 2, 1)
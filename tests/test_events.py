@@ -0,0 +1,49 @@
+"""Live update stream (/api/events) resume"""
+import itertools
+
+
+def publish(app_module, db, count):
+    for i in range(count):
+        with app_module.write_transaction(db):
+            app_module.publish_event(db, 'machine_status',
+                                     {'machine_id': 1, 'status': ('in_use', 'available')[i % 2]})
+
+
+def read_stream(client, last_event_id, until_id, max_chunks=20):
+    """Chunks of the stream until event `until_id` arrives (or `max_chunks`)"""
+    response = client.get('/api/events', headers={'Last-Event-ID': str(last_event_id)}, buffered=False)
+    chunks = []
+    try:
+        for chunk in itertools.islice(response.response, max_chunks):
+            chunk = chunk.decode()
+            chunks.append(chunk)
+            if f'id: {until_id}\n' in chunk:
+                break
+    finally:
+        response.close()
+    return chunks
+
+
+def event_ids(chunks):
+    return [int(line[4:]) for chunk in chunks for line in chunk.splitlines() if line.startswith('id: ')]
+
+
+def test_resume_on_fresh_broadcaster_replays_from_table(app_module, db, client):
+    publish(app_module, db, 5)
+    # As after a restart: this worker's broadcaster has nothing buffered
+    app_module._broadcasters.pop(app_module.DATABASE, None)
+
+    chunks = read_stream(client, 1, until_id=5)
+    assert event_ids(chunks) == [2, 3, 4, 5]
+    assert not any(chunk.startswith(':') for chunk in chunks)
+
+
+def test_resume_after_pruned_events_resets(app_module, db, client):
+    publish(app_module, db, 5)
+    db.execute('DELETE FROM change_events WHERE id <= 3')
+    db.commit()
+    app_module._broadcasters.pop(app_module.DATABASE, None)
+
+    chunks = read_stream(client, 1, until_id=5)
+    assert 'event: reset' in chunks[1]
+    assert event_ids(chunks) == [5]
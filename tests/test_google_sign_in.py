@@ -0,0 +1,79 @@
+"""Google ID token verification against the local certs stand-in"""
+import time
+
+import pytest
+
+from standins import GoogleCertsStandIn
+
+
+@pytest.fixture
+def certs(app_module, monkeypatch):
+    server = GoogleCertsStandIn(app_module.GOOGLE_CLIENT_ID).start()
+    monkeypatch.setattr(app_module, 'GOOGLE_CERTS_URL', server.url)
+    monkeypatch.setattr(app_module, 'google_request', app_module.CachedCertsRequest())
+    monkeypatch.setattr(app_module, '_verified_tokens', {})
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def verifications(monkeypatch):
+    """Number of full signature verifications"""
+    from google.oauth2 import id_token
+
+    calls = []
+    verify_token = id_token.verify_token
+
+    def counting(*args, **kwargs):
+        calls.append(1)
+        return verify_token(*args, **kwargs)
+
+    monkeypatch.setattr(id_token, 'verify_token', counting)
+    return calls
+
+
+def test_certs_fetched_once_within_max_age(client, certs):
+    for student in ('21ucs001', '21ucs002', '21ucs003'):
+        token = certs.make_id_token(f'{student}@lnmiit.ac.in')
+        assert client.post('/api/google-register', json={'token': token}).status_code == 201
+    assert certs.fetches == 1
+
+
+def test_certs_refetched_after_max_age(client, certs):
+    certs.max_age = 0
+    for student in ('21ucs001', '21ucs002'):
+        token = certs.make_id_token(f'{student}@lnmiit.ac.in')
+        assert client.post('/api/google-register', json={'token': token}).status_code == 201
+    assert certs.fetches == 2
+
+
+def test_login_then_register_verifies_once(client, certs, verifications):
+    token = certs.make_id_token('21ucs001@lnmiit.ac.in', name='Asha')
+
+    # The page tries to log in first and registers when the student is unknown
+    assert client.post('/api/google-login', json={'token': token}).status_code == 404
+    response = client.post('/api/google-register', json={'token': token})
+    assert response.status_code == 201
+    assert response.get_json()['user']['username'] == 'Asha'
+    assert client.post('/api/google-login', json={'token': token}).status_code == 200
+    assert len(verifications) == 1
+
+
+@pytest.mark.parametrize('claims', [
+    pytest.param({'iat': int(time.time()) - 7200, 'exp': int(time.time()) - 3600}, id='expired'),
+    pytest.param({'aud': 'someone-else.apps.googleusercontent.com'}, id='wrong-audience'),
+    pytest.param({'iss': 'https://accounts.example.com'}, id='wrong-issuer'),
+])
+def test_invalid_token_is_rejected(client, certs, claims):
+    token = certs.make_id_token('21ucs001@lnmiit.ac.in', **claims)
+    for endpoint in ('/api/google-login', '/api/google-register'):
+        response = client.post(endpoint, json={'token': token})
+        assert response.status_code == 401
+        assert response.get_json()['message'].startswith('Invalid token')
+
+
+def test_other_domain_is_rejected(client, certs):
+    token = certs.make_id_token('someone@gmail.com')
+    response = client.post('/api/google-register', json={'token': token})
+    assert (response.status_code, response.get_json()['message']) == (401, 'Unauthorized domain')
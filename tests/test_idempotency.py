@@ -0,0 +1,54 @@
+"""Idempotency-Key handling on booking writes"""
+import pytest
+
+
+def book(client, key, start='2030-01-01T10:00:00.000Z', end='2030-01-01T11:00:00.000Z'):
+    return client.post('/api/bookings', json={'machine_id': 1, 'start_time': start, 'end_time': end},
+                       headers={'Authorization': 'Bearer 2', 'Idempotency-Key': key})
+
+
+def stored_keys(db):
+    return db.execute('SELECT status FROM idempotency_keys').fetchall()
+
+
+@pytest.fixture
+def admission(app_module, monkeypatch):
+    """Admission control on, with room for one booking per student"""
+    monkeypatch.setattr(app_module, 'ADMISSION_ENABLED', True)
+    monkeypatch.setitem(app_module.RATE_LIMITS, 'booking_user', (0.0001, 1))
+
+
+def test_retry_is_replayed(client):
+    first = book(client, 'k1')
+    assert first.status_code == 201
+
+    retry = book(client, 'k1')
+    assert retry.status_code == 201
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json() == first.get_json()
+
+    assert book(client, 'k1', start='2030-01-02T10:00:00.000Z').status_code == 422
+
+
+def test_replay_is_answered_before_admission(admission, client):
+    assert book(client, 'k1').status_code == 201
+    # The student's bucket is empty now, but a retry still gets its answer
+    retry = book(client, 'k1')
+    assert (retry.status_code, retry.headers.get('Idempotent-Replayed')) == (201, 'true')
+
+
+def test_shed_request_does_not_claim_its_key(admission, client, db, app_module, monkeypatch):
+    assert book(client, 'k1').status_code == 201
+
+    claims = []
+    write_transaction = app_module.write_transaction
+
+    def counting(conn, *args, **kwargs):
+        if conn.database == app_module.DATABASE:
+            claims.append(1)
+        return write_transaction(conn, *args, **kwargs)
+
+    monkeypatch.setattr(app_module, 'write_transaction', counting)
+    assert book(client, 'k2', start='2030-01-02T10:00:00.000Z').status_code == 429
+    assert claims == []
+    assert len(stored_keys(db)) == 1
@@ -0,0 +1,28 @@
+"""In-process read model against the database"""
+
+
+def add_user(db, user_id, name):
+    db.execute("INSERT INTO users (id, student_id, username, password) VALUES (?, ?, ?, 'x')",
+               (user_id, f'21ucs{user_id:03d}', name))
+    db.commit()
+
+
+def test_user_added_after_a_miss_is_found(app_module, db):
+    model = app_module.read_model(db)
+    assert model._user(db, 50) is None
+
+    add_user(db, 50, 'Asha')
+    assert model._user(db, 50) == ('Asha', '21ucs050')
+
+
+def test_check_reports_a_stale_user(app_module, db):
+    add_user(db, 50, 'Asha')
+    model = app_module.read_model(db)
+    assert model._user(db, 50) == ('Asha', '21ucs050')
+    assert app_module.check_read_model(db) == []
+
+    db.execute("UPDATE users SET username = 'Asha K' WHERE id = 50")
+    db.commit()
+    assert app_module.check_read_model(db) == [
+        "user 50: model ('Asha', '21ucs050'), database ('Asha K', '21ucs050')"]
+    assert model._user(db, 50) == ('Asha K', '21ucs050')